@@ -1,20 +1,54 @@
 """``nastran.py`` defines NastranComponent.
   
 """
+import os
 import sys
+import time
+import subprocess
 from os import path
-from tempfile import mkdtemp, gettempdir
-from shutil import rmtree
+from glob import glob
+from tempfile import mkdtemp, mkstemp, gettempdir
+from shutil import rmtree, copyfile
+
+import numpy
 
 from openmdao.lib.components.external_code import ExternalCode
 
-from openmdao.lib.datatypes.api import Float, Int, Array, Str, Bool, List
+from openmdao.lib.datatypes.api import Float, Int, Array, Str, Bool, List, \
+     Enum
 
 from openmdao.util.filewrap import FileParser
 
 from nastran_replacer import NastranReplacer
-from nastran_maker import NastranMaker
-from nastran_parser import NastranParser
+from nastran_maker import NastranMaker, data_field
+from nastran_parser import NastranParser, fill_ids
+from nastran_patcher import TemplatePatcher
+from nastran_deck import BulkDeck, LONG, FREE_LONG
+from nastran_validator import DeckValidator
+from nastran_case_control import needed_requests, trim_case_control, \
+     load_case_subcases, request_for_header
+from nastran_util import bulk_data_bounds, linked_values, \
+     format_fields, parse_reals
+from nastran_license import LicenseSemaphore, license_failure
+from nastran_scheduler import NastranScheduler, estimate_deck_memory, \
+     affinity_prefix
+from nastran_scratch import ScratchPool
+from nastran_archive import RunArchive, DEFAULT_ARTIFACTS
+from nastran_fd import FiniteDifferenceBatch, fd_steps, written_steps, \
+     fd_jacobian, run_jobs
+from nastran_restart import RestartDatabase, template_key, \
+     sorted_echo_deck, parse_sorted_echo, delete_entries, restart_deck, \
+     changed_cards
+from nastran_superelement import superelement_map, \
+     superelement_partitions, changed_superelements, partial_case_control, \
+     RESIDUAL
+from nastran_matrix import read_matrices
+from nastran_history import read_history
+from nastran_results import derived_value, aggregate_rows
+from nastran_groups import template_properties, GroupIndex
+from nastran_sol200 import SOL200_FILENAME, DESVAR_BASE, DRESP_BASE, \
+     UNBOUNDED, field_position, displacement_response, design_cards, \
+     sol200_deck, parse_sensitivities
 
 class NastranComponent(ExternalCode):
     """All Nastran-capable components should be subclasses of NastranComponent.
@@ -52,6 +86,211 @@ class NastranComponent(ExternalCode):
     keep_last_iteration = Bool(True, iotype="in", desc="If I am \
     deleting temporary files, should I keep the last one?")
 
+    nastran_include_base = Bool(False, iotype="in", desc="Should the \
+                                bulk data that doesn't change be written \
+                                once and INCLUDEd in every run, instead \
+                                of writing the whole file every time?")
+
+    nastran_patch_template = Bool(False, iotype="in", desc="Should \
+                                  the input file be written by copying \
+                                  the unchanged parts of the memory \
+                                  mapped template and writing only the \
+                                  changed cards, instead of reading the \
+                                  whole template in as text?")
+
+    nastran_resident_deck = Bool(False, iotype="in", desc="Should \
+                                 the bulk data of the template be \
+                                 parsed once and kept between runs, so \
+                                 that only the cards that changed since \
+                                 the last run are written again? \
+                                 Implies nastran_patch_template.")
+
+    nastran_trim_output = Bool(False, iotype="in", desc="Should the \
+                               Case Control be rewritten to request only \
+                               the output that the outputs with a \
+                               nastran_header need, with ECHO = NONE?")
+
+    nastran_keep_requests = List(Str, iotype="in", desc="Output \
+                                 requests (DISPLACEMENT, STRESS, ...) \
+                                 that nastran_trim_output should leave \
+                                 alone, for outputs with a nastran_func.")
+
+    nastran_load_cases = List(iotype="in", desc="Load cases to run \
+                              as the subcases of one Nastran run. \
+                              Each is a dictionary of Case Control \
+                              entries, such as {'name': 'pullup', \
+                              'LOAD': 10, 'SPC': 2}. Empty runs the \
+                              subcases of the template.")
+
+    nastran_validate = Bool(False, iotype="in", desc="Should the \
+                            input file be checked for bad fields, \
+                            continuations, duplicate ids and missing \
+                            cards before Nastran is started on it?")
+
+    nastran_sensitivities = Bool(False, iotype="in", desc="Should \
+                                 the run be a SOL 200 design \
+                                 sensitivity analysis, so that the \
+                                 derivatives of the outputs with a \
+                                 nastran_dresp with respect to the \
+                                 property inputs come out of the same \
+                                 run? They are given by provideJ.")
+
+    nastran_fd_gradient = Bool(False, iotype="in", desc="Should \
+                               every run be followed by the runs of a \
+                               forward difference gradient of the \
+                               outputs with a nastran_header that are \
+                               Floats, with respect to the inputs that \
+                               set one field? It is given by provideJ.")
+
+    nastran_fd_step = Float(1.e-6, iotype="in", desc="Relative step \
+                            of nastran_fd_gradient. Values smaller \
+                            than 1 get it as an absolute step.")
+
+    nastran_fd_workers = Int(0, iotype="in", desc="How many of the \
+                             nastran_fd_gradient runs can run at the \
+                             same time. 0 means one per core.")
+
+    nastran_restart = Bool(False, iotype="in", desc="Should the \
+                           database of a baseline run be kept, and \
+                           every later run be a RESTART from it that \
+                           only has the cards that changed?")
+
+    nastran_restart_dir = Str("", iotype="in", desc="Directory in \
+                              which to keep the baseline databases of \
+                              nastran_restart. Defaults to a \
+                              nastran_restart directory in \
+                              output_tempdir_dir.")
+
+    nastran_superelements = Bool(False, iotype="in", desc="With \
+                                 nastran_restart, should only the \
+                                 superelements (BEGIN SUPER = n) whose \
+                                 cards changed, and the residual, have \
+                                 their matrices generated and reduced \
+                                 again?")
+
+    nastran_sparse_matrices = Bool(False, iotype="in", desc="Should \
+                                   the nastran_matrix outputs be \
+                                   scipy.sparse matrices instead of \
+                                   numpy arrays?")
+
+    nastran_history_memmap = Bool(False, iotype="in", desc="Should \
+                                  the nastran_history outputs be \
+                                  memory mapped .npy files in the run \
+                                  directory instead of arrays in \
+                                  memory?")
+
+    nastran_connected_only = Bool(False, iotype="in", desc="Should \
+                                  only the outputs that are connected \
+                                  (and those in nastran_outputs) be set \
+                                  after a run? The others keep their \
+                                  values.")
+
+    nastran_outputs = List(Str, iotype="in", desc="The outputs to set \
+                           after a run, such as the ones a driver \
+                           reads. If given, the others keep their \
+                           values. Empty sets all of them, unless \
+                           nastran_connected_only is set.")
+
+    archive_dir = Str("", iotype="in", desc="Directory in which to keep \
+                      compressed copies of selected runs. Empty turns \
+                      archiving off.")
+
+    archive_compression = Enum("gzip", ["gzip", "bz2", "lzma"],
+                               iotype="in", desc="How to compress the \
+                               archived runs.")
+
+    archive_artifacts = List(Str, value=DEFAULT_ARTIFACTS, iotype="in",
+                             desc="Files of a run directory to archive.")
+
+    archive_every = Int(0, iotype="in", desc="Archive every Nth \
+                        iteration. 0 turns it off.")
+
+    archive_best = Int(0, iotype="in", desc="Archive the N runs with the \
+                       best archive_objective. 0 turns it off.")
+
+    archive_objective = Str("", iotype="in", desc="Name of the output \
+                            variable that archive_best ranks runs by.")
+
+    archive_maximize = Bool(False, iotype="in", desc="Is a bigger \
+                            archive_objective better?")
+
+    archive_failed = Bool(True, iotype="in", desc="If archiving, should \
+                          runs that failed be archived?")
+
+    scratch_pool_size = Int(0, iotype="in", desc="Number of run \
+                            directories to create ahead of time and \
+                            recycle. Deleted run directories are then \
+                            cleaned in the background. 0 makes a new \
+                            directory for every run.")
+
+    scratch_pool_dir = Str("", iotype="in", desc="Directory in which \
+                           to put the pooled run directories (tmpfs or \
+                           a fast local disk). Defaults to \
+                           output_tempdir_dir.")
+
+    scratch_directory = Str("", iotype="in", desc="Directory for \
+                            Nastran's scratch files (sdirectory=). \
+                            Point it at the fastest local disk.")
+
+    license_tokens = Int(0, iotype="in", desc="Number of Nastran \
+                         licenses shared by every process using \
+                         license_lock_dir. 0 disables the limiter.")
+
+    license_lock_dir = Str(path.join(gettempdir(), "nastran_licenses"),
+                           iotype="in", desc="Directory holding the \
+                           license token lock files.")
+
+    license_retries = Int(3, iotype="in", desc="How many times a run \
+                          that failed to get a license is requeued.")
+
+    license_backoff = Float(30., iotype="in", units="s", desc="Seconds \
+                            to wait before the first requeue. The wait \
+                            doubles on every further requeue.")
+
+    nastran_smp = Int(0, iotype="in", desc="Number of SMP threads \
+                      Nastran should use (smp=). 0 leaves it to Nastran.")
+
+    nastran_mem = Int(0, iotype="in", units="MB", desc="Memory Nastran \
+                      should use (mem=), in MB. 0 leaves it to Nastran, \
+                      unless use_scheduler is set, in which case it is \
+                      estimated from the input deck.")
+
+    use_scheduler = Bool(False, iotype="in", desc="Should runs wait \
+                         until enough cores and memory are free on this \
+                         machine, and be pinned to the cores they got?")
+
+    scheduler_dir = Str(path.join(gettempdir(), "nastran_scheduler"),
+                        iotype="in", desc="Directory holding the state \
+                        shared by every scheduled run on this machine.")
+
+    scheduler_cores = Int(0, iotype="in", desc="Cores the scheduler may \
+                          hand out. 0 means all of them.")
+
+    scheduler_memory = Int(0, iotype="in", units="MB", desc="Memory the \
+                           scheduler may hand out, in MB. 0 means all \
+                           the physical memory.")
+
+    queue_wait_time = Float(0., iotype="out", units="s", desc="Time \
+                            spent waiting for cores, memory or a \
+                            license token, or backing off after a \
+                            license failure.")
+
+    run_time = Float(0., iotype="out", units="s", desc="Time spent \
+                     running Nastran.")
+
+    parse_time = Float(0., iotype="out", units="s", desc="Time spent \
+                       reading Nastran's output and parsing its \
+                       grids.")
+
+    extract_time = Float(0., iotype="out", units="s", desc="Time \
+                         spent setting the outputs from Nastran's \
+                         output.")
+
+    skipped_outputs = Int(0, iotype="out", desc="How many outputs \
+                          weren't set after the last run, because \
+                          of nastran_connected_only or \
+                          nastran_outputs.")
+
     def __init__(self, *args, **kwargs):
         super(NastranComponent, self).__init__(*args, **kwargs)
 
@@ -65,6 +304,82 @@ class NastranComponent(ExternalCode):
         self._seen_first_iteration = False
         self._last_seen_iteration = ""
 
+        # only made once scratch_pool_size is set, see _make_tmpdir
+        self._scratch_pool = None
+
+        # only made once archive_dir is set, see _archive_run
+        self._archive = None
+        self._archive_settings = None
+
+        # (key, filename) of the unchanged bulk data written for
+        # nastran_include_base
+        self._include_base = None
+
+        # the memory-mapped template for nastran_patch_template (a
+        # BulkDeck for nastran_resident_deck)
+        self._patcher = None
+        self._patcher_key = None
+        self._iteration = 0
+
+        # the DeckValidator of the resident deck, for nastran_validate
+        self._validator = None
+
+        # the template the input file is written from, and the (key,
+        # filename) of the copy made for nastran_trim_output and
+        # nastran_load_cases
+        self._template_path = None
+        self._derived = None
+
+        # for nastran_sensitivities: the names of the inputs and
+        # outputs that are differentiated, the {(name, id): layout} of
+        # the property cards of the template (and its key), and the
+        # sensitivities of the last run
+        self._design = None
+        self._layouts = None
+        self._sensitivities = {}
+
+        # the Jacobian of the last run, for nastran_fd_gradient
+        self._fd_jacobian = None
+
+        # for nastran_restart: (stat key, RestartDatabase, BulkDeck of
+        # the template, lines of the template up to BEGIN BULK,
+        # {(name, id): superelements}, superelements of the partitions
+        # in order), the index of the baseline's sorted bulk data echo
+        # and the values of the cards the baseline changed
+        self._restart = None
+        self._restart_index = None
+        self._restart_values = None
+
+        # the superelements the last nastran_superelements run
+        # processed again, None if it was all of them
+        self.submitted_superelements = None
+
+        # the matrices read for the nastran_matrix outputs of the last
+        # run, {matrix name: matrix}
+        self.matrices = {}
+
+        # the (steps, ids) of the nastran_history outputs of the last
+        # run, {"traitname": (steps, ids)}
+        self.histories = {}
+
+        # the gradients of the nastran_aggregate outputs of the last
+        # run with respect to the values of their rows, and the DRESP1
+        # ids of every output of the design model
+        self.aggregate_gradients = {}
+        self._dresps = {}
+
+        # the ids of the rows of the Array grid outputs of the last run
+        self.array_ids = {}
+
+        # where the rows of every grid output were in the last run that
+        # had them, {request: GridPlan}, so that they can be taken
+        # from the same places in the next runs
+        self._plans = {}
+
+        # (stat key, element ids, property ids, {groups: GroupIndex})
+        # of the template, for nastran_group_by
+        self._properties = None
+
 
     def execute(self):
         """Runs the NastranComponent.
@@ -104,6 +419,8 @@ class NastranComponent(ExternalCode):
         smart_replacements = {}
         output_variables = {}
         grid_outputs = {}
+        matrix_outputs = {}
+        history_outputs = {}
 
         for name, trait in self.traits().iteritems():
             if trait.iotype == "in":
@@ -117,9 +434,15 @@ class NastranComponent(ExternalCode):
                                          " is too long to be a variable")
                     input_variables[name] = trait
 
+                # an Array can set many fields, given as a list of
+                # (card, id, fieldnum) in nastran_targets, or move
+                # GRID points with a ShapeUpdate in nastran_shape
+                if trait.nastran_targets or trait.nastran_shape:
+                    smart_replacements[name] = trait
+
                 # it could also be a smart replacement, but we'll have
                 # to specify the card, id, and fieldnum
-                if trait.nastran_card and trait.nastran_id and trait.nastran_fieldnum:
+                elif trait.nastran_card and trait.nastran_id and trait.nastran_fieldnum:
                     smart_replacements[name] = trait
 
                 elif trait.nastran_card or trait.nastran_id or trait.nastran_fieldnum:
@@ -139,7 +462,22 @@ class NastranComponent(ExternalCode):
                 # this is the grid method of accessing. We have to
                 # specify a header, row, and attribute and
                 # the output variable will be set to that value
-                if trait.nastran_header and trait.nastran_constraints and trait.nastran_columns:
+                # an Array or a derived output (nastran_derived,
+                # nastran_reduce or nastran_allowable) can do without
+                # constraints
+                derived = trait.nastran_derived or trait.nastran_reduce or \
+                          trait.nastran_aggregate or trait.nastran_group_by or \
+                          trait.nastran_allowable is not None or \
+                          isinstance(trait.trait_type, Array)
+                if trait.nastran_aggregate and \
+                       trait.nastran_allowable is not None:
+                    raise RuntimeError("Output " + name + " is an " + \
+                                       "aggregate, so its allowable is " + \
+                                       "nastran_constraint_allowable, " + \
+                                       "not nastran_allowable (which " + \
+                                       "is a margin of safety)")
+                if trait.nastran_header and trait.nastran_columns and \
+                       (trait.nastran_constraints or derived):
                     grid_outputs[name] = trait
                 elif trait.nastran_header or trait.nastran_constraints or trait.nastran_columns:
                     raise RuntimeError("You specified at least one of " + \
@@ -148,40 +486,65 @@ class NastranComponent(ExternalCode):
                                     "did not specify all them. You " + \
                                     "most probably mistyped")
 
-        # let's do our work in a tmp dir
-        tmpdir = mkdtemp(dir = self.output_tempdir_dir)
-        tmppath = path.join(tmpdir, "input.bdf")
-        tmpfh = open(tmppath, "w")
+                # a matrix that Nastran wrote with OUTPUT4, or punched
+                # as DMIG cards
+                if trait.nastran_matrix:
+                    matrix_outputs[name] = trait
 
-        # raw nastran file supplied by user
-        fh = open(self.nastran_filename, "r")
+                # the whole time or frequency history of a table
+                if trait.nastran_history:
+                    history_outputs[name] = trait
 
-        # note: fh.readlines() won't work because it doesn't
-        # strip the newline at the end for you. So whatever,
-        # we'll just use split on newlines.
-        nastran_text = fh.read().split("\n")
-        fh.close()
+        if self.nastran_sensitivities and self.nastran_fd_gradient:
+            raise RuntimeError("Set only one of nastran_sensitivities " + \
+                               "and nastran_fd_gradient")
+        if self.nastran_sensitivities:
+            self._design = self._design_variables(smart_replacements,
+                                                  grid_outputs)
+        elif self.nastran_fd_gradient:
+            self._design = self._fd_variables(smart_replacements,
+                                              grid_outputs)
+
+        self._template_path = self._get_template(grid_outputs)
+
+        # let's do our work in a tmp dir
+        tmpdir = self._make_tmpdir()
+        tmppath = path.join(tmpdir, "input.bdf")
 
-        # replace the variables in the nastran text using Replacer
-        replacer = NastranReplacer(nastran_text)
         varname2value = {}
         for name, trait in input_variables.iteritems():
             varname2value[trait.nastran_var] = getattr(self, name)
-        replacer.replace(varname2value)
-        nastran_text = replacer.text
 
-        # use nastran maker to intelligently replace
-        # values in cards
-        maker = NastranMaker(nastran_text)
-        for name, trait in smart_replacements.iteritems():
-            value = getattr(self, name)
-            maker.set(trait.nastran_card,
-                      trait.nastran_id,
-                      trait.nastran_fieldnum, value)
-        self.nastran_maker_hook(maker)
-        maker.write_to_file(tmpfh, 10001)
+        if self.nastran_superelements and not self.nastran_restart:
+            raise RuntimeError("nastran_superelements needs " + \
+                               "nastran_restart")
+        if self.nastran_include_base and (self.nastran_patch_template or \
+                                          self.nastran_resident_deck):
+            raise RuntimeError("nastran_include_base can't be used " + \
+                               "with nastran_patch_template or " + \
+                               "nastran_resident_deck, which write " + \
+                               "the whole deck")
+        if self.nastran_restart:
+            if varname2value:
+                raise RuntimeError("nastran_restart can't be used " + \
+                                   "with nastran_var inputs")
+            if self.nastran_sensitivities or self.nastran_fd_gradient:
+                raise RuntimeError("nastran_restart can't be used " + \
+                                   "with nastran_sensitivities or " + \
+                                   "nastran_fd_gradient")
+            # the database has to be locked before we know whether
+            # this is the baseline run, so the input file is written by
+            # _run_restart
+        else:
+            self._write_input(tmppath, tmpdir, varname2value,
+                              smart_replacements)
 
-        tmpfh.close()
+        if self.nastran_sensitivities:
+            self._write_design_model(path.join(tmpdir, SOL200_FILENAME),
+                                     smart_replacements, grid_outputs)
+
+        if self.nastran_validate and not self.nastran_restart:
+            self._validate_deck(tmppath)
 
         # what is the new file called?
         self.output_filename = path.join(tmpdir, "input.out")
@@ -189,22 +552,85 @@ class NastranComponent(ExternalCode):
         # perhaps this should be logged, or something
         print self.output_filename
 
+        # the scheduler has to know how much memory the run will
+        # take, so if we weren't told, we guess from the deck
+        memory = self.nastran_mem
+        if self.use_scheduler and not memory:
+            memory = estimate_deck_memory(self._template_path \
+                                          if self.nastran_restart \
+                                          else tmppath)
+
         # Then we run the nastran file
-        if self.nastran_command == 'python':  # True when using fake_nastran.py
-            self.command = [self.nastran_command,
-                            self.nastran_command_args[0], tmppath]
-            self.command.extend(self.nastran_command_args[1:])
-        else:
-            self.command = [self.nastran_command, tmppath]
-            self.command.extend(self.nastran_command_args)
-        self.command.extend(["batch=no", "out=" + tmpdir, "dbs=" + tmpdir])
+        self.command = self._nastran_command(tmppath, tmpdir, memory)
+
+        # the outputs nothing asks for aren't set
+        wanted = self._wanted_outputs(grid_outputs)
+        extracted = []
+        skipped = set()
+        for outputs in (output_variables, grid_outputs, history_outputs,
+                        matrix_outputs):
+            if wanted is not None:
+                skipped.update(set(outputs) - wanted)
+                outputs = dict([(name, trait) for name, trait \
+                                in outputs.iteritems() if name in wanted])
+            extracted.append(outputs)
+        self.skipped_outputs = len(skipped)
+
+        self._iteration += 1
+        try:
+            # This calls ExternalCode's execute which will run
+            # the nastran command via subprocess
+            if self.nastran_restart:
+                self._run_restart(tmppath, tmpdir, memory,
+                                  smart_replacements)
+            else:
+                self._run_nastran(tmpdir, memory)
+
+            self._parse_output(extracted[0], extracted[1], extracted[2])
+            self._read_matrices(extracted[3])
+
+            if self.nastran_fd_gradient:
+                self._finite_differences(tmppath, memory,
+                                         smart_replacements, grid_outputs)
+        except Exception:
+            # keep the failed run around for the post mortem
+            exc_info = sys.exc_info()
+            self._archive_run(tmpdir, True)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self._archive_run(tmpdir, False)
+
+        # get rid of our tmp dir
+        tmpdir_to_delete = ""
+        if self.delete_tmp_files:
+            if self.keep_first_iteration:
+                if not self._seen_first_iteration:
+                    self._seen_first_iteration = True
+                else:
+                    if self.keep_last_iteration: # keep both
+                        tmpdir_to_delete = self._last_seen_iteration
+                        self._last_seen_iteration = tmpdir
+                    else: # just keep first
+                        tmpdir_to_delete = tmpdir
+            else:
+                if self.keep_last_iteration: # only keep last
+                    tmpdir_to_delete = self._last_seen_iteration
+                    self._last_seen_iteration = tmpdir
+                else: # don't keep anything
+                    tmpdir_to_delete = tmpdir
 
-        # This calls ExternalCode's execute which will run
-        # the nastran command via subprocess
-        super(NastranComponent, self).execute()
+            if tmpdir_to_delete:
+                self._remove_tmpdir(tmpdir_to_delete)
 
-        # And now we parse the output
+    def _parse_output(self, output_variables, grid_outputs,
+                      history_outputs=None):
+        """Parse Nastran's output and set the output variables.
 
+        output_variables, grid_outputs, history_outputs:
+        {"traitname" : trait}
+            The outputs that use ``nastran_func``, the ones that use
+            NastranParser and the ones that use ``nastran_history``.
+        """
+        start = time.time()
         filep = FileParser()
         filep.set_file(self.output_filename)
         filep.set_delimiters(" ")
@@ -218,6 +644,7 @@ class NastranComponent(ExternalCode):
                                    "correctly. If you want to see " +\
                                    "the output, check out " + \
                                    self.output_filename)
+        parse_time = time.time() - start
 
 
         for output_name, output_trait in output_variables.iteritems():
@@ -227,25 +654,41 @@ class NastranComponent(ExternalCode):
                     output_trait.nastran_func(filep))
 
 
-        # This is the grid parser.
+        if self.nastran_sensitivities:
+            self._sensitivities = parse_sensitivities(filep.data)
+
+        self.histories = {}
+        tmpdir = path.dirname(self.output_filename)
+        for name, trait in (history_outputs or {}).iteritems():
+            filename = None
+            if self.nastran_history_memmap:
+                filename = path.join(tmpdir, name + ".npy")
+            steps, ids, values = read_history(
+                filep.data, trait.nastran_history,
+                self._subcase_number(trait.nastran_subcase), filename)
+            self.histories[name] = (steps, ids)
+            setattr(self, name, values)
+
+        # This is the grid parser. If no output needs it, it parses
+        # the grids the first time it's used
         self.parser = NastranParser(filep.data)
-        self.parser.parse()
+        if grid_outputs or not (self.nastran_connected_only or \
+                                self.nastran_outputs):
+            parse_start = time.time()
+            self.parser.parse()
+            parse_time += time.time() - parse_start
 
+        self.aggregate_gradients = {}
+        self.array_ids = {}
         for name, trait in grid_outputs.iteritems():
-            header = trait.nastran_header
-            subcase = trait.nastran_subcase
-            constraints = trait.nastran_constraints
-            columns = trait.nastran_columns
-            result = self.parser.get(header, subcase, \
-                                     constraints, columns)
-
-            # nastran_{row,column} might be kinda silly
-            # in most cases, the user will probably just call
-            # self.parser.get on her own
-            nastran_row = trait.nastran_row
-            nastran_column = trait.nastran_column
-            row = nastran_row or 0
-            col = nastran_column or 0
+            if trait.nastran_aggregate:
+                value, self.aggregate_gradients[name] = \
+                       self._aggregate(self.parser, trait)
+            elif self._is_block(trait):
+                self.array_ids[name], value = \
+                                      self._array_value(self.parser, trait)
+            else:
+                value = self._grid_value(self.parser, trait)
 
             # Now we'll try to guess the conversion we should
             # perform by inspecting the type of trait that
@@ -258,41 +701,1080 @@ class NastranComponent(ExternalCode):
             elif isinstance(trait.trait_type, Int):
                 converter = lambda x: int(float(x))
                 type_understood_as = "int"
+            elif isinstance(trait.trait_type, Array) and \
+                     isinstance(value, numpy.ndarray):
+                # a block of the grid, or a derived value for every
+                # row, in the type of the array the output has
+                dtype = numpy.asarray(getattr(self, name)).dtype
+                if dtype.kind in "iu":
+                    converter = lambda x: numpy.asarray(x).astype(dtype)
+                else:
+                    converter = numpy.asarray
+                type_understood_as = "array"
             elif isinstance(trait.trait_type, Array):
-                # we aren't actually going to return the entire
-                # grid because you should use parser if you
-                # want to do that.
+                # a value reduced to one
                 converter = lambda x: [x]
                 type_understood_as = "array"
 
             try:
-                setattr(self, name, converter(result[row][col]))
+                setattr(self, name, converter(value))
             except ValueError, ve:
                 print >> sys.stderr, "Unable to convert string " + \
-                      result[row][col] +  " to " + type_understood_as
+                      value +  " to " + type_understood_as
                 raise
 
-        # get rid of our tmp dir
-        tmpdir_to_delete = ""
+        self.parse_time = parse_time
+        self.extract_time = time.time() - start - parse_time
+
+    def _read_matrices(self, matrix_outputs):
+        """Set the ``nastran_matrix`` outputs from the files of the run.
+
+        The matrix is looked for in ``nastran_matrix_file`` (relative
+        to the run directory) if the output gives one, otherwise in
+        every OUTPUT4 file (``*.op4``) and then the punch file. Every
+        file is read at most once.
+
+        matrix_outputs: {"traitname" : trait}
+        """
+        start = time.time()
+        tmpdir = path.dirname(self.output_filename)
+        found = {}
+        self.matrices = {}
+        for name, trait in matrix_outputs.iteritems():
+            if trait.nastran_matrix_file:
+                filenames = [path.join(tmpdir, trait.nastran_matrix_file)]
+            else:
+                filenames = sorted(glob(path.join(tmpdir, "*.op4"))) + \
+                            sorted(glob(path.join(tmpdir, "*.pch")))
+            for filename in filenames:
+                if filename not in found:
+                    if not path.exists(filename):
+                        continue
+                    found[filename] = read_matrices(
+                        filename, self.nastran_sparse_matrices)
+                if trait.nastran_matrix in found[filename]:
+                    matrix = found[filename][trait.nastran_matrix]
+                    break
+            else:
+                raise RuntimeError("Could not find matrix " + \
+                                   trait.nastran_matrix + " for " + \
+                                   name + " in " + \
+                                   (", ".join(filenames) or tmpdir))
+            self.matrices[trait.nastran_matrix] = matrix
+            setattr(self, name, matrix)
+        self.extract_time += time.time() - start
+
+    def _wanted_outputs(self, grid_outputs):
+        """The names of the outputs to set after a run, or None for all
+        of them: the ones in ``nastran_outputs``, the connected ones if
+        ``nastran_connected_only``, and the grid outputs the gradients
+        need."""
+        if not (self.nastran_connected_only or self.nastran_outputs):
+            return None
+        wanted = set(self.nastran_outputs)
+        if self.nastran_connected_only:
+            wanted.update(self.list_outputs(connected=True))
+        if self.nastran_fd_gradient:
+            # the Jacobian is worked out from their values
+            wanted.update(self._design[1])
+        if self.nastran_sensitivities:
+            wanted.update([name for name, trait in grid_outputs.iteritems() \
+                           if trait.nastran_aggregate])
+        return wanted
+
+    def _grid_value(self, parser, trait):
+        """The string NastranParser finds for the grid output
+        ``trait``."""
+        if trait.nastran_aggregate:
+            return self._aggregate(parser, trait)[0]
+        if trait.nastran_group_by:
+            return self._group_value(parser, trait)
+        if self._is_block(trait):
+            return self._array_value(parser, trait)[1]
+        result = self._grid_rows(parser, trait)
+
+        # every row, derived and perhaps reduced to one value
+        if trait.nastran_derived or trait.nastran_reduce or \
+               trait.nastran_allowable is not None:
+            return derived_value(result, trait.nastran_derived,
+                                 trait.nastran_reduce,
+                                 trait.nastran_allowable)
+
+        # nastran_{row,column} might be kinda silly
+        # in most cases, the user will probably just call
+        # self.parser.get on her own
+        nastran_row = trait.nastran_row
+        nastran_column = trait.nastran_column
+        row = nastran_row or 0
+        col = nastran_column or 0
+        return result[row][col]
+
+    def _is_block(self, trait):
+        """Does the grid output ``trait`` get a whole block of the
+        grid? Array outputs do, unless they are derived."""
+        return isinstance(trait.trait_type, Array) and \
+               not (trait.nastran_derived or trait.nastran_reduce or \
+                    trait.nastran_aggregate or trait.nastran_group_by or \
+                    trait.nastran_allowable is not None)
+
+    def _grid_rows(self, parser, trait, columns=None):
+        """The rows NastranParser finds for the grid output ``trait``,
+        with its ``nastran_columns`` or ``columns``.
+        ``nastran_subcase`` can be a list, and then the rows of every
+        subcase in it are put together."""
+        subcases = trait.nastran_subcase
+        if not isinstance(subcases, (list, tuple)):
+            subcases = [subcases]
+        constraints = trait.nastran_constraints or {}
+        # a range or an array of ids is for NastranParser.select
+        select = [value for value in constraints.itervalues() \
+                  if isinstance(value, slice) or \
+                  (not isinstance(value, basestring) and \
+                   hasattr(value, "__iter__"))]
+        rows = []
+        for subcase in subcases:
+            rows.extend(self._extract(parser, trait, subcase, constraints,
+                                      columns or trait.nastran_columns,
+                                      bool(select))[1].tolist())
+        return rows
+
+    def _array_value(self, parser, trait):
+        """The ids of the rows of the Array output ``trait`` (None if
+        the grid has no id column), and the whole block of its
+        ``nastran_columns`` as floats in the order of the ids: a 1-d
+        array for one column, 2-d for more."""
+        subcases = trait.nastran_subcase
+        if not isinstance(subcases, (list, tuple)):
+            subcases = [subcases]
+        ids = []
+        blocks = []
+        for subcase in subcases:
+            found, rows = self._extract(parser, trait, subcase,
+                                        trait.nastran_constraints or {},
+                                        trait.nastran_columns, True)
+            if found is not None:
+                ids.append(found)
+            values = parse_reals(rows.ravel()) if rows.size \
+                     else numpy.zeros(0)
+            blocks.append(values.reshape(rows.shape))
+        values = numpy.concatenate(blocks)
+        if values.shape[1] == 1:
+            values = values[:, 0]
+        return (numpy.concatenate(ids) if ids else None), values
+
+    def _extract(self, parser, trait, subcase, constraints, columns,
+                 by_id):
+        """The ids and rows of one subcase of the grid output
+        ``trait``, as ``NastranParser.select`` returns them (in the
+        order they are printed, without ids, unless ``by_id``).
+
+        The first run works out where the rows are, and the next ones
+        take them from the same places, as long as the grid still has
+        them there. Otherwise where they are is worked out again."""
+        request = (trait.nastran_header, repr(subcase),
+                   repr(sorted([(name, value.tolist() \
+                                 if isinstance(value, numpy.ndarray) \
+                                 else value) \
+                                for name, value in constraints.iteritems()])),
+                   repr(columns), trait.nastran_id_column, by_id)
+        plan = self._plans.get(request)
+        rows = None
+        if plan is not None:
+            rows = parser.extract(plan)
+        if rows is None:
+            plan = parser.plan(trait.nastran_header,
+                               self._subcase_number(subcase), constraints,
+                               columns, trait.nastran_id_column, by_id)
+            self._plans[request] = plan
+            rows = parser.extract(plan)
+        return plan.ids, rows
+
+    def _group_value(self, parser, trait):
+        """The value of every group of properties of the grid output
+        ``trait``: the ``nastran_derived`` result of every row (or its
+        first column), reduced over the elements of the group with
+        ``nastran_reduce`` (``max`` if not given).
+
+        The element of a row is in its ``nastran_id_column`` (by
+        default ``ELEMENT ID.``), and the property of every element is
+        read once from the template and the files it INCLUDEs."""
+        stat = os.stat(self.nastran_filename)
+        key = (path.abspath(self.nastran_filename), stat.st_mtime,
+               stat.st_size)
+        if self._properties is None or self._properties[0] != key:
+            elements, pids, names = \
+                      template_properties(self.nastran_filename)
+            self._properties = (key, elements, pids, {})
+        key, elements, pids, indices = self._properties
+        groups = repr(trait.nastran_group_by)
+        if groups not in indices:
+            indices[groups] = GroupIndex(elements, pids,
+                                         trait.nastran_group_by)
+
+        id_column = trait.nastran_id_column or "ELEMENT ID."
+        rows = self._grid_rows(parser, trait,
+                               [id_column] + list(trait.nastran_columns))
+        ids = fill_ids([row[0] for row in rows])
+        values = derived_value([row[1:] for row in rows],
+                               trait.nastran_derived)
+        return indices[groups].reduce(ids, values,
+                                      trait.nastran_reduce or "max")
+
+    def _aggregate(self, parser, trait):
+        """The ``nastran_aggregate`` of the grid output ``trait``, and
+        its gradient with respect to the values of the rows."""
+        return aggregate_rows(self._grid_rows(parser, trait),
+                              trait.nastran_aggregate, trait.nastran_rho,
+                              trait.nastran_derived,
+                              trait.nastran_constraint_allowable)
+
+    def _write_input(self, tmppath, tmpdir, varname2value,
+                     smart_replacements):
+        """Write the input file ``tmppath`` from the template."""
+        if self.nastran_patch_template or self.nastran_resident_deck:
+            # the template is never read in as text, NastranMaker
+            # only records the changes
+            maker = NastranMaker([])
+            self._set_smart_replacements(maker, smart_replacements)
+            self._get_patcher().write(tmppath, maker, varname2value, 10001)
+        else:
+            self._write_deck(tmppath, tmpdir, varname2value,
+                             smart_replacements)
+
+    def _nastran_command(self, tmppath, tmpdir, memory, dbs=None):
+        """The command that runs Nastran on ``tmppath`` in ``tmpdir``,
+        with ``memory`` MB. The database goes to ``dbs`` (``tmpdir``
+        if None)."""
+        if self.nastran_command == 'python':  # True when using fake_nastran.py
+            command = [self.nastran_command,
+                       self.nastran_command_args[0], tmppath]
+            command.extend(self.nastran_command_args[1:])
+        else:
+            command = [self.nastran_command, tmppath]
+            command.extend(self.nastran_command_args)
+        command.extend(["batch=no", "out=" + tmpdir,
+                        "dbs=" + (dbs or tmpdir)])
+        if self.scratch_directory:
+            command.append("sdirectory=" + self.scratch_directory)
+        if self.nastran_smp > 0:
+            command.append("smp=%d" % self.nastran_smp)
+        if memory > 0:
+            command.append("mem=%dmb" % memory)
+        return command
+
+    def _make_tmpdir(self):
+        """Return an empty directory for this run, either a new one or
+        one from the ScratchPool."""
+        if self.scratch_pool_size <= 0:
+            return mkdtemp(dir = self.output_tempdir_dir)
+
+        base_dir = self.scratch_pool_dir or self.output_tempdir_dir
+        pool = self._scratch_pool
+        if pool is None or pool.base_dir != base_dir or \
+               pool.size != self.scratch_pool_size:
+            if pool is not None:
+                pool.close()
+            pool = ScratchPool(base_dir, self.scratch_pool_size)
+            self._scratch_pool = pool
+        return pool.acquire()
+
+    def _archive_run(self, tmpdir, failed):
+        """Hand the run in ``tmpdir`` to the RunArchive, which decides
+        whether to keep it and compresses it in the background."""
+        if not self.archive_dir:
+            return
+
+        settings = (self.archive_dir, self.archive_compression,
+                    tuple(self.archive_artifacts), self.archive_every,
+                    self.archive_best, self.archive_maximize,
+                    self.archive_failed)
+        if self._archive is None or self._archive_settings != settings:
+            if self._archive is not None:
+                self._archive.wait()
+            self._archive = RunArchive(self.archive_dir,
+                                       self.archive_compression,
+                                       list(self.archive_artifacts),
+                                       self.archive_every,
+                                       self.archive_best,
+                                       self.archive_maximize,
+                                       self.archive_failed)
+            self._archive_settings = settings
+
+        objective = None
+        if self.archive_objective and not failed:
+            objective = float(getattr(self, self.archive_objective))
+        self._archive.submit(tmpdir, self._iteration, failed, objective)
+
+    def _remove_tmpdir(self, tmpdir):
+        """Get rid of a run directory we don't want to keep. If the
+        RunArchive is still reading it, that happens once it's done."""
+        if self._archive is not None:
+            self._archive.when_done(tmpdir, self._discard_tmpdir)
+        else:
+            self._discard_tmpdir(tmpdir)
+
+    def _discard_tmpdir(self, tmpdir):
+        """Delete a run directory. With a ScratchPool, it is cleaned
+        and recycled in the background."""
+        if self._scratch_pool is not None and self.scratch_pool_size > 0:
+            self._scratch_pool.release(tmpdir)
+        else:
+            rmtree(tmpdir)
+
+    def _write_deck(self, tmppath, tmpdir, varname2value,
+                    smart_replacements):
+        """Write the input file by running the template through
+        NastranReplacer and NastranMaker.
+
+        tmppath: str
+            Where the input file goes.
+
+        tmpdir: str
+            The run directory.
+
+        varname2value: {varname: value}
+            The values for NastranReplacer.
+
+        smart_replacements: {"traitname" : trait}
+            The inputs that NastranMaker puts in.
+        """
+        tmpfh = open(tmppath, "w")
+
+        # raw nastran file supplied by user
+        fh = open(self._template_path, "r")
+
+        # note: fh.readlines() won't work because it doesn't
+        # strip the newline at the end for you. So whatever,
+        # we'll just use split on newlines.
+        nastran_text = fh.read().split("\n")
+        fh.close()
+
+        # replace the variables in the nastran text using Replacer
+        replacer = NastranReplacer(nastran_text)
+        replacer.replace(varname2value)
+        nastran_text = replacer.text
+
+        # use nastran maker to intelligently replace
+        # values in cards
+        maker = NastranMaker(nastran_text)
+        self._set_smart_replacements(maker, smart_replacements)
+        if self.nastran_include_base:
+            self._write_include_deck(maker, tmpfh, tmpdir, varname2value)
+        else:
+            maker.write_to_file(tmpfh, 10001)
+
+        tmpfh.close()
+
+    def _set_smart_replacements(self, maker, smart_replacements):
+        """Tell NastranMaker about the current values of the inputs
+        in ``smart_replacements`` and let the subclass add its own
+        with ``nastran_maker_hook``."""
+        for name, trait in smart_replacements.iteritems():
+            value = getattr(self, name)
+            if trait.nastran_shape:
+                # the value is the amplitudes of the shapes
+                trait.nastran_shape.apply(maker, value)
+                continue
+            if trait.nastran_targets:
+                values = linked_values(value, trait.nastran_linking,
+                                       trait.nastran_offset)
+                maker.set_many(trait.nastran_targets,
+                               format_fields(values, 16))
+                continue
+            maker.set(trait.nastran_card,
+                      trait.nastran_id,
+                      trait.nastran_fieldnum, value)
+        self.nastran_maker_hook(maker)
+
+    def _validate_deck(self, tmppath):
+        """Check the input file ``tmppath`` with DeckValidator and
+        raise RuntimeError if there is something wrong with it.
+
+        With ``nastran_resident_deck``, the template is checked the
+        first time, and after that only the cards that changed.
+        Otherwise the bulk data of the input file, and of the files it
+        INCLUDEs (``base.bdf`` and ``design.bdf`` with
+        ``nastran_include_base``), is indexed and checked every
+        time."""
+        if self.nastran_resident_deck:
+            deck = self._get_patcher()
+            if self._validator is None or self._validator.deck is not deck:
+                if self._validator is not None:
+                    self._validator.close()
+                self._validator = DeckValidator(deck)
+                problems = self._validator.validate()
+            else:
+                problems = self._validator.validate(deck.modified)
+        else:
+            deck = BulkDeck(tmppath)
+            try:
+                validator = DeckValidator(deck)
+                try:
+                    problems = validator.validate()
+                finally:
+                    validator.close()
+            finally:
+                deck.close()
+
+        if problems:
+            raise RuntimeError("There are problems with the input " + \
+                               "file " + tmppath + ":\n" + \
+                               "\n".join(problems[:20]))
+
+    def _get_template(self, grid_outputs):
+        """The file to write the input file from.
+
+        That is ``nastran_filename``, unless ``nastran_load_cases``,
+        ``nastran_trim_output`` or ``nastran_sensitivities`` is set.
+        Then it is a copy of it with one subcase per load case, a Case
+        Control that only requests the output that ``grid_outputs``
+        need and/or the entries of a SOL 200 sensitivity analysis. The
+        copy is
+        only made again when the template, the load cases or the
+        outputs change."""
+        if not self.nastran_trim_output and not self.nastran_load_cases \
+               and not self.nastran_sensitivities:
+            return self.nastran_filename
+
+        outputs = [(trait.nastran_header, trait.nastran_constraints or {}) \
+                   for trait in grid_outputs.itervalues()]
+        # (an array of ids would be shortened by its repr)
+        wanted = sorted([(header, sorted([(key, value.tolist() \
+                                           if isinstance(value, numpy.ndarray) \
+                                           else value) \
+                                          for key, value in constraints.items()])) \
+                         for header, constraints in outputs])
+        stat = os.stat(self.nastran_filename)
+        key = (path.abspath(self.nastran_filename), stat.st_mtime,
+               stat.st_size, self.nastran_trim_output, repr(wanted),
+               tuple(self.nastran_keep_requests),
+               repr(self.nastran_load_cases), self.nastran_sensitivities)
+        if self._derived is None or self._derived[0] != key or \
+               not path.exists(self._derived[1]):
+            fh = open(self.nastran_filename, "r")
+            text = fh.read().split("\n")
+            fh.close()
+
+            if self.nastran_load_cases:
+                text = load_case_subcases(text, self.nastran_load_cases)
+
+            if self.nastran_trim_output:
+                try:
+                    requests = needed_requests(outputs)
+                except KeyError, err:
+                    self._logger.warning("Don't know which output " + \
+                                         "request prints " + str(err) + \
+                                         ", so all of them are kept")
+                    requests = None
+                text = trim_case_control(text, requests,
+                                         self.nastran_keep_requests)
+
+            if self.nastran_sensitivities:
+                text = sol200_deck(text)
+
+            fd, derived = mkstemp(prefix="nastran_template_", suffix=".bdf",
+                                  dir=self.output_tempdir_dir)
+            derived_fh = os.fdopen(fd, "w")
+            derived_fh.write("\n".join(text))
+            derived_fh.close()
+            if self._derived is not None and path.exists(self._derived[1]):
+                os.remove(self._derived[1])
+            self._derived = (key, derived)
+        return self._derived[1]
+
+    def _design_variables(self, smart_replacements, grid_outputs):
+        """The names of the inputs and outputs that
+        ``nastran_sensitivities`` differentiates: the inputs that set
+        one field of a property card, and the outputs with a
+        ``nastran_dresp``. Both are sorted, which is the order of the
+        DESVAR and DRESP1 cards and of the Jacobian."""
+        inputs = sorted([name for name, trait in \
+                         smart_replacements.iteritems() \
+                         if not trait.nastran_targets and \
+                         not trait.nastran_shape and \
+                         trait.nastran_card.upper().startswith("P")])
+        outputs = sorted([name for name, trait in grid_outputs.iteritems() \
+                          if trait.nastran_dresp])
+        if not outputs:
+            raise RuntimeError("nastran_sensitivities needs at least " + \
+                               "one output with a nastran_dresp")
+        return inputs, outputs
+
+    def _long_card(self, name, cid):
+        """Is card ``name`` ``cid`` written in long field in the
+        template? The field numbers of a long card mean other fields,
+        so we need to know how each card is written."""
+        stat = os.stat(self.nastran_filename)
+        key = (path.abspath(self.nastran_filename), stat.st_mtime,
+               stat.st_size)
+        if self._layouts is None or self._layouts[0] != key:
+            deck = BulkDeck(self.nastran_filename)
+            try:
+                layouts = dict([((card.name, card.cid), card.layout) \
+                                for card in deck.cards])
+            finally:
+                deck.close()
+            self._layouts = (key, layouts)
+        layout = self._layouts[1].get((name.upper().rstrip("*"), str(cid)))
+        if layout is None:
+            raise RuntimeError("Could not find card " + name + \
+                               " with id " + str(cid))
+        return layout in (LONG, FREE_LONG)
+
+    def _write_design_model(self, filename, smart_replacements,
+                            grid_outputs):
+        """Write the DESVAR, DVPREL1, DRESP1 and DCONSTR cards for the
+        current values of the inputs to ``filename``."""
+        inputs, outputs = self._design
+        variables = []
+        for name in inputs:
+            trait = smart_replacements[name]
+            card = trait.nastran_card.upper().rstrip("*")
+            cid = str(trait.nastran_id)
+            lower = trait.low if trait.low is not None else -UNBOUNDED
+            upper = trait.high if trait.high is not None else UNBOUNDED
+            variables.append((getattr(self, name), lower, upper, card, cid,
+                              field_position(trait.nastran_fieldnum,
+                                             self._long_card(card, cid))))
+
+        responses = []
+        self._dresps = {}
+        for name in outputs:
+            trait = grid_outputs[name]
+            response = trait.nastran_dresp
+            if trait.nastran_aggregate:
+                # one response for each element of the aggregate, in
+                # the order of its rows
+                if trait.nastran_derived or response is True or \
+                       not response.get("ATTI"):
+                    raise RuntimeError("The aggregate " + name + " needs " + \
+                                       "a nastran_dresp with the ATTI " + \
+                                       "of its rows, and no " + \
+                                       "nastran_derived, to have " + \
+                                       "sensitivities")
+                self._dresps[name] = range(DRESP_BASE + len(responses),
+                                           DRESP_BASE + len(responses) + \
+                                           len(response["ATTI"]))
+                for element in response["ATTI"]:
+                    single = dict(response)
+                    single["ATTI"] = [element]
+                    responses.append(single)
+                continue
+            if response is True:
+                if request_for_header(trait.nastran_header) != \
+                       "DISPLACEMENT":
+                    raise RuntimeError("Only displacements can be " + \
+                                       "made into a design response " + \
+                                       "by themselves, give " + name + \
+                                       " the DRESP1 fields instead")
+                response = displacement_response(trait.nastran_constraints,
+                                                 trait.nastran_columns)
+            self._dresps[name] = [DRESP_BASE + len(responses)]
+            responses.append(response)
+
+        fh = open(filename, "w")
+        fh.write("\n".join(design_cards(variables, responses)) + "\n")
+        fh.close()
+
+    def _fd_variables(self, smart_replacements, grid_outputs):
+        """The names of the inputs and outputs that
+        ``nastran_fd_gradient`` differentiates: the inputs that set one
+        field, and the Float outputs with a ``nastran_header``. Both
+        are sorted, which is the order of the Jacobian."""
+        inputs = sorted([name for name, trait in \
+                         smart_replacements.iteritems() \
+                         if not trait.nastran_targets and \
+                         not trait.nastran_shape])
+        outputs = sorted([name for name, trait in grid_outputs.iteritems() \
+                          if isinstance(trait.trait_type, Float)])
+        return inputs, outputs
+
+    def _finite_differences(self, tmppath, memory, smart_replacements,
+                            grid_outputs):
+        """Run Nastran once for every input of ``nastran_fd_gradient``
+        and work out the Jacobian from the outputs.
+
+        The perturbed input files are written by FiniteDifferenceBatch
+        from the input file of the run that just finished (``tmppath``),
+        so NastranReplacer and NastranMaker aren't run again. With
+        ``nastran_include_base`` only ``design.bdf`` is perturbed, and
+        every run directory links to the same ``base.bdf``. Up to
+        ``nastran_fd_workers`` of them run at the same time, each in its
+        own directory, and they go through the scheduler and take
+        license tokens like every other run.
+        """
+        inputs, outputs = self._design
+        if not inputs or not outputs:
+            self._fd_jacobian = numpy.zeros((len(outputs), len(inputs)))
+            return
+        values = [float(getattr(self, name)) for name in inputs]
+        steps = fd_steps(values, self.nastran_fd_step)
+
+        # with nastran_include_base, the cards NastranMaker changed
+        # are in design.bdf, not in the input file
+        design = None
+        if self.nastran_include_base:
+            design = path.join(path.dirname(tmppath), "design.bdf")
+
+        jobs = []
+        try:
+            batch = FiniteDifferenceBatch(design or tmppath,
+                                          design is not None)
+            try:
+                for name, value, step in zip(inputs, values, steps):
+                    trait = smart_replacements[name]
+                    jobdir = mkdtemp(prefix="fd_",
+                                     dir=self.output_tempdir_dir)
+                    jobs.append(jobdir)
+                    if design is not None:
+                        copyfile(tmppath, path.join(jobdir, "input.bdf"))
+                        self._link_base(jobdir)
+                    # the base deck has the card in long field, so the
+                    # template's fieldnum is turned into a data field
+                    field = data_field(trait.nastran_fieldnum,
+                                       self._long_card(trait.nastran_card,
+                                                       trait.nastran_id))
+                    batch.write(path.join(jobdir, path.basename(
+                                    design or "input.bdf")),
+                                trait.nastran_card, trait.nastran_id,
+                                field, value + step)
+            finally:
+                batch.close()
+
+            scheduler = None
+            if self.use_scheduler:
+                scheduler = NastranScheduler(self.scheduler_dir,
+                                             self.scheduler_cores,
+                                             self.scheduler_memory)
+            perturbed = run_jobs(lambda jobdir: self._fd_run(
+                                     jobdir, memory, scheduler,
+                                     [grid_outputs[name] for name in outputs]),
+                                 jobs, self.nastran_fd_workers)
+        except Exception:
+            # the run directories of a failed gradient aren't kept
+            exc_info = sys.exc_info()
+            for jobdir in jobs:
+                rmtree(jobdir, True)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        base = [float(getattr(self, name)) for name in outputs]
+        self._fd_jacobian = fd_jacobian(base, perturbed,
+                                        written_steps(values, steps))
+
         if self.delete_tmp_files:
-            if self.keep_first_iteration:
-                if not self._seen_first_iteration:
-                    self._seen_first_iteration = True
+            for jobdir in jobs:
+                rmtree(jobdir)
+
+    def _fd_run(self, jobdir, memory, scheduler, traits):
+        """Run one job of ``_finite_differences`` in ``jobdir`` and
+        return the values of the grid outputs ``traits``.
+
+        Every job runs in a thread of its own, so it has its own
+        LicenseSemaphore (a semaphore holds one token) and its own
+        reservation from ``scheduler``, if there is one."""
+        command = self._nastran_command(path.join(jobdir, "input.bdf"),
+                                        jobdir, memory)
+        semaphore = None
+        if self.license_tokens > 0:
+            semaphore = LicenseSemaphore(self.license_lock_dir,
+                                         self.license_tokens)
+        reservation = None
+        if scheduler is not None:
+            reservation = scheduler.reserve(max(1, self.nastran_smp), memory)
+            command = affinity_prefix(reservation.cpus) + command
+        try:
+            if semaphore is not None:
+                semaphore.acquire()
+            try:
+                stdout = open(path.join(jobdir, "input.stdout"), "w")
+                try:
+                    subprocess.call(command, stdout=stdout,
+                                    stderr=subprocess.STDOUT)
+                finally:
+                    stdout.close()
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        finally:
+            if reservation is not None:
+                scheduler.release(reservation)
+
+        output_filename = path.join(jobdir, "input.out")
+        if not path.exists(output_filename):
+            raise RuntimeError("Nastran didn't write " + output_filename)
+        fh = open(output_filename, "r")
+        lines = fh.read().split("\n")
+        fh.close()
+        for line in lines:
+            if "FATAL" in line:
+                raise RuntimeError("There was a problem with the " + \
+                                   "finite difference run in " + jobdir)
+        parser = NastranParser(lines)
+        parser.parse()
+        return [float(self._grid_value(parser, trait)) for trait in traits]
+
+    def list_deriv_vars(self):
+        """The inputs and outputs ``provideJ`` gives the derivatives
+        of, when ``nastran_sensitivities`` or ``nastran_fd_gradient``
+        is set."""
+        if not (self.nastran_sensitivities or self.nastran_fd_gradient) \
+               or self._design is None:
+            return (), ()
+        inputs, outputs = self._design
+        return tuple(inputs), tuple(outputs)
+
+    def provideJ(self):
+        """The derivatives of the outputs with respect to the inputs of
+        ``list_deriv_vars``, one row per output and one column per
+        input: the sensitivities of the last SOL 200 run, or the
+        Jacobian of the last ``nastran_fd_gradient``."""
+        if self.nastran_fd_gradient:
+            return self._fd_jacobian
+        inputs, outputs = self.list_deriv_vars()
+        J = numpy.zeros((len(outputs), len(inputs)))
+        for row, name in enumerate(outputs):
+            dresps = self._dresps[name]
+            for column in range(len(inputs)):
+                desvar = DESVAR_BASE + column
+                for dresp in dresps:
+                    if (dresp, desvar) not in self._sensitivities:
+                        raise RuntimeError("Nastran printed no " + \
+                                           "sensitivity of DRESP1 " + \
+                                           str(dresp) + " (" + name + \
+                                           ") to DESVAR " + str(desvar) + \
+                                           " (" + inputs[column] + ")")
+                derivatives = numpy.array([self._sensitivities[ \
+                    (dresp, desvar)] for dresp in dresps])
+                if name in self.aggregate_gradients:
+                    # the chain rule, through the rows of the aggregate
+                    gradient = self.aggregate_gradients[name]
+                    if len(gradient) != len(dresps):
+                        raise RuntimeError("The aggregate " + name + \
+                                           " has " + str(len(gradient)) + \
+                                           " rows but " + \
+                                           str(len(dresps)) + \
+                                           " responses")
+                    J[row, column] = numpy.dot(gradient, derivatives)
                 else:
-                    if self.keep_last_iteration: # keep both
-                        tmpdir_to_delete = self._last_seen_iteration
-                        self._last_seen_iteration = tmpdir
-                    else: # just keep first
-                        tmpdir_to_delete = tmpdir
-            else:
-                if self.keep_last_iteration: # only keep last
-                    tmpdir_to_delete = self._last_seen_iteration
-                    self._last_seen_iteration = tmpdir
-                else: # don't keep anything
-                    tmpdir_to_delete = tmpdir
+                    J[row, column] = derivatives[0]
+        return J
 
-            if tmpdir_to_delete:
-                rmtree(tmpdir_to_delete)
+    def _get_restart(self):
+        """The RestartDatabase, the BulkDeck, the lines up to
+        ``BEGIN BULK``, the owners of the cards and the partitions of
+        the current template.
+
+        The database is known by a hash of the template. The template
+        is only hashed again when its size or modification time
+        changes, and the database of the old template is removed."""
+        directory = self.nastran_restart_dir or \
+                    path.join(self.output_tempdir_dir, "nastran_restart")
+        stat = os.stat(self._template_path)
+        key = (directory, path.abspath(self._template_path),
+               stat.st_mtime, stat.st_size)
+        if self._restart is None or self._restart[0] != key:
+            database = RestartDatabase(directory,
+                                       template_key(self._template_path))
+            if self._restart is not None:
+                old_database, old_deck = self._restart[1:3]
+                old_deck.close()
+                if old_database.path != database.path:
+                    old_database.remove()
+
+            fh = open(self._template_path, "r")
+            lines = fh.read().split("\n")
+            fh.close()
+            begin, end = bulk_data_bounds(lines)
+            owners = superelement_map(lines)
+            self._restart = (key, database,
+                             BulkDeck(self._template_path),
+                             lines[:begin+1], owners,
+                             superelement_partitions(lines))
+            self._restart_index = None
+            self._restart_values = None
+        return self._restart[1:]
+
+    def _run_restart(self, tmppath, tmpdir, memory, smart_replacements):
+        """Write the input file and run Nastran for ``nastran_restart``.
+
+        The first run of a template (by any process) is the baseline.
+        It is written like any other run, with ``ECHO = SORT``, and
+        keeps its database in the RestartDatabase. The sorted bulk
+        data echo says which rows of the database every card is.
+
+        Every later run is a RESTART from that database. Its bulk data
+        only deletes the cards NastranMaker changes, with ``/``
+        entries, and has their new versions, so Nastran only has to
+        redo what depends on them.
+
+        The database is locked from the moment we look at it until
+        Nastran is done with it.
+        """
+        database, deck, head, owners, partitions = self._get_restart()
+        database.lock()
+        try:
+            if database.ready():
+                if self._restart_index is None:
+                    self._restart_index = database.load_index()
+                    self._restart_values = database.load_values()
+                maker = NastranMaker([])
+                self._set_smart_replacements(maker, smart_replacements)
+                deck.apply(maker.names)
+
+                # {superelement: (rows to delete, rows of new cards)}.
+                # The cards that still have their baseline values are
+                # in the database already
+                sections = {}
+                for card in changed_cards(deck, self._restart_values):
+                    seid = RESIDUAL
+                    if len(partitions) > 1:
+                        seid = changed_superelements(owners,
+                                   [(card.name, card.cid)]).pop()
+                    card_key = (seid, card.name, card.cid)
+                    if card_key not in self._restart_index:
+                        raise RuntimeError("Card " + card.name + \
+                                           " with id " + card.cid + \
+                                           " isn't in the baseline " + \
+                                           "database " + database.path)
+                    ranges, cards = sections.setdefault(seid, ([], []))
+                    ranges.append(self._restart_index[card_key])
+                    cards.extend(deck.rows(card)[0])
+                for seid, (ranges, cards) in sections.iteritems():
+                    sections[seid] = (delete_entries(ranges), cards)
+
+                if self.nastran_superelements:
+                    # the reduced matrices of the other superelements
+                    # are in the database already
+                    head = partial_case_control(head, sections.keys())
+                    self.submitted_superelements = \
+                        sorted(set(sections) | set([RESIDUAL]))
+
+                fh = open(tmppath, "w")
+                fh.write("\n".join(restart_deck(head, database.master,
+                                                sections)) + "\n")
+                fh.close()
+                self._run_nastran(tmpdir, memory)
+                return
+
+            self._write_input(tmppath, tmpdir, {}, smart_replacements)
+            fh = open(tmppath, "r")
+            lines = sorted_echo_deck(fh.read().split("\n"))
+            fh.close()
+            fh = open(tmppath, "w")
+            fh.write("\n".join(lines))
+            fh.close()
+
+            # the baseline's database is kept (scr=no) where the
+            # RESTART runs will find it
+            command = self.command
+            self.command = self._nastran_command(tmppath, tmpdir, memory,
+                                                 database.dbs) + ["scr=no"]
+            try:
+                self._run_nastran(tmpdir, memory)
+            finally:
+                self.command = command
+
+            fh = open(self.output_filename, "r")
+            ranges = parse_sorted_echo(fh.read().split("\n"), partitions)
+            fh.close()
+            if not ranges:
+                raise RuntimeError("Could not find the sorted bulk " + \
+                                   "data echo in " + self.output_filename)
+            # the cards of a RESTART run are compared with these
+            maker = NastranMaker([])
+            self._set_smart_replacements(maker, smart_replacements)
+            deck.apply(maker.names)
+            values = dict([((card.name, card.cid), deck.values(card)) \
+                           for card in deck.modified])
+            database.save_values(values)
+            database.save_index(ranges)
+            self._restart_index = ranges
+            self._restart_values = values
+            self.submitted_superelements = None
+        finally:
+            database.unlock()
+
+    def _subcase_number(self, subcase):
+        """The number of the subcase ``nastran_subcase`` refers to. It
+        can be the name of one of ``nastran_load_cases``."""
+        if not isinstance(subcase, basestring):
+            return subcase
+        for number, case in enumerate(self.nastran_load_cases):
+            if case.get("name") == subcase:
+                return number + 1
+        raise RuntimeError("There is no load case called " + subcase)
+
+    def _get_patcher(self):
+        """The TemplatePatcher (or BulkDeck) for the current template.
+        It is kept (and the template stays mapped) until the template
+        changes."""
+        patcher_class = BulkDeck if self.nastran_resident_deck \
+                        else TemplatePatcher
+        stat = os.stat(self._template_path)
+        key = (path.abspath(self._template_path), stat.st_mtime,
+               stat.st_size, patcher_class)
+        if self._patcher is None or self._patcher_key != key:
+            if self._patcher is not None:
+                self._patcher.close()
+            self._patcher = patcher_class(self._template_path)
+            self._patcher_key = key
+        return self._patcher
+
+    def _write_include_deck(self, maker, file_handler, tmpdir,
+                            varname2value):
+        """Write the input file as a small ``input.bdf`` that INCLUDEs
+        the bulk data that didn't change (``base.bdf``) and the cards
+        NastranMaker changed (``design.bdf``).
+
+        ``base.bdf`` is only written when the template, the set of
+        changed cards or the NastranReplacer variables change. Every
+        run directory gets a hard link to it (or a copy, if the run
+        directory is on another filesystem).
+
+        maker: NastranMaker
+            Has all the changes for this run.
+
+        file_handler: file-like object
+            Where ``input.bdf`` goes. It is closed afterwards.
+
+        tmpdir: str
+            The run directory.
+
+        varname2value: {varname: value}
+            The values NastranReplacer put in.
+        """
+        changed = maker.split(10001)
+        text = maker.text
+        begin, end = bulk_data_bounds(text)
+
+        stat = os.stat(self._template_path)
+        key = (path.abspath(self._template_path), stat.st_mtime,
+               stat.st_size, tuple(sorted(maker.names)),
+               tuple(sorted(varname2value.items())))
+        if self._include_base is None or self._include_base[0] != key or \
+               not path.exists(self._include_base[1]):
+            fd, base = mkstemp(prefix="nastran_base_", suffix=".bdf",
+                               dir=self.output_tempdir_dir)
+            base_fh = os.fdopen(fd, "w")
+            base_fh.write("\n".join(text[begin+1:end]) + "\n")
+            base_fh.close()
+            # run directories keep their copy: a hard link still has
+            # the contents once the name is gone, and where a hard
+            # link can't be made the file is copied
+            if self._include_base is not None and \
+                   path.exists(self._include_base[1]):
+                os.remove(self._include_base[1])
+            self._include_base = (key, base)
+
+        self._link_base(tmpdir)
+
+        design_fh = open(path.join(tmpdir, "design.bdf"), "w")
+        design_fh.write("\n".join(changed) + "\n")
+        design_fh.close()
+
+        file_handler.write("\n".join(text[:begin+1] + \
+                                     ["INCLUDE 'base.bdf'",
+                                      "INCLUDE 'design.bdf'"] + \
+                                     text[end:]))
+        file_handler.close()
+
+    def _link_base(self, directory):
+        """Link ``base.bdf`` in ``directory`` to the current base of
+        ``nastran_include_base`` with a hard link, or copy it if
+        ``directory`` is on another filesystem. A symbolic link would
+        dangle once the base is written again and the old one
+        removed."""
+        base_link = path.join(directory, "base.bdf")
+        try:
+            os.link(self._include_base[1], base_link)
+        except OSError:
+            copyfile(self._include_base[1], base_link)
+
+    def _run_nastran(self, tmpdir, memory):
+        """Run ``self.command`` through ExternalCode's execute.
+
+        If ``use_scheduler`` is set, the run first waits until the
+        NastranScheduler in ``scheduler_dir`` can give it
+        ``nastran_smp`` cores and ``memory`` MB, and Nastran is pinned
+        to the cores it got. If ``license_tokens`` is set, a token is
+        then taken from the LicenseSemaphore in ``license_lock_dir``
+        for the duration of the run. A run that failed because Nastran
+        could not get a license is requeued up to ``license_retries``
+        times, waiting ``license_backoff`` seconds before the first
+        retry and twice as long before each one after that.
+
+        tmpdir: str
+            The directory Nastran is running in. Its log file is
+            searched for license failures.
+
+        memory: int
+            Memory, in MB, to reserve from the scheduler.
+        """
+        scheduler = None
+        if self.use_scheduler:
+            scheduler = NastranScheduler(self.scheduler_dir,
+                                         self.scheduler_cores,
+                                         self.scheduler_memory)
+        semaphore = None
+        if self.license_tokens > 0:
+            semaphore = LicenseSemaphore(self.license_lock_dir,
+                                         self.license_tokens)
+
+        self.queue_wait_time = 0.
+        self.run_time = 0.
+        command = self.command
+        attempt = 0
+        while True:
+            reservation = None
+            if scheduler is not None:
+                reservation = scheduler.reserve(max(1, self.nastran_smp),
+                                                memory)
+                self.queue_wait_time += reservation.wait_time
+                self.command = affinity_prefix(reservation.cpus) + command
+            if semaphore is not None:
+                self.queue_wait_time += semaphore.acquire()
+            start = time.time()
+            try:
+                try:
+                    super(NastranComponent, self).execute()
+                except RuntimeError:
+                    if not self._requeue_for_license(tmpdir, attempt, True):
+                        raise
+                else:
+                    if not self._requeue_for_license(tmpdir, attempt, False):
+                        return
+            finally:
+                self.run_time += time.time() - start
+                if semaphore is not None:
+                    semaphore.release()
+                if reservation is not None:
+                    scheduler.release(reservation)
+                    self.command = command
+
+            delay = self.license_backoff * 2 ** attempt
+            attempt += 1
+            time.sleep(delay)
+            self.queue_wait_time += delay
+
+    def _requeue_for_license(self, tmpdir, attempt, failed):
+        """Decide whether the run that just finished should be requeued
+        because Nastran could not get a license.
+
+        The log file is always searched because it is small. The output
+        file is only searched if the run failed or never produced
+        any output."""
+        if attempt >= self.license_retries:
+            return False
+        filenames = [path.join(tmpdir, "input.log")]
+        if failed or not path.exists(self.output_filename):
+            filenames.append(self.output_filename)
+        message = license_failure(filenames)
+        if message is None:
+            return False
+        self._logger.warning("Nastran could not get a license (" + \
+                             message + "). Requeueing run in " + \
+                             tmpdir)
+        return True
 
     def nastran_maker_hook(self, maker):
         """A subclass can override this function to dynamically
@@ -0,0 +1,370 @@
+"""Defines RunArchive, which compresses the interesting files of selected
+runs into an archive directory in the background, and keeps an index
+of what it archived."""
+import os
+import sys
+import bz2
+import gzip
+import fcntl
+import tarfile
+import hashlib
+import threading
+from Queue import Queue
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+INDEX_FILENAME = "index.txt"
+INDEX_COLUMNS = ["iteration", "input_hash", "status", "objective",
+                 "reasons", "archive"]
+
+DEFAULT_ARTIFACTS = ["input.bdf", "design.bdf", "input.out", "input.f06",
+                     "input.f04", "input.log"]
+
+_extensions = {"gzip": ".tar.gz", "bz2": ".tar.bz2", "lzma": ".tar.xz"}
+
+
+def _check_compression(compression):
+    """Raise ValueError if we can't compress with ``compression``."""
+    if compression not in _extensions:
+        raise ValueError("Unknown compression " + compression + \
+                         ". Use one of " + ", ".join(sorted(_extensions)))
+    if compression == "lzma" and lzma is None:
+        raise ValueError("lzma compression needs the lzma module " + \
+                         "(backports.lzma on Python 2)")
+
+
+def _open_compressed(filename, compression):
+    """Open ``filename`` for writing one compressed stream."""
+    if compression == "gzip":
+        return gzip.GzipFile(filename, "wb")
+    if compression == "bz2":
+        return bz2.BZ2File(filename, "wb")
+    return lzma.LZMAFile(filename, "wb")
+
+
+def _open_readable(filename):
+    """Open an archive written by ``_open_compressed`` for reading."""
+    if filename.endswith(".tar.gz"):
+        return gzip.GzipFile(filename, "rb")
+    if filename.endswith(".tar.bz2"):
+        return bz2.BZ2File(filename, "rb")
+    if lzma is None:
+        raise ValueError("Reading " + filename + " needs the lzma module")
+    return lzma.LZMAFile(filename, "rb")
+
+
+def input_hash(filename):
+    """SHA1 hex digest of the file ``filename``."""
+    digest = hashlib.sha1()
+    fh = open(filename, "rb")
+    try:
+        while True:
+            block = fh.read(1 << 20)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        fh.close()
+    return digest.hexdigest()
+
+
+class RunArchive(object):
+    """Archives runs, in the background, according to a retention policy.
+
+    A run is archived if any of these applies:
+
+    - ``every`` is set and the iteration number is a multiple of it
+    - ``best`` is set and the run's objective is among the ``best``
+      best seen so far. When a run drops out of the best ones, it is
+      taken out of the archive (unless it is there for another reason).
+    - ``failed`` is set and the run failed
+
+    The selected files of an archived run go into a single compressed
+    tar stream (one gzip, bz2 or lzma member) in ``archive_dir``. The
+    file ``index.txt`` in ``archive_dir`` has one tab-separated line per
+    archived run, so runs can be found by iteration or by the hash
+    of their input deck. Processes can share ``archive_dir``: each one
+    merges its changes into the index under a lock.
+    """
+
+    def __init__(self, archive_dir, compression="gzip", artifacts=None,
+                 every=0, best=0, maximize=False, failed=True):
+        """
+        archive_dir: str
+            Where the archives and the index go. Created if needed.
+
+        compression: str
+            ``gzip``, ``bz2`` or ``lzma``.
+
+        artifacts: [str] or None
+            Names of the files of a run directory to archive. Missing
+            ones are skipped. Defaults to ``DEFAULT_ARTIFACTS``.
+
+        every: int
+            Archive every ``every``-th iteration. 0 turns it off.
+
+        best: int
+            Keep the ``best`` runs with the best objective. 0 turns
+            it off.
+
+        maximize: bool
+            Is a bigger objective better?
+
+        failed: bool
+            Archive the runs that failed?
+        """
+        # fail now rather than in the background thread
+        _check_compression(compression)
+
+        self.archive_dir = archive_dir
+        self.compression = compression
+        self.artifacts = artifacts or DEFAULT_ARTIFACTS
+        self.every = every
+        self.best = best
+        self.maximize = maximize
+        self.failed = failed
+
+        if not os.path.isdir(archive_dir):
+            os.makedirs(archive_dir)
+        self.index_filename = os.path.join(archive_dir, INDEX_FILENAME)
+        self.entries = self.read_index(archive_dir)
+        # the archives whose entries were added, changed or removed
+        # since the index was last written
+        self._changed = set()
+        self._removed = set()
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._queue = Queue()
+        self._worker = threading.Thread(target=self._work)
+        self._worker.setDaemon(True)
+        self._worker.start()
+
+    @staticmethod
+    def read_index(archive_dir):
+        """Read the index of ``archive_dir``. Returns a list of
+        dictionaries with the keys in ``INDEX_COLUMNS``."""
+        filename = os.path.join(archive_dir, INDEX_FILENAME)
+        entries = []
+        if not os.path.exists(filename):
+            return entries
+        fh = open(filename, "r")
+        for line in fh:
+            values = line.rstrip("\n").split("\t")
+            if len(values) != len(INDEX_COLUMNS) or \
+                   values[0] == INDEX_COLUMNS[0]:
+                continue
+            entry = dict(zip(INDEX_COLUMNS, values))
+            entry["iteration"] = int(entry["iteration"])
+            entry["objective"] = float(entry["objective"]) \
+                                 if entry["objective"] else None
+            entry["reasons"] = set(entry["reasons"].split(","))
+            entries.append(entry)
+        fh.close()
+        return entries
+
+    def find(self, iteration=None, input_hash=None):
+        """Return the index entries matching the iteration number and/or
+        the input hash. The ``archive`` key of an entry is the archive's
+        filename, relative to ``archive_dir``. The runs archived by
+        other processes are found too."""
+        self.wait()
+        return [entry for entry in self.read_index(self.archive_dir) \
+                if (iteration is None or entry["iteration"] == iteration) \
+                and (input_hash is None or \
+                     entry["input_hash"] == input_hash)]
+
+    def extract(self, entry, directory):
+        """Unpack the archived run ``entry`` into ``directory``."""
+        fh = _open_readable(os.path.join(self.archive_dir,
+                                         entry["archive"]))
+        try:
+            tar = tarfile.open(fileobj=fh, mode="r|")
+            tar.extractall(directory)
+            tar.close()
+        finally:
+            fh.close()
+
+    def submit(self, run_dir, iteration, failed=False, objective=None):
+        """Consider the run in ``run_dir`` for archiving. The policy is
+        applied and the files are compressed in the background; this
+        returns immediately. Don't delete ``run_dir`` yourself, hand the
+        deletion to ``when_done``."""
+        self._lock.acquire()
+        try:
+            self._pending[run_dir] = self._pending.get(run_dir, [])
+        finally:
+            self._lock.release()
+        self._queue.put((run_dir, iteration, failed, objective))
+
+    def when_done(self, run_dir, func):
+        """Call ``func(run_dir)`` once the archive is finished with
+        ``run_dir``. If it isn't waiting on it, that's right now."""
+        self._lock.acquire()
+        try:
+            if run_dir in self._pending:
+                self._pending[run_dir].append(func)
+                return
+        finally:
+            self._lock.release()
+        func(run_dir)
+
+    def wait(self):
+        """Block until every submitted run has been handled."""
+        self._queue.join()
+
+    def _better(self, one, other):
+        """Is objective ``one`` better than ``other``?"""
+        if self.maximize:
+            return one > other
+        return one < other
+
+    def _reasons(self, iteration, failed, objective):
+        """Why should this run be archived? Also takes the best-N
+        reason away from the run it pushes out, if any."""
+        reasons = set()
+        if self.every > 0 and iteration % self.every == 0:
+            reasons.add("every")
+        if self.failed and failed:
+            reasons.add("failed")
+        if self.best > 0 and not failed and objective is not None:
+            best = [entry for entry in self.entries \
+                    if "best" in entry["reasons"]]
+            if len(best) < self.best:
+                reasons.add("best")
+            else:
+                worst = best[0]
+                for entry in best[1:]:
+                    if self._better(worst["objective"], entry["objective"]):
+                        worst = entry
+                if self._better(objective, worst["objective"]):
+                    reasons.add("best")
+                    self._drop_reason(worst, "best")
+        return reasons
+
+    def _drop_reason(self, entry, reason):
+        """Take ``reason`` away from ``entry`` and remove the archive
+        if that was the only reason to keep it."""
+        entry["reasons"].discard(reason)
+        if entry["reasons"]:
+            self._changed.add(entry["archive"])
+        else:
+            self.entries.remove(entry)
+            self._changed.discard(entry["archive"])
+            self._removed.add(entry["archive"])
+            filename = os.path.join(self.archive_dir, entry["archive"])
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _write_index(self):
+        """Merge our changes into the (small) index file.
+
+        Another process may have written it since we read it, so it is
+        read again under a lock (on ``archive_dir`` itself, since the
+        index is replaced by renaming), and only the entries we changed
+        are replaced. Our entries are then the merged ones."""
+        fd = os.open(self.archive_dir, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            ours = dict([(entry["archive"], entry) \
+                         for entry in self.entries \
+                         if entry["archive"] in self._changed])
+            entries = []
+            for entry in self.read_index(self.archive_dir):
+                name = entry["archive"]
+                if name in self._removed:
+                    continue
+                entries.append(ours.pop(name, entry))
+            entries.extend([entry for entry in self.entries \
+                            if entry["archive"] in ours])
+            self._write_entries(entries)
+            self.entries = entries
+            self._changed.clear()
+            self._removed.clear()
+        finally:
+            # closing the file lets the lock go
+            os.close(fd)
+
+    def _write_entries(self, entries):
+        """Rewrite the index file with ``entries``."""
+        fh = open(self.index_filename + ".tmp", "w")
+        fh.write("\t".join(INDEX_COLUMNS) + "\n")
+        for entry in entries:
+            objective = entry["objective"]
+            fh.write("\t".join([str(entry["iteration"]),
+                                entry["input_hash"], entry["status"],
+                                "" if objective is None else repr(objective),
+                                ",".join(sorted(entry["reasons"])),
+                                entry["archive"]]) + "\n")
+        fh.close()
+        os.rename(self.index_filename + ".tmp", self.index_filename)
+
+    def _archive(self, run_dir, iteration, failed, objective, reasons):
+        """Compress the artifacts of ``run_dir`` and add it to the index."""
+        deck = os.path.join(run_dir, "input.bdf")
+        digest = input_hash(deck) if os.path.exists(deck) else ""
+        # the process id keeps the runs of processes sharing
+        # archive_dir apart
+        name = "run_%06d_%d%s" % (iteration, os.getpid(),
+                                  _extensions[self.compression])
+
+        fh = _open_compressed(os.path.join(self.archive_dir, name),
+                              self.compression)
+        try:
+            tar = tarfile.open(fileobj=fh, mode="w|")
+            for artifact in self.artifacts:
+                filename = os.path.join(run_dir, artifact)
+                if os.path.exists(filename):
+                    tar.add(filename, arcname=artifact)
+            tar.close()
+        finally:
+            fh.close()
+
+        # a rerun of an iteration replaces the old one
+        for entry in [entry for entry in self.entries \
+                      if entry["archive"] == name]:
+            self.entries.remove(entry)
+        self._changed.add(name)
+        self._removed.discard(name)
+        self.entries.append({"iteration": iteration,
+                             "input_hash": digest,
+                             "status": "failed" if failed else "ok",
+                             "objective": objective,
+                             "reasons": reasons,
+                             "archive": name})
+
+    def _work(self):
+        """Body of the background thread."""
+        while True:
+            run_dir, iteration, failed, objective = self._queue.get()
+            try:
+                reasons = self._reasons(iteration, failed, objective)
+                if reasons:
+                    self._archive(run_dir, iteration, failed, objective,
+                                  reasons)
+                self._write_index()
+            except Exception, err:
+                # don't let one bad run stop the archiving of the others
+                print >> sys.stderr, "Unable to archive " + run_dir + \
+                      ": " + str(err)
+            try:
+                self._lock.acquire()
+                try:
+                    callbacks = self._pending.pop(run_dir, [])
+                finally:
+                    self._lock.release()
+                for func in callbacks:
+                    try:
+                        func(run_dir)
+                    except Exception, err:
+                        print >> sys.stderr, "Unable to clean up " + \
+                              run_dir + ": " + str(err)
+            finally:
+                # or wait() would never return
+                self._queue.task_done()
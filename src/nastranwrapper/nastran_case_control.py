@@ -0,0 +1,289 @@
+"""Defines functions that rewrite the Case Control section of a Nastran
+input file so that Nastran only prints what is going to be parsed."""
+import re
+
+from nastran_util import bulk_data_bounds
+from nastran_parser import readable_header
+
+# (words in the header of an output page, request that prints it). The
+# first match wins, so the more specific ones come first. None means
+# it is always printed.
+HEADER_REQUESTS = [
+    ("real eigenvalues", None),
+    ("displacement vector", "DISPLACEMENT"),
+    ("eigenvector", "DISPLACEMENT"),
+    ("velocity vector", "VELOCITY"),
+    ("acceleration vector", "ACCELERATION"),
+    ("load vector", "OLOAD"),
+    ("forces of single-point constraint", "SPCFORCES"),
+    ("forces of single point constraint", "SPCFORCES"),
+    ("forces of multipoint constraint", "MPCFORCES"),
+    ("forces of multi-point constraint", "MPCFORCES"),
+    ("grid point force balance", "GPFORCE"),
+    ("strain energ", "ESE"),
+    ("stresses", "STRESS"),
+    ("strains", "STRAIN"),
+    ("forces in", "FORCE"),
+]
+
+# Nastran only looks at the first four letters of a request
+REQUEST_NAMES = {"DISP": "DISPLACEMENT", "VECT": "DISPLACEMENT",
+                 "PRES": "DISPLACEMENT", "VELO": "VELOCITY",
+                 "ACCE": "ACCELERATION", "OLOA": "OLOAD",
+                 "SPCF": "SPCFORCES", "MPCF": "MPCFORCES",
+                 "GPFO": "GPFORCE", "ESE": "ESE", "STRE": "STRESS",
+                 "ELST": "STRESS", "STRA": "STRAIN", "FORC": "FORCE",
+                 "ELFO": "FORCE", "GPST": "GPSTRESS", "STRF": "STRFIELD"}
+
+request_match = re.compile("^(?P<indent>\\s*)(?P<name>[A-Za-z]+)" \
+                           "(?P<describers>\\s*\\([^)]*\\))?\\s*=\\s*" \
+                           "(?P<value>.*)$")
+set_match = re.compile("^\\s*SET\\s+(?P<id>\\d+)\\s*=", re.IGNORECASE)
+echo_match = re.compile("^(?P<indent>\\s*)ECHO\\s*=", re.IGNORECASE)
+cend_match = re.compile("^\\s*CEND", re.IGNORECASE)
+subcase_match = re.compile("^\\s*SUBCASE\\s+\\d+", re.IGNORECASE)
+label_match = re.compile("^\\s*LABEL\\s*=", re.IGNORECASE)
+
+# how many ids go on one line of a SET
+IDS_PER_LINE = 8
+
+
+def request_name(word):
+    """The full name of the output request ``word`` (which may be
+    abbreviated), or None if it isn't an output request."""
+    return REQUEST_NAMES.get(word.upper()[:4])
+
+
+def request_for_header(header):
+    """The output request that prints the pages with ``header``
+    (``"displacement vector"``, say).
+
+    Returns the request name, None if the page is always printed, and
+    raises KeyError if we don't know."""
+    # "D I S P L A C E M E N T   V E C T O R" as well
+    words = readable_header(header)
+    for text, request in HEADER_REQUESTS:
+        if text in words:
+            return request
+    raise KeyError(header)
+
+
+def constrained_ids(constraints):
+    """The ids a ``nastran_constraints`` dictionary asks for, or None
+    if it doesn't restrict the output to some ids."""
+    for key, value in constraints.iteritems():
+        if "ID" not in key.upper():
+            continue
+        if str(value).strip().isdigit():
+            return set([int(value)])
+        # an array of ids, for an Array output (a range can be huge,
+        # so it gets them all)
+        if not isinstance(value, (basestring, slice)) and \
+               hasattr(value, "__iter__"):
+            return set([int(number) for number in value])
+    return None
+
+
+def needed_requests(outputs):
+    """Work out which output requests, for which ids, the outputs need.
+
+    outputs: [(header, constraints)]
+        ``nastran_header`` and ``nastran_constraints`` of the outputs.
+
+    Returns {request name: set of ids, or None for all of them}.
+    Raises KeyError for a header we don't know the request of.
+    """
+    requests = {}
+    for header, constraints in outputs:
+        request = request_for_header(header)
+        if request is None:
+            continue
+        ids = constrained_ids(constraints)
+        if request in requests and requests[request] is None:
+            continue
+        if ids is None:
+            requests[request] = None
+        else:
+            requests.setdefault(request, set()).update(ids)
+    return requests
+
+
+def case_control_bounds(lines):
+    """The indices of the ``CEND`` and ``BEGIN BULK`` lines, which
+    the Case Control is between."""
+    for index, line in enumerate(lines):
+        if cend_match.match(line):
+            begin, end = bulk_data_bounds(lines)
+            return index, begin
+    raise RuntimeError("Could not find CEND in the Nastran file")
+
+
+def _set_lines(set_id, ids):
+    """Case Control lines that define SET ``set_id``."""
+    ids = [str(number) for number in sorted(ids)]
+    chunks = [ids[i:i + IDS_PER_LINE] \
+              for i in range(0, len(ids), IDS_PER_LINE)]
+    lines = []
+    for index, chunk in enumerate(chunks):
+        line = ("SET " + str(set_id) + " = ") if index == 0 else "   "
+        line += ", ".join(chunk)
+        if index < len(chunks) - 1:
+            line += ","
+        lines.append(line)
+    return lines
+
+
+def trim_case_control(lines, requests, keep=()):
+    """Rewrite the Case Control of a Nastran input file.
+
+    Every output request in ``requests`` is pointed at a new SET of
+    just the ids that are needed (or ALL), and requests that the
+    template doesn't have yet are added at the top. Other output
+    requests are commented out, unless they are in ``keep``.
+    ``ECHO`` is set to ``NONE``.
+
+    lines: [str]
+        The lines of the file, without newlines.
+
+    requests: {request name: set of ids or None}
+        As returned by ``needed_requests``. None leaves all the output
+        requests alone, and only turns the echo off.
+
+    keep: [str]
+        Output requests that should be left alone.
+
+    Returns the new lines.
+    """
+    cend, begin = case_control_bounds(lines)
+
+    keep = set([request_name(name) or name.upper() for name in keep])
+
+    # the new SETs get ids that aren't used yet
+    used = [int(match.group("id")) for match in \
+            [set_match.match(line) for line in lines[cend+1:begin]] \
+            if match]
+    next_set = max(used + [1000]) + 1
+    set_ids = {}
+    added = []
+    for request in sorted(requests or {}):
+        if requests[request] is not None:
+            set_ids[request] = next_set
+            added.extend(_set_lines(next_set, requests[request]))
+            next_set += 1
+
+    new_lines = []
+    echo = False
+    present = set()
+    for line in lines[cend+1:begin]:
+        match = echo_match.match(line)
+        if match:
+            new_lines.append(match.group("indent") + "ECHO = NONE")
+            echo = True
+            continue
+        match = request_match.match(line)
+        name = match and request_name(match.group("name"))
+        if requests is None or not name or \
+               match.group("value").strip().upper() == "NONE" or \
+               name in keep:
+            new_lines.append(line)
+        elif name in requests:
+            value = str(set_ids.get(name, "ALL"))
+            new_lines.append(match.group("indent") + match.group("name") + \
+                             (match.group("describers") or "") + " = " + \
+                             value)
+            present.add(name)
+        else:
+            new_lines.append("$ " + line)
+
+    top = []
+    if not echo:
+        top.append("ECHO = NONE")
+    top.extend(added)
+    for request in sorted(requests or {}):
+        if request not in present:
+            top.append(request + " = " + str(set_ids.get(request, "ALL")))
+
+    return lines[:cend+1] + top + new_lines + lines[begin:]
+
+
+def _entry_name(name):
+    """The full name of the Case Control entry ``name``. Only output
+    requests can be abbreviated to their first four letters; the other
+    entries (``LOAD`` and ``LOADSET``, say) are told apart by their
+    whole name."""
+    return request_name(name) or name.upper()
+
+
+def _entry_matches(key, line):
+    """Is ``line`` the Case Control entry ``key`` (``LOAD``,
+    ``TEMPERATURE(LOAD)``, ...)? A key without describers matches the
+    entry whatever its describers are."""
+    match = request_match.match(line)
+    key_match = request_match.match(key + "=")
+    if not match or not key_match or \
+           _entry_name(match.group("name")) != \
+           _entry_name(key_match.group("name")):
+        return False
+    describers = key_match.group("describers")
+    return not describers or \
+           describers.replace(" ", "").upper() == \
+           (match.group("describers") or "").replace(" ", "").upper()
+
+
+def load_case_subcases(lines, cases):
+    """Rewrite the Case Control of a Nastran input file with one
+    SUBCASE per load case.
+
+    The entries of the template's first subcase (output requests,
+    say) are repeated in every subcase, with the entries of the load
+    case replacing the ones with the same name and the others added.
+    The template's other subcases are dropped. Everything above the
+    first subcase is left alone.
+
+    lines: [str]
+        The lines of the file, without newlines.
+
+    cases: [{entry: value}]
+        One dictionary a load case, such as ``{"name": "pullup",
+        "LOAD": 10, "SPC": 2}``. The optional ``name`` becomes the
+        LABEL of the subcase.
+
+    Returns the new lines. The subcases are numbered from 1, in the
+    order of ``cases``.
+    """
+    cend, begin = case_control_bounds(lines)
+    body = lines[cend+1:begin]
+    starts = [index for index, line in enumerate(body) \
+              if subcase_match.match(line)]
+    if starts:
+        top = body[:starts[0]]
+        first_end = starts[1] if len(starts) > 1 else len(body)
+        pattern = body[starts[0]+1:first_end]
+    else:
+        top, pattern = body, []
+
+    subcases = []
+    for number, case in enumerate(cases):
+        subcases.append("SUBCASE " + str(number + 1))
+        name = case.get("name")
+        if name:
+            subcases.append("   LABEL = " + str(name))
+        entries = sorted([(key, value) for key, value in case.iteritems() \
+                          if key != "name"])
+        used = set()
+        for line in pattern:
+            if name and label_match.match(line):
+                continue
+            for key, value in entries:
+                if _entry_matches(key, line):
+                    indent = request_match.match(line).group("indent")
+                    subcases.append(indent + key + " = " + str(value))
+                    used.add(key)
+                    break
+            else:
+                subcases.append(line)
+        for key, value in entries:
+            if key not in used:
+                subcases.append("   " + key + " = " + str(value))
+
+    return lines[:cend+1] + top + subcases + lines[begin:]
@@ -0,0 +1,372 @@
+"""Defines BulkDeck, a model of the bulk data of a template that is
+parsed once and kept in memory, so that every run only costs as much as
+the cards it changes."""
+import os
+import re
+from bisect import bisect_left
+
+from nastran_maker import _change_card, field_slot
+from nastran_patcher import TemplatePatcher, CONTINUATION_STARTS
+from nastran_util import stringify
+
+# the ways a card can be written
+SHORT = 0       # fixed fields, 8 wide
+LONG = 1        # fixed fields, 16 wide (NAME*)
+FREE = 2        # comma separated, small field
+FREE_LONG = 3   # comma separated, large field (NAME*)
+
+# "*" and the number have to fit in the 8 wide first field
+MAX_CONTINUATION = 9999999
+
+begin_bulk_match = re.compile("^ *BEGIN +BULK", re.IGNORECASE)
+include_match = re.compile("^INCLUDE\\s+'?([^']*?)'?\\s*$", re.IGNORECASE)
+
+
+def _slots_per_row(layout):
+    """How many slots (name and continuation fields included) a row
+    of a card written as ``layout`` has."""
+    if layout in (LONG, FREE_LONG):
+        return 6
+    return 10
+
+
+def _card_header(line):
+    """The name, id and layout of the card starting on ``line``."""
+    if "," in line:
+        entries = line.split(",")
+        name = entries[0].strip().upper()
+        cid = entries[1].strip() if len(entries) > 1 else ""
+        layout = FREE_LONG if name.endswith("*") else FREE
+    else:
+        name = line[:8].strip().upper()
+        if name.endswith("*"):
+            cid = line[8:24].strip()
+            layout = LONG
+        else:
+            cid = line[8:16].strip()
+            layout = SHORT
+    return name.rstrip("*"), cid, layout
+
+
+def _row_slots(row, layout):
+    """Split one row of a card into its slots, the same way
+    NastranMaker does for fixed field cards."""
+    if layout == SHORT:
+        return [row[i:i + 8] for i in range(0, 80, 8)]
+    if layout == LONG:
+        return [row[:8]] + [row[i:i + 16] for i in range(8, 88, 16)]
+
+    # free field: pad every row out to the fixed layout, so that the
+    # field numbers mean the same thing whichever way a card is written
+    per_row = _slots_per_row(layout)
+    entries = [entry.strip() for entry in row.split(",")]
+    slots = entries[:per_row]
+    # a free field row can hold more than one row's worth of fields
+    rest = entries[per_row:]
+    while rest:
+        slots.extend([""] + rest[:per_row - 2] + [""])
+        rest = rest[per_row - 2:]
+    if len(slots) % per_row:
+        slots.extend([""] * (per_row - len(slots) % per_row))
+    # long values don't fit the 16 wide fields the card is rewritten in
+    for index, slot in enumerate(slots):
+        if len(slot) > 16:
+            try:
+                slots[index] = stringify(float(slot), 16)
+            except ValueError:
+                pass
+    return slots
+
+
+def data_fields(slots, layout):
+    """The data fields of a card split into ``slots``, stripped: the
+    slots without the name and the continuation fields."""
+    per_row = _slots_per_row(layout)
+    return [slots[index].strip() for index in xrange(1, len(slots)) \
+            if 0 < index % per_row < per_row - 1]
+
+
+class BulkCard(object):
+    """One card of the bulk data.
+
+    ``start`` and ``end`` are its byte range in the template, ``layout``
+    how it is written there (SHORT, LONG, FREE or FREE_LONG).
+    ``original`` are its slots as parsed from the template, ``fields``
+    its slots with the changes of the current run applied (None if it
+    doesn't change) and ``rendered`` the text written in its place.
+    ``continuations`` is the (first, count) of the continuation numbers
+    its rendered rows use, which it keeps from run to run."""
+
+    __slots__ = ("name", "cid", "start", "end", "layout", "original",
+                 "fields", "rendered", "continuations")
+
+    def __init__(self, name, cid, start, end, layout):
+        self.name = name
+        self.cid = cid
+        self.start = start
+        self.end = end
+        self.layout = layout
+        self.original = None
+        self.fields = None
+        self.rendered = None
+        self.continuations = None
+
+
+class BulkDeck(TemplatePatcher):
+    """The bulk data of a template, indexed once and kept across runs.
+
+    Building a BulkDeck finds every card of the bulk data (short field,
+    long field or free field, with its continuations) in one pass over
+    the memory-mapped template. The fields of a card are only parsed
+    the first time it is changed, and are kept.
+
+    Every run, ``apply`` takes the changes recorded by a NastranMaker.
+    Only the cards whose fields are different from the last run are
+    rendered again, and cards that are no longer changed go back to
+    the template. ``write`` then writes the deck the way
+    TemplatePatcher does, copying everything else from the template.
+
+    Field numbers are the ones NastranMaker uses. A free field card
+    has the slots it would have if it were written with fixed fields.
+    """
+
+    def __init__(self, filename, unique_int=10001, bulk_only=False):
+        """
+        filename: str
+            The template Nastran file.
+
+        unique_int: int
+            The first continuation number of the rendered cards.
+
+        bulk_only: bool
+            Is the whole file bulk data, without BEGIN BULK, like a
+            file that is INCLUDEd in the bulk data?
+        """
+        super(BulkDeck, self).__init__(filename)
+        self._bulk_only = bulk_only
+
+        # all the cards, in the order of the template
+        self.cards = []
+        # {(name, id): BulkCard}
+        self.index = {}
+        # keys of the cards that are there more than once
+        self.duplicates = set()
+        # byte offsets of continuation rows that don't follow a card
+        self.orphans = []
+        # the files INCLUDEd in the bulk data, as they are written
+        self.includes = []
+        self._index_cards()
+
+        # the cards changed in the last run
+        self._modified = set()
+        # the next continuation number no card has. A card keeps the
+        # numbers it was given, so this only grows with the number of
+        # cards that are ever changed
+        self._unique_int = unique_int
+
+    def _index_cards(self):
+        """Find all the cards of the bulk data."""
+        current = None
+        in_bulk = self._bulk_only
+        position = 0
+        self._map.seek(0)
+        for line in iter(self._map.readline, ""):
+            start = position
+            position += len(line)
+            if not in_bulk:
+                in_bulk = begin_bulk_match.match(line) is not None
+                continue
+
+            if current is not None and line[:1] in CONTINUATION_STARTS \
+                   and line.strip():
+                current.end = position
+                continue
+            if line[:1] == "$":
+                # comments can come between the rows of a card
+                continue
+            if line[:1] in "+*," and line.strip():
+                self.orphans.append(start)
+            current = None
+
+            if not line[:1].isalpha():
+                # blank lines
+                continue
+            upper = line.upper()
+            if upper.startswith("ENDDATA"):
+                break
+            if upper.startswith("INCLUDE"):
+                match = include_match.match(line.strip())
+                self.includes.append(match.group(1) if match \
+                                     else line.strip())
+                continue
+            if upper.startswith("BEGIN"):
+                continue
+
+            name, cid, layout = _card_header(line)
+            current = BulkCard(name, cid, start, position, layout)
+            self.cards.append(current)
+            if (name, cid) in self.index:
+                self.duplicates.add((name, cid))
+            else:
+                self.index[(name, cid)] = current
+
+    def card(self, name, cid):
+        """The BulkCard ``name`` with id ``cid``."""
+        key = (name.upper().rstrip("*"), str(cid))
+        if key in self.duplicates:
+            raise RuntimeError("There were two cards with the " + \
+                               "same id. You don't want this. " + \
+                               "Two cards: " + key[0] + " id: " + key[1])
+        try:
+            return self.index[key]
+        except KeyError:
+            raise RuntimeError("Could not find card " + key[0] + \
+                               " with id " + key[1])
+
+    def _original(self, card):
+        """The slots of ``card`` as they are in the template."""
+        if card.original is None:
+            text = self._map[card.start:card.end]
+            slots = []
+            for row in text.split("\n"):
+                row = row.rstrip("\r")
+                if row.strip() and not row.startswith("$"):
+                    slots.extend(_row_slots(row, card.layout))
+            card.original = tuple(slots)
+        return card.original
+
+    @property
+    def modified(self):
+        """The cards changed in the last run."""
+        return self._modified
+
+    def rows(self, card):
+        """The rows ``card`` is written as in the run deck, and their
+        layout."""
+        if card.fields is not None:
+            text, layout = self._render(card), LONG
+        else:
+            text, layout = self._map[card.start:card.end], card.layout
+        return [row.rstrip("\r") for row in text.split("\n") \
+                if row.strip() and not row.startswith("$")], layout
+
+    def values(self, card, template=False):
+        """The data of ``card``, without the continuation fields and
+        stripped: the name, then the fields in order. They are the
+        values in the template if ``template`` is set, and the ones of
+        the current run if not."""
+        slots = (not template and card.fields) or self._original(card)
+        values = [card.name] + data_fields(slots, card.layout)
+        while len(values) > 1 and values[-1] == "":
+            del values[-1]
+        return values
+
+    def apply(self, changes):
+        """Make ``changes`` the changes of this run.
+
+        changes: {(name, id): [{"fieldnum": int, "value": value}]}
+            What NastranMaker records in ``names``.
+        """
+        touched = set()
+        for (name, cid), attrs in changes.iteritems():
+            card = self.card(name, cid)
+            touched.add(card)
+            fields = list(self._original(card))
+            long_card = _slots_per_row(card.layout) == 6
+            for attr in attrs:
+                fieldnum = field_slot(attr, long_card)
+                if fieldnum >= len(fields):
+                    fields.extend([""] * (fieldnum + 1 - len(fields)))
+                fields[fieldnum] = stringify(attr["value"], length=16)
+            if fields != card.fields:
+                card.fields = fields
+                card.rendered = None
+
+        for card in self._modified - touched:
+            card.fields = None
+            card.rendered = None
+        self._modified = touched
+
+    def _render(self, card):
+        """The text that replaces ``card`` in the run deck."""
+        if card.rendered is None:
+            long_card = _slots_per_row(card.layout) == 6
+            # the changes are already in the fields. The card's own
+            # continuation numbers are used again if there are enough
+            rows = None
+            if card.continuations is not None:
+                first, count = card.continuations
+                end, rows = _change_card(list(card.fields), long_card, [],
+                                         first)
+                if end - first > count:
+                    rows = None
+            if rows is None:
+                first = self._unique_int
+                end, rows = _change_card(list(card.fields), long_card, [],
+                                         first)
+                if end - 1 > MAX_CONTINUATION:
+                    raise RuntimeError("Ran out of continuation numbers " + \
+                                       "at " + card.name + " " + card.cid)
+                card.continuations = (first, end - first)
+                self._unique_int = end
+            # keep the newline after the card, if it had one
+            newline = "\n" if self._map[card.end-1] == "\n" else ""
+            card.rendered = "\n".join(rows) + newline
+        return card.rendered
+
+    def _patches(self, changes, input_variables, unique_int):
+        """Work out what to write instead of which byte ranges.
+
+        ``unique_int`` is ignored, the deck keeps its own count.
+        Returns a sorted list of (start, end, new bytes)."""
+        self.apply(changes)
+        replaced = self._replace_variables(input_variables)
+        starts = sorted(replaced)
+
+        patches = []
+        for card in self._modified:
+            # the cards are parsed once, they can't hold variables
+            index = bisect_left(starts, card.start)
+            if index < len(starts) and starts[index] < card.end:
+                raise RuntimeError("Card " + card.name + " with id " + \
+                                   card.cid + " has variables in " + \
+                                   "it and can't be changed in a " + \
+                                   "resident deck")
+            patches.append((card.start, card.end, self._render(card)))
+
+        for start, (end, line) in replaced.iteritems():
+            patches.append((start, end, line))
+
+        patches.sort()
+        return patches
+
+
+def included_decks(deck):
+    """Open the files INCLUDEd in the bulk data of the BulkDeck
+    ``deck``, and the files they INCLUDE, as BulkDecks. A relative
+    path is taken from the directory of the file that INCLUDEs it.
+
+    Returns (the decks, the INCLUDEs that couldn't be read). The
+    decks have to be closed.
+    """
+    decks = []
+    missing = []
+    seen = set([os.path.abspath(deck.filename)])
+    pending = [(deck, name) for name in deck.includes]
+    while pending:
+        parent, name = pending.pop(0)
+        filename = os.path.abspath(os.path.join(
+            os.path.dirname(parent.filename), name))
+        if filename in seen:
+            continue
+        seen.add(filename)
+        if not os.path.isfile(filename):
+            missing.append(name)
+            continue
+        if not os.path.getsize(filename):
+            # an empty file can't be mapped, and has no cards anyway
+            continue
+        included = BulkDeck(filename, bulk_only=True)
+        decks.append(included)
+        pending.extend([(included, child) for child in included.includes])
+    return decks, missing
@@ -0,0 +1,109 @@
+"""Defines FiniteDifferenceBatch, which writes the input files of a
+finite difference gradient from one rendered base deck, and the
+functions that run them in parallel and assemble the Jacobian."""
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from nastran_deck import BulkDeck
+from nastran_maker import NastranMaker
+from nastran_util import stringify, parse_reals
+
+# the base deck already uses continuation numbers from 10001, so the
+# perturbed cards start well above them
+FD_UNIQUE_INT = 80001
+
+
+def fd_steps(values, step, minimum=1.):
+    """Forward difference steps for ``values``: ``step`` relative to
+    the value, but never smaller than ``step * minimum``."""
+    values = numpy.asarray(values, dtype=float)
+    return step * numpy.maximum(numpy.abs(values), minimum)
+
+
+def written_steps(values, steps):
+    """The steps as they end up in the input files, once the base and
+    the perturbed values have been written in long fields. Dividing by
+    these instead of ``steps`` takes out the rounding."""
+    base = parse_reals([stringify(value, length=16) for value in values])
+    perturbed = parse_reals([stringify(value + step, length=16) \
+                             for value, step in zip(values, steps)])
+    return perturbed - base
+
+
+def fd_jacobian(base, perturbed, steps):
+    """Forward difference Jacobian.
+
+    base: array-like of shape (m,)
+        The outputs at the base point.
+
+    perturbed: array-like of shape (n, m)
+        The outputs with the j-th input perturbed, one row per input.
+
+    steps: array-like of shape (n,)
+
+    Returns an array of shape (m, n), one row per output.
+    """
+    base = numpy.asarray(base, dtype=float)
+    perturbed = numpy.asarray(perturbed, dtype=float) \
+                .reshape((len(steps), len(base)))
+    steps = numpy.asarray(steps, dtype=float)
+    if (steps == 0).any():
+        raise ValueError("A finite difference step is lost when the " + \
+                         "value is written to the input file")
+    return ((perturbed - base) / steps[:, numpy.newaxis]).T
+
+
+def run_jobs(function, jobs, workers=0):
+    """``map(function, jobs)``, with up to ``workers`` calls at the
+    same time (the number of cores if 0). ``function`` should spend
+    its time waiting on Nastran, not holding the interpreter."""
+    workers = min(len(jobs), workers or cpu_count())
+    if workers <= 1:
+        return map(function, jobs)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(function, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class FiniteDifferenceBatch(object):
+    """Writes perturbed copies of a run deck.
+
+    The base deck (the input file of the run at the base point) is
+    indexed once as a BulkDeck. Every perturbed deck then only renders
+    the one card that holds the perturbed field, and the rest is copied
+    from the base deck, so a batch of N perturbations costs a lot less
+    than N times NastranReplacer and NastranMaker on the template.
+    """
+
+    def __init__(self, base_path, bulk_only=False):
+        """
+        base_path: str
+            The input file of the base run.
+
+        bulk_only: bool
+            Is ``base_path`` only bulk data, like the ``design.bdf``
+            that the input file INCLUDEs with ``nastran_include_base``?
+        """
+        self.deck = BulkDeck(base_path, FD_UNIQUE_INT, bulk_only)
+
+    def close(self):
+        """Unmap the base deck."""
+        self.deck.close()
+
+    def write(self, filename, name, cid, field, value):
+        """Write the base deck with data field ``field`` (as for
+        ``NastranMaker.set_fields``) of card ``name`` ``cid`` set to
+        ``value`` to ``filename``. The field of the last ``write`` goes
+        back to its base value.
+
+        The changed cards of the base deck are written in long field,
+        so a ``fieldnum`` of the template's layout would point at
+        another field there; ``data_field`` turns it into ``field``."""
+        maker = NastranMaker([])
+        maker.set_fields([(name, cid, field)], [value])
+        self.deck.write(filename, maker)
@@ -0,0 +1,157 @@
+"""Defines the functions that find the property of every element of a
+template, and GroupIndex, which reduces element results to one value
+for every group of properties."""
+import numpy
+
+from nastran_deck import BulkDeck, included_decks
+from nastran_validator import ELEMENTS
+from nastran_parser import fill_ids
+
+# how the values of the elements of a group can be reduced to one;
+# blank (NaN) values are left out
+GROUP_REDUCTIONS = ["max", "min", "maxabs", "sum", "mean"]
+
+
+def element_properties(deck, included=()):
+    """The property of every element of a BulkDeck, and of the
+    BulkDecks ``included`` (the files it INCLUDEs).
+
+    Elements without a property card (CONROD, CONM2) are left out. A
+    blank property id is the id of the element, as for Nastran.
+
+    Returns (element ids, property ids, element names), as arrays in
+    the order of the element ids.
+    """
+    elements = []
+    pids = []
+    names = []
+    for each, card in [(each, card) for each in [deck] + list(included) \
+                       for card in each.cards]:
+        if card.name not in ELEMENTS:
+            continue
+        pid_index = ELEMENTS[card.name][0]
+        if pid_index is None:
+            continue
+        values = each.values(card)
+        pid = values[pid_index] if pid_index < len(values) else ""
+        elements.append(int(values[1]))
+        pids.append(int(pid or values[1]))
+        names.append(card.name)
+    order = numpy.argsort(elements, kind="mergesort")
+    return numpy.array(elements, dtype=int)[order], \
+           numpy.array(pids, dtype=int)[order], \
+           numpy.array(names, dtype=object)[order]
+
+
+def template_properties(filename):
+    """``element_properties`` of the template ``filename`` and of the
+    files its bulk data INCLUDEs.
+
+    Raises RuntimeError if an INCLUDEd file can't be read, since its
+    elements would be missing."""
+    deck = BulkDeck(filename)
+    included, missing = included_decks(deck)
+    try:
+        if missing:
+            raise RuntimeError("Could not read " + ", ".join(missing) + \
+                               ", which " + filename + " INCLUDEs, to " + \
+                               "find the property of every element")
+        return element_properties(deck, included)
+    finally:
+        for each in [deck] + included:
+            each.close()
+
+
+class GroupIndex(object):
+    """Which group every element is in, for reducing element results
+    to one value a group.
+
+    A group is a list of property ids, or one property id. The groups
+    are kept in the order they are given.
+    """
+
+    def __init__(self, elements, pids, groups):
+        """
+        elements, pids: arrays of int
+            The property of every element, as ``element_properties``
+            returns them.
+
+        groups: [int or [int]]
+            The property ids of every group.
+        """
+        group_of_pid = {}
+        for index, group in enumerate(groups):
+            if not isinstance(group, (list, tuple)):
+                group = [group]
+            for pid in group:
+                if int(pid) in group_of_pid:
+                    raise ValueError("Property " + str(pid) + \
+                                     " is in more than one group")
+                group_of_pid[int(pid)] = index
+        self.groups = list(groups)
+        self.elements = numpy.asarray(elements, dtype=int)
+        pids = numpy.asarray(pids, dtype=int)
+
+        group_pids = numpy.array(sorted(group_of_pid), dtype=int)
+        missing = ~numpy.in1d(group_pids, pids)
+        if missing.any():
+            raise ValueError("No element has property " + \
+                             str(group_pids[missing][0]))
+        # the group of every element, -1 if it isn't in one
+        group_numbers = numpy.array([group_of_pid[pid] \
+                                     for pid in group_pids], dtype=int)
+        where = numpy.minimum(numpy.searchsorted(group_pids, pids),
+                              len(group_pids) - 1)
+        self.element_groups = numpy.where(group_pids[where] == pids,
+                                          group_numbers[where], -1)
+
+    def group_of(self, ids):
+        """The group of every element in ``ids``, -1 if it isn't in
+        one. Raises RuntimeError for an element we don't know."""
+        ids = numpy.asarray(ids, dtype=int)
+        where = numpy.searchsorted(self.elements, ids)
+        where = numpy.minimum(where, len(self.elements) - 1)
+        unknown = self.elements[where] != ids
+        if unknown.any():
+            raise RuntimeError("Unknown element " + str(ids[unknown][0]))
+        return self.element_groups[where]
+
+    def reduce(self, ids, values, reduction="max"):
+        """Reduce the ``values`` of the elements ``ids`` (which can
+        repeat) to one value a group, in one pass.
+
+        Returns an array with a value for every group, NaN for a group
+        with no values.
+        """
+        if reduction not in GROUP_REDUCTIONS:
+            raise ValueError("Unknown reduction " + str(reduction) + \
+                             "; use one of " + ", ".join(GROUP_REDUCTIONS))
+        values = numpy.asarray(values, dtype=float)
+        groups = self.group_of(ids)
+        keep = groups >= 0
+        groups, values = groups[keep], values[keep]
+        order = numpy.argsort(groups, kind="mergesort")
+        groups, values = groups[order], values[order]
+
+        result = numpy.empty(len(self.groups))
+        result[...] = numpy.nan
+        if not len(values):
+            return result
+        starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]])
+        if reduction == "max":
+            reduced = numpy.fmax.reduceat(values, starts)
+        elif reduction == "min":
+            reduced = numpy.fmin.reduceat(values, starts)
+        elif reduction == "maxabs":
+            reduced = numpy.fmax.reduceat(numpy.abs(values), starts)
+        else:
+            present = ~numpy.isnan(values)
+            reduced = numpy.add.reduceat(numpy.where(present, values, 0.),
+                                         starts)
+            counts = numpy.add.reduceat(present.astype(int), starts)
+            if reduction == "mean":
+                reduced = reduced / numpy.maximum(counts, 1)
+            # a group of blanks stays NaN
+            reduced[counts == 0] = numpy.nan
+        result[groups[starts]] = reduced
+        return result
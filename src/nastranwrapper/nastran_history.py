@@ -0,0 +1,189 @@
+"""Defines the functions that read a time or frequency history (the
+output of a transient or frequency response run, SORT1 or SORT2) into
+one array of (step, id, component), without parsing every page into a
+grid the way NastranParser does."""
+import re
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from nastran_parser import readable_header, _is_dumbcaps
+from nastran_util import parse_reals
+
+# the step of the tables that follow, in SORT1
+step_match = re.compile("^.\\s*(TIME|FREQUENCY|EIGENVALUE|LOAD STEP)" \
+                        "\\s*=\\s*(?P<value>\\S+)")
+
+# the point or element of the tables that follow, in SORT2
+id_match = re.compile("^.\\s*(POINT|ELEMENT)-ID\\s*=\\s*(?P<value>\\d+)")
+
+subcase_match = re.compile("SUBCASE (\\d+)")
+
+# the first field of a row of numbers, after the carriage control
+row_match = re.compile("^.\\s*[-+]?(\\d|\\.\\d)")
+
+# how complex output is printed
+REAL_IMAGINARY = "REAL/IMAGINARY"
+MAGNITUDE_PHASE = "MAGNITUDE/PHASE"
+
+
+def _is_number(token):
+    return not token.isalpha()
+
+
+def _scan(lines, header, subcase):
+    """Find the rows of the ``header`` tables of ``subcase``.
+
+    Returns (steps, ids, rows, imaginary, form): the step and id of
+    every row as strings, its values as lists of strings, the second
+    part of every complex row (None if the output is real) and how the
+    complex output is printed (REAL_IMAGINARY or MAGNITUDE_PHASE).
+    """
+    header = header.lower()
+    steps = []
+    ids = []
+    rows = []
+    imaginary = []
+    form = None
+
+    step = None
+    current_id = None
+    sort2 = False
+    current_subcase = None
+    in_table = False
+    is_complex = False
+    second = False
+    for line in lines:
+        if "PAGE" in line:
+            # the step, id and header are printed again on every page
+            in_table = False
+            is_complex = False
+            second = False
+            continue
+
+        if row_match.match(line):
+            if not in_table:
+                continue
+            tokens = [token for token in line[1:].split() \
+                      if _is_number(token)]
+            if second:
+                # the imaginary part, or the phase, of the row above
+                imaginary[-1] = tokens
+                second = False
+                continue
+            if sort2:
+                steps.append(tokens[0])
+                ids.append(current_id)
+            else:
+                steps.append(step)
+                ids.append(tokens[0])
+            rows.append(tokens[1:])
+            imaginary.append([])
+            second = is_complex
+            continue
+
+        match = step_match.match(line)
+        if match:
+            step = match.group("value")
+            sort2 = False
+        match = id_match.match(line)
+        if match:
+            current_id = match.group("value")
+            sort2 = True
+        match = subcase_match.search(line)
+        if match:
+            current_subcase = int(match.group(1))
+
+        if REAL_IMAGINARY in line or MAGNITUDE_PHASE in line:
+            is_complex = True
+            form = MAGNITUDE_PHASE if MAGNITUDE_PHASE in line \
+                   else REAL_IMAGINARY
+        elif line.strip() and header in readable_header(line):
+            in_table = subcase is None or current_subcase == subcase
+        elif _is_dumbcaps(line.strip()):
+            # the header of some other table
+            in_table = False
+    if form is None:
+        imaginary = None
+    return steps, ids, rows, imaginary, form
+
+
+def _numbers(rows, width):
+    """The rows of strings as one array of (row, column), NaN where a
+    row is too short."""
+    strings = []
+    for row in rows:
+        strings.extend(row + [""] * (width - len(row)))
+    return parse_reals(strings).reshape((len(rows), width))
+
+
+def read_history(lines, header, subcase=None, filename=None):
+    """Read the ``header`` tables of a transient or frequency response
+    run into one array.
+
+    Both SORT1 (a table of every id for each step) and SORT2 (a table
+    of every step for each id) output can be read. The tables should
+    have one row of numbers for every id and step (two for complex
+    output); columns that aren't numbers, like TYPE, are left out. All
+    the numbers are converted at once.
+
+    lines: [str]
+        The lines of the output, without newlines.
+
+    header: str
+        The header of the tables, or part of it, like
+        "displacement vector".
+
+    subcase: None or int
+        Only read the tables of this subcase.
+
+    filename: None or str
+        If given, the values are written to this ``.npy`` file, which
+        is memory mapped instead of being kept in memory.
+
+    Returns (steps, ids, values). ``steps`` are the times or
+    frequencies, in order, ``ids`` the points or elements, in order,
+    and ``values`` is an array of (step, id, component). It is
+    complex if the output was, whether it was printed as real and
+    imaginary parts or as magnitude and phase (in degrees). Values
+    that aren't printed are NaN.
+    """
+    steps, ids, rows, imaginary, form = _scan(lines, header, subcase)
+    if not rows:
+        raise RuntimeError("Could not find any " + header + " history")
+
+    width = max([len(row) for row in rows])
+    numbers = _numbers(rows, width)
+    if imaginary is not None:
+        second = _numbers(imaginary, width)
+        if form == MAGNITUDE_PHASE:
+            numbers = numbers * numpy.exp(1j * numpy.radians(second))
+        else:
+            numbers = numbers + 1j * second
+
+    step_values, step_index = numpy.unique(parse_reals(steps),
+                                           return_inverse=True)
+    id_values, id_index = numpy.unique(numpy.array(ids).astype(int),
+                                       return_inverse=True)
+    shape = (len(step_values), len(id_values), width)
+    if filename:
+        values = open_memmap(filename, mode="w+", dtype=numbers.dtype,
+                             shape=shape)
+    else:
+        values = numpy.empty(shape, dtype=numbers.dtype)
+    values[...] = numpy.nan
+    values[step_index, id_index] = numbers
+    if filename:
+        values.flush()
+    return step_values, id_values, values
+
+
+def real_imaginary(values):
+    """The real and imaginary parts of a complex history."""
+    return values.real, values.imag
+
+
+def magnitude_phase(values):
+    """The magnitude and phase (in degrees, the way Nastran prints it)
+    of a complex history."""
+    return numpy.abs(values), numpy.degrees(numpy.angle(values))
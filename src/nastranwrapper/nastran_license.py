@@ -0,0 +1,144 @@
+"""Defines LicenseSemaphore, a file-lock based token pool that lets
+several processes on one machine share a fixed number of Nastran
+licenses, and helpers to recognize license failures in Nastran's output."""
+import os
+import re
+import time
+import errno
+import fcntl
+
+# Messages that Nastran (or the license manager it talks to) prints
+# when it could not check out a license. They are matched without
+# regard to case.
+LICENSE_FAILURE_PATTERNS = [
+    r"unable to (obtain|check ?out|acquire|get) .*licen[cs]e",
+    r"licen[cs]e .*(denied|unavailable|not available|expired|exhausted)",
+    r"licen[cs]e (checkout|request) failed",
+    r"no such feature exists",
+    r"flexlm error",
+    r"licensed number of users already reached",
+]
+
+
+class LicenseSemaphore(object):
+    """A counting semaphore shared by every process on this machine that
+    points at the same ``lock_dir``.
+
+    Each of the ``tokens`` licenses is represented by a file in
+    ``lock_dir``. Holding an exclusive ``flock`` on one of those files
+    means holding that license. The operating system drops the lock
+    when the holder exits, so a crashed optimizer never leaks a token.
+    """
+
+    def __init__(self, lock_dir, tokens, poll_interval=0.5):
+        """
+        lock_dir: str
+            Directory that holds the token files. It is created if
+            it does not exist.
+
+        tokens: int
+            How many licenses may be in use at the same time.
+
+        poll_interval: float
+            Seconds to sleep between attempts when every token is taken.
+        """
+        if tokens < 1:
+            raise ValueError("A LicenseSemaphore needs at least one token")
+        self.lock_dir = lock_dir
+        self.tokens = tokens
+        self.poll_interval = poll_interval
+        self._fd = None
+        self.token = None
+
+        if not os.path.isdir(lock_dir):
+            try:
+                os.makedirs(lock_dir)
+            except OSError, err:
+                # somebody else may have beaten us to it
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def _try_token(self, token):
+        """Try to lock token number ``token`` without blocking.
+
+        Returns True if we now hold it."""
+        filename = os.path.join(self.lock_dir, "token.%d" % token)
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, err:
+            os.close(fd)
+            if err.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return False
+            raise
+        self._fd = fd
+        self.token = token
+        return True
+
+    def acquire(self, timeout=None):
+        """Block until a token is available and take it.
+
+        timeout: float or None
+            Give up after this many seconds. None waits forever.
+
+        Returns the number of seconds spent waiting in the queue.
+        Raises RuntimeError if ``timeout`` expires first.
+        """
+        if self._fd is not None:
+            raise RuntimeError("This LicenseSemaphore already holds " + \
+                               "token " + str(self.token))
+        start = time.time()
+        # start at a different token in every process so that
+        # everybody doesn't fight over token 0
+        first = os.getpid() % self.tokens
+        while True:
+            for offset in range(self.tokens):
+                if self._try_token((first + offset) % self.tokens):
+                    return time.time() - start
+            if timeout is not None and time.time() - start >= timeout:
+                raise RuntimeError("Timed out after " + str(timeout) + \
+                                   " seconds waiting for one of the " + \
+                                   str(self.tokens) + " license tokens " + \
+                                   "in " + self.lock_dir)
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        """Give back the token we hold. Releasing twice is harmless."""
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self.token = None
+
+
+def license_failure(filenames, patterns=None):
+    """Look through Nastran's output files for a license failure.
+
+    filenames: [str]
+        Files to search (the output file, the log file, ...). Files
+        that do not exist are skipped.
+
+    patterns: [str] or None
+        Regular expressions to look for. Defaults to
+        ``LICENSE_FAILURE_PATTERNS``.
+
+    Returns the first offending line (stripped) or None.
+    """
+    if patterns is None:
+        patterns = LICENSE_FAILURE_PATTERNS
+    matcher = re.compile("|".join(["(?:%s)" % p for p in patterns]),
+                         re.IGNORECASE)
+    for filename in filenames:
+        if not os.path.exists(filename):
+            continue
+        fh = open(filename, "r")
+        try:
+            for line in fh:
+                if matcher.search(line):
+                    return line.strip()
+        finally:
+            fh.close()
+    return None
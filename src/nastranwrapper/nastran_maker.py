@@ -3,6 +3,9 @@ for Nastran files."""
 import re
 from nastran_util import stringify
 
+# the first row of a card: its name and id
+card_match = re.compile("(?P<name>[a-zA-Z0-9*]*) +(?P<num>\d+) ")
+
 class NastranMaker(object):
     """A object that performs specified replacements conforming
     to the Nastran format.
@@ -44,43 +47,69 @@ class NastranMaker(object):
         """
         self.names.setdefault((name, cid), []).append({"fieldnum": fieldnum, "value":value})
 
-    def _nastran_set(self, name, cid, attrs, unique_int):
-        """We go through the text that we have and make
-        the needed substitution.
+    def set_many(self, targets, values):
+        """Records many replacements at once.
 
-        name: str
-        
-        cid: int or str
-            Specifies the id of the card.
-            
-        attrs: [{fieldnum: value_to_insert}]
-            We may have to change a few fields for a given
-            line. Those changes are stored in attrs.
-            
-        unique_int: int
-            This integer is needed for writing out the
-            continuations in the Nastran file. It must be
-            unique within the file (!beware).
-            
+        targets: [(name, cid, fieldnum)]
+            Where the values go, as for ``set``.
+
+        values: sequence or numpy array
+            What to put there, one value per target.
         """
-        card = None
-        for index, line in enumerate(self.text):
-            if line.startswith(name):
-                match = re.match("(?P<name>[a-zA-Z0-9*]*) +(?P<num>\d+) ", line)
-                if match and \
-                       (match.group("name") == name or \
-                        match.group("name") == name + "*") \
-                        and match.group("num") == str(cid):
-                    if not card:
-                        card = index
-                    else:
-                        raise RuntimeError("There were two cards with the " + \
-                                        "same id. You don't want this. " + \
-                                        "Two cards: " + match.group("name") +\
-                                        " id: " + match.group("num"))
-
-        if card is None:
+        self._set_all(targets, values, "fieldnum")
+
+    def set_fields(self, targets, values):
+        """Like ``set_many``, but the targets are (name, cid, field),
+        where ``field`` counts only the data fields of the card: 1 is
+        the id, 2 the field after it, and so on across continuations.
+        Unlike ``fieldnum``, this doesn't depend on whether the card is
+        written in short or long field.
+        """
+        self._set_all(targets, values, "field")
+
+    def _set_all(self, targets, values, key):
+        """Record ``values`` for ``targets``, numbered by ``key``."""
+        if len(targets) != len(values):
+            raise ValueError("Got " + str(len(values)) + " values for " + \
+                             str(len(targets)) + " targets")
+        if hasattr(values, "tolist"):
+            # plain floats print the same way the scalar inputs do
+            values = values.tolist()
+        names = self.names
+        for (name, cid, number), value in zip(targets, values):
+            names.setdefault((name, cid), []).append({key: number,
+                                                      "value": value})
+
+    def _card_index(self):
+        """Where every card starts in ``self.text``, found in one pass
+        over it: {(name, id): [row]}."""
+        index = {}
+        for row, line in enumerate(self.text):
+            match = card_match.match(line)
+            if match:
+                index.setdefault((match.group("name"), match.group("num")),
+                                 []).append(row)
+        return index
+
+    def _find_card(self, name, cid, index=None):
+        """Find the card ``name`` with id ``cid`` and split it
+        into its fields. ``index`` is the ``_card_index`` of
+        ``self.text``, if it has already been made.
+
+        Returns the index of its first row in ``self.text``, the
+        index one past its last row, the list of fields (continuation
+        fields included) and whether it is a long card."""
+        if index is None:
+            index = self._card_index()
+        rows = index.get((name, str(cid)), []) + \
+               index.get((name + "*", str(cid)), [])
+        if len(rows) > 1:
+            raise RuntimeError("There were two cards with the " + \
+                               "same id. You don't want this. " + \
+                               "Two cards: " + name + " id: " + str(cid))
+        if not rows:
             raise RuntimeError("Could not find card " + name + " with id " + str(cid))
+        card = rows[0]
 
         # are we dealing with a long card?
         long_card = False
@@ -117,54 +146,63 @@ class NastranMaker(object):
 
             current_row += 1
 
-        # we want to delete the row(s) from the file
-        del self.text[card:current_row]
-
-        # now we add the field with the change applied
-        # we're also going to conver the field to long
-        # form and add it to the end of the file
-        long_format = 16
-        divisions = 6
-
-        # change the value we're supposed to change
-        for attr in attrs:
-            fieldnum = attr["fieldnum"]
-            value = attr["value"]
-
-            #print "supposed to change", fieldnum, "to", value
-
-            items[fieldnum] = stringify(value, length=long_format)
-
-        # remove the continuations
-        to_remove = None
-        if not long_card:
-            to_remove = [i for i in range(9, len(items), 10)] + \
-                        [i for i in range(10, len(items), 10)]
-        else:
-            to_remove = [i for i in range(5, len(items), 6)] + \
-                        [i for i in range(6, len(items), 6)]
-
-        to_remove.sort(reverse=True)
-        for i in to_remove:
-            del items[i]
-
-
-        # write it to the end of the file
-        unique_int, new_rows = _items_to_long_form(items, unique_int)
-
-        for row in new_rows[::-1]:
-            self.text.insert(card, row)
-
-        #print "\n".join(new_rows)
-        return unique_int
+        return card, current_row, items, long_card
 
     def _output(self, unique_id):
         """A little helper that just commits all the changes
         that should be made.
 
         This changes self.text"""
+        unique_id, replaced = self._change_cards(unique_id)
+        text = []
+        last = 0
+        for card, end, new_rows in sorted(replaced):
+            text.extend(self.text[last:card])
+            text.extend(new_rows)
+            last = end
+        text.extend(self.text[last:])
+        self.text[:] = text
+
+    def _change_cards(self, unique_int):
+        """Apply the changes to all the cards, which are found through
+        one ``_card_index`` of the text.
+
+        Returns the next unused ``unique_int`` and a list of
+        (index of the first row, index one past the last row, new
+        rows) of every changed card, in the order they were changed."""
+        index = self._card_index()
+        replaced = []
         for (name, cid), attrs in self.names.iteritems():
-            unique_id = self._nastran_set(name, cid, attrs, unique_id)
+            card, end, items, long_card = self._find_card(name, cid, index)
+            unique_int, new_rows = _change_card(items, long_card, attrs,
+                                                unique_int)
+            replaced.append((card, end, new_rows))
+        return unique_int, replaced
+
+    def split(self, unique_int=10001):
+        """Make the substitutions, but keep the changed cards apart
+        from the rest of the file.
+
+        The changed cards are taken out of ``self.text``, which is left
+        with everything that did not change, and returned (in long
+        form) as a list of rows. This is what you need to ``INCLUDE``
+        an unchanged base deck and only write the changed cards for
+        every run.
+
+        unique_int: int
+            Should be unique within the entire input file for Nastran
+            to work.
+        """
+        unique_int, replaced = self._change_cards(unique_int)
+        changed = []
+        for card, end, new_rows in replaced:
+            changed.extend(new_rows)
+        removed = set()
+        for card, end, new_rows in replaced:
+            removed.update(xrange(card, end))
+        self.text[:] = [line for row, line in enumerate(self.text) \
+                        if row not in removed]
+        return changed
 
     def write_to_file(self, file_handler, unique_int=10001):
         """After specifying the substitutions that should be made,
@@ -188,6 +226,78 @@ class NastranMaker(object):
 
 
 
+def field_slot(attr, long_card):
+    """Where in the list of slots of a card (continuation slots
+    included) the change ``attr`` goes. Raises ValueError for a
+    ``fieldnum`` that is a continuation field, which can't be set."""
+    if "field" not in attr:
+        slot = attr["fieldnum"]
+        per_row = 6 if long_card else 10
+        if slot > 0 and slot % per_row in (0, per_row - 1):
+            raise ValueError("Field " + str(slot) + " of a " + \
+                             ("long" if long_card else "short") + \
+                             " field card is a continuation field")
+        return slot
+    # 8 data fields a row in short field, 4 in long field
+    per_row = 4 if long_card else 8
+    row, column = divmod(attr["field"] - 1, per_row)
+    return row * (per_row + 2) + 1 + column
+
+
+def data_field(fieldnum, long_card):
+    """The ``field`` of ``set_fields`` (1 is the id) that is slot
+    ``fieldnum`` of a card written in short or long field. Unlike the
+    slot, it stays the same when the card is rewritten in long field.
+    Raises ValueError for a continuation slot."""
+    per_row = 6 if long_card else 10
+    row, column = divmod(fieldnum, per_row)
+    if column in (0, per_row - 1):
+        raise ValueError("Field " + str(fieldnum) + " of a " + \
+                         ("long" if long_card else "short") + \
+                         " field card is not a data field")
+    return row * (per_row - 2) + column
+
+
+def _change_card(items, long_card, attrs, unique_int):
+    """Apply ``attrs`` to the fields of a card found with
+    ``_find_card`` and write it back out in long form.
+
+    Returns the next unused ``unique_int`` and the new rows."""
+    # now we add the field with the change applied
+    # we're also going to conver the field to long
+    # form and add it to the end of the file
+    long_format = 16
+    divisions = 6
+
+    # change the value we're supposed to change
+    for attr in attrs:
+        fieldnum = field_slot(attr, long_card)
+        value = attr["value"]
+
+        #print "supposed to change", fieldnum, "to", value
+
+        if fieldnum >= len(items):
+            items.extend([""] * (fieldnum + 1 - len(items)))
+        items[fieldnum] = stringify(value, length=long_format)
+
+    # remove the continuations
+    to_remove = None
+    if not long_card:
+        to_remove = [i for i in range(9, len(items), 10)] + \
+                    [i for i in range(10, len(items), 10)]
+    else:
+        to_remove = [i for i in range(5, len(items), 6)] + \
+                    [i for i in range(6, len(items), 6)]
+
+    to_remove.sort(reverse=True)
+    for i in to_remove:
+        del items[i]
+
+
+    # write it to the end of the file
+    return _items_to_long_form(items, unique_int)
+
+
 def _items_to_long_form(items, unique_int):
     """Convert to Nastran long form.
 
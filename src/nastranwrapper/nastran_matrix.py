@@ -0,0 +1,409 @@
+"""Defines the functions that read the matrices Nastran writes with
+OUTPUT4 (formatted or binary) and punches as DMIG cards into numpy
+arrays or scipy.sparse matrices."""
+import re
+
+import numpy
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+from nastran_deck import _card_header, _row_slots, data_fields
+from nastran_util import parse_reals
+
+# NTYPE of OUTPUT4 and TIN of DMIG: real single, real double, complex
+# single and complex double precision
+REAL_SINGLE, REAL_DOUBLE, COMPLEX_SINGLE, COMPLEX_DOUBLE = 1, 2, 3, 4
+
+# the form of a symmetric DMIG, which only has one triangle
+SYMMETRIC = 6
+# a rectangular DMIG whose columns are numbered 1 to NCOL
+RECTANGULAR_NCOL = 9
+
+# the numbers that follow a formatted OUTPUT4 header, like 1P,3E23.16
+format_match = re.compile("(?P<count>\\d+)\\s*[EDG](?P<width>\\d+)",
+                          re.IGNORECASE)
+
+
+def _is_complex(ntype):
+    return ntype in (COMPLEX_SINGLE, COMPLEX_DOUBLE)
+
+
+def _words_per_value(ntype):
+    """Double precision numbers count as two words."""
+    if ntype in (REAL_DOUBLE, COMPLEX_DOUBLE):
+        return 2
+    return 1
+
+
+def _build(shape, rows, columns, values, sparse):
+    """A matrix of ``shape`` with ``values`` at (``rows``, ``columns``).
+    Values at the same place are added up."""
+    if sparse:
+        if scipy is None:
+            raise ValueError("Sparse matrices need scipy")
+        return scipy.sparse.coo_matrix((values, (rows, columns)),
+                                       shape=shape).tocsc()
+    matrix = numpy.zeros(shape, dtype=values.dtype)
+    numpy.add.at(matrix, (rows, columns), values)
+    return matrix
+
+
+def _runs(starts, lengths):
+    """The indices ``start, start+1, ..., start+length-1`` of every
+    (start, length), all in one array."""
+    starts = numpy.asarray(starts, dtype=int)
+    lengths = numpy.asarray(lengths, dtype=int)
+    total = lengths.sum()
+    offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(lengths) - \
+                                                 lengths, lengths)
+    return numpy.repeat(starts, lengths) + offsets
+
+
+class _Strings(object):
+    """The strings of nonzero values of one matrix, as they are read:
+    (column, first row, first value index, number of values)."""
+
+    def __init__(self):
+        self.columns = []
+        self.rows = []
+        self.starts = []
+        self.counts = []
+
+    def add(self, column, row, start, count):
+        self.columns.append(column)
+        self.rows.append(row)
+        self.starts.append(start)
+        self.counts.append(count)
+
+    def matrix(self, shape, numbers, complex_values, sparse):
+        """Put the ``numbers`` the strings index into a matrix."""
+        numbers = numpy.asarray(numbers)
+        if complex_values:
+            # the numbers of a string are real and imaginary parts
+            counts = numpy.asarray(self.counts, dtype=int) // 2
+            real = numbers[_runs(self.starts, 2 * counts)]
+            values = real[0::2] + 1j * real[1::2]
+        else:
+            counts = numpy.asarray(self.counts, dtype=int)
+            values = numbers[_runs(self.starts, counts)]
+        rows = _runs(self.rows, counts)
+        columns = numpy.repeat(self.columns, counts)
+        return _build(shape, rows, columns, values.astype(
+            complex if complex_values else float), sparse)
+
+
+def _string_header(words, position, bigmat):
+    """The length in words and the first row (from 0) of the string of
+    a sparse column that starts at ``words[position]``, and where its
+    values start."""
+    if bigmat:
+        # L counts the row word as well
+        length, row = int(words[position]), int(words[position + 1])
+        return length - 1, row - 1, position + 2
+    packed = int(words[position])
+    length = packed // 65536 - 1
+    return length, packed - 65536 * (length + 1) - 1, position + 1
+
+
+def _ascii_format(text):
+    """(values per line, width) of a formatted OUTPUT4 record."""
+    match = format_match.search(text)
+    if not match:
+        return 5, 16
+    return int(match.group("count")), int(match.group("width"))
+
+
+def _read_op4_ascii(lines, sparse):
+    """Read the matrices of a formatted OUTPUT4 file."""
+    matrices = {}
+    index = 0
+    while index < len(lines):
+        header = lines[index]
+        index += 1
+        if not header.strip():
+            continue
+        ncol, nrow, nform, ntype = [int(header[i:i + 8]) \
+                                    for i in range(0, 32, 8)]
+        name = header[32:40].strip()
+        per_line, width = _ascii_format(header[40:])
+        bigmat = nrow < 0
+        nrow = abs(nrow)
+        words = _words_per_value(ntype)
+
+        strings = _Strings()
+        chunks = []
+        numbers = 0
+        while index < len(lines):
+            icol, irow, nw = [int(lines[index][i:i + 8]) \
+                              for i in range(0, 24, 8)]
+            index += 1
+            if icol > ncol:
+                # the record after the last column closes the matrix
+                index += (nw // words + per_line - 1) // per_line
+                break
+            if irow > 0:
+                count = nw // words
+                used = (count + per_line - 1) // per_line
+                chunks.extend(lines[index:index + used])
+                strings.add(icol - 1, irow - 1, numbers, count)
+                numbers += used * per_line
+                index += used
+                continue
+
+            # a sparse column: strings, each with an integer header
+            left = nw
+            while left > 0:
+                header_words = [int(field) for field in \
+                                lines[index].split()]
+                index += 1
+                length, row, position = _string_header(header_words, 0,
+                                                       bigmat)
+                left -= length + position
+                count = length // words
+                used = (count + per_line - 1) // per_line
+                chunks.extend(lines[index:index + used])
+                strings.add(icol - 1, row, numbers, count)
+                numbers += used * per_line
+                index += used
+
+        # every line is cut into its fields at once
+        size = per_line * width
+        text = "".join([chunk.rstrip("\r\n").ljust(size)[:size] \
+                        for chunk in chunks])
+        fields = numpy.frombuffer(text, dtype="S" + str(width)) \
+                 if text else numpy.zeros(0, dtype="S1")
+        matrices[name] = strings.matrix((nrow, ncol), parse_reals(fields),
+                                        _is_complex(ntype), sparse)
+    return matrices
+
+
+def _read_op4_binary(data, endian, sparse):
+    """Read the matrices of a binary (Fortran unformatted) OUTPUT4
+    file."""
+    integer = numpy.dtype(endian + "i4")
+    matrices = {}
+    position = 0
+
+    def record():
+        """The bytes of the next record, and the position after it."""
+        length = int(numpy.frombuffer(data, integer, 1, position)[0])
+        start = position + 4
+        return data[start:start + length], start + length + 4
+
+    while position + 4 <= len(data):
+        header, position = record()
+        ncol, nrow, nform, ntype = numpy.frombuffer(header, integer, 4)
+        name = header[16:24].strip()
+        bigmat = nrow < 0
+        nrow = abs(int(nrow))
+        words = _words_per_value(ntype)
+        real = numpy.dtype(endian + ("f8" if words == 2 else "f4"))
+
+        strings = _Strings()
+        pieces = []
+        numbers = 0
+        while position + 4 <= len(data):
+            column, position = record()
+            icol, irow, nw = numpy.frombuffer(column, integer, 3)
+            if icol > ncol:
+                break
+            body = column[12:]
+            if irow > 0:
+                values = numpy.frombuffer(body, real)
+                pieces.append(values)
+                strings.add(icol - 1, irow - 1, numbers, len(values))
+                numbers += len(values)
+                continue
+
+            # a sparse column: strings, each with an integer header
+            body_words = numpy.frombuffer(body, integer)
+            word = 0
+            while word < len(body_words):
+                length, row, word = _string_header(body_words, word, bigmat)
+                values = numpy.frombuffer(body, real, length // words,
+                                          word * 4)
+                pieces.append(values)
+                strings.add(icol - 1, row, numbers, len(values))
+                numbers += len(values)
+                word += length
+
+        numbers = numpy.concatenate(pieces) if pieces else numpy.zeros(0)
+        matrices[name] = strings.matrix((nrow, ncol), numbers,
+                                        _is_complex(ntype), sparse)
+    return matrices
+
+
+def read_op4(filename, sparse=False):
+    """Read the matrices of an OUTPUT4 file, formatted or binary.
+
+    Both the column by column form and the sparse (string) forms,
+    including BIGMAT, are understood. The values of a matrix are
+    converted all at once, not one at a time.
+
+    filename: str
+
+    sparse: bool
+        Should the matrices be scipy.sparse (CSC) matrices instead of
+        numpy arrays? Needs scipy.
+
+    Returns {matrix name: matrix}.
+    """
+    fh = open(filename, "rb")
+    data = fh.read()
+    fh.close()
+
+    # a binary file starts with the length of the 24 byte header
+    for endian in ("<", ">"):
+        if len(data) >= 4 and \
+               numpy.frombuffer(data, numpy.dtype(endian + "i4"), 1)[0] == 24:
+            return _read_op4_binary(data, endian, sparse)
+    return _read_op4_ascii(data.split("\n"), sparse)
+
+
+def _cards(lines, name):
+    """The data fields of every ``name`` card in ``lines``."""
+    cards = []
+    slots = None
+    layout = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.startswith("$"):
+            continue
+        if line[:1] in " +*,":
+            if slots is not None:
+                slots.extend(_row_slots(line, layout))
+            continue
+        if slots is not None:
+            cards.append(data_fields(slots, layout))
+            slots = None
+        card_name, cid, layout = _card_header(line)
+        if card_name == name:
+            slots = _row_slots(line, layout)
+    if slots is not None:
+        cards.append(data_fields(slots, layout))
+    return cards
+
+
+def read_dmig(filename, sparse=False):
+    """Read the DMIG matrices of a punch (or bulk data) file.
+
+    filename: str
+
+    sparse: bool
+        As for ``read_op4``.
+
+    Returns {matrix name: (matrix, row dofs, column dofs)}. The dofs
+    are arrays of (grid, component), in the order of the rows and
+    columns. A symmetric matrix (IFO 6) is filled in from the triangle
+    that is given, and square ones have the same dofs both ways. The
+    columns of an IFO 9 matrix are (1, 0) to (NCOL, 0), given or not.
+    """
+    fh = open(filename, "r")
+    cards = _cards(fh.read().split("\n"), "DMIG")
+    fh.close()
+
+    headers = {}
+    entries = {}
+    for fields in cards:
+        if fields[1] == "0":
+            # NAME 0 IFO TIN TOUT POLAR blank NCOL
+            fields = fields + [""] * (8 - len(fields))
+            headers[fields[0]] = (int(fields[2]), int(fields[3]),
+                                  fields[5] == "1", int(fields[7] or 0))
+        else:
+            # NAME GJ CJ blank, then GI CI A B
+            entries.setdefault(fields[0], []).append(fields)
+
+    matrices = {}
+    for name, (form, tin, polar, ncol) in headers.iteritems():
+        # GJ, CJ, GI, CI, A and B of every term, each in a list of
+        # their own, so they are all read at once
+        columns = []
+        rows = []
+        parts = []
+        imaginary_parts = []
+        for fields in entries.get(name, []):
+            values = fields[4:]
+            values = values + [""] * (-len(values) % 4)
+            # rows that aren't full are padded with blank terms
+            terms = [values[i:i + 4] for i in xrange(0, len(values), 4) \
+                     if values[i]]
+            columns.extend([fields[1], fields[2]] * len(terms))
+            for term in terms:
+                rows.extend(term[:2])
+                parts.append(term[2])
+                imaginary_parts.append(term[3])
+
+        count = len(parts)
+        numbers = parse_reals(rows + columns + parts + imaginary_parts) \
+                  if count else numpy.zeros(0)
+        # a blank component is 0
+        ids = numpy.nan_to_num(numbers[:4 * count]).astype(int)
+        rows = ids[:2 * count].reshape((-1, 2))
+        columns = ids[2 * count:].reshape((-1, 2))
+        real = numbers[4 * count:5 * count]
+        imaginary = numpy.nan_to_num(numbers[5 * count:])
+        if _is_complex(tin):
+            if polar:
+                values = real * numpy.exp(1j * numpy.radians(imaginary))
+            else:
+                values = real + 1j * imaginary
+        else:
+            values = real
+
+        if form == SYMMETRIC:
+            # the other triangle, without the diagonal twice
+            off = numpy.any(rows != columns, axis=1)
+            rows, columns = numpy.concatenate([rows, columns[off]]), \
+                            numpy.concatenate([columns, rows[off]])
+            values = numpy.concatenate([values, values[off]])
+
+        if form == RECTANGULAR_NCOL:
+            # the rows are as many as the dofs they use, the columns
+            # as many as NCOL says
+            row_dofs, row_index = _dofs(rows)
+            column_index = columns[:, 0] - 1
+            if len(column_index) and (column_index.min() < 0 or \
+                                      column_index.max() >= ncol):
+                raise ValueError("DMIG " + name + " has a column " + \
+                                 "outside 1 to NCOL " + str(ncol))
+            column_dofs = numpy.column_stack(
+                [numpy.arange(1, ncol + 1), numpy.zeros(ncol, dtype=int)])
+        elif form == 2:
+            row_dofs, row_index = _dofs(rows)
+            column_dofs, column_index = _dofs(columns)
+        else:
+            dofs, index = _dofs(numpy.concatenate([rows, columns]))
+            row_dofs = column_dofs = dofs
+            row_index, column_index = index[:len(rows)], index[len(rows):]
+        matrices[name] = (_build((len(row_dofs), len(column_dofs)),
+                                 row_index, column_index, values, sparse),
+                          row_dofs, column_dofs)
+    return matrices
+
+
+def _dofs(pairs):
+    """The sorted unique (grid, component) ``pairs``, and where each
+    pair is among them."""
+    if not len(pairs):
+        return pairs, numpy.zeros(0, dtype=int)
+    keys = pairs[:, 0] * 10 + pairs[:, 1]
+    unique, index = numpy.unique(keys, return_inverse=True)
+    return numpy.column_stack([unique // 10, unique % 10]), index
+
+
+def read_matrices(filename, sparse=False):
+    """Read the matrices of ``filename``: DMIG cards if it is a punch
+    (or bulk data) file, OUTPUT4 otherwise.
+
+    Returns {matrix name: matrix}. The dofs of DMIG matrices are left
+    out; ``read_dmig`` has them.
+    """
+    extension = filename.lower().rsplit(".", 1)[-1]
+    if extension in ("pch", "bdf", "dat"):
+        return dict([(name, entry[0]) for name, entry \
+                     in read_dmig(filename, sparse).iteritems()])
+    return read_op4(filename, sparse)
@@ -4,6 +4,10 @@ import re
 import operator
 import copy
 
+import numpy
+
+from nastran_util import parse_reals
+
 NORMAL_LINE_LEN = 100
 
 class NastranParser(object):
@@ -502,36 +506,7 @@ class NastranParser(object):
             
         """
 
-        # find the grid we're talking about my matching
-        # the header
-        myindex = None
-        maybeindex = None # for partial matches
-        for index in range(len(self.grids)):
-            if self.headers[index]["actual"].strip() == header or \
-                   self.headers[index]["clean"] == header:
-                if not subcase or \
-                   (subcase and self.subcases[index] == subcase):
-                    myindex = index
-                    break
-                else:
-                    print "subcase mismatch!"
-                    print "should be subcase", subcase
-                    print "but the header's subcase is", self.subcases[index]
-            if header in self.headers[index]["actual"].strip() or \
-                header in self.headers[index]["clean"]:
-                if not subcase or \
-                   (subcase and self.subcases[index] == subcase):
-                    maybeindex = index
-
-
-        if myindex is None:
-            if maybeindex is None:
-                raise RuntimeError("Could not find " + header + \
-                                " in:\n" + \
-                                "\n".join(map(lambda x: x["actual"].strip(), self.headers)) + "\n - or -\n" + \
-                                "\n".join(map(operator.itemgetter("clean"), self.headers)))
-            else:
-                myindex = maybeindex
+        myindex = self._grid_index(header, subcase)
 
         # apply the dictionary of constraints in order
         # to eliminate rows that don't work (simple where clause)
@@ -587,6 +562,237 @@ class NastranParser(object):
 
         return result
 
+    def select(self, header, subcase, constraints, column_names,
+               id_column=None):
+        """Like ``get``, but a constraint can also be a sequence (or
+        array) of the values to keep, or a ``slice`` of them:
+        ``slice(1, 100)`` keeps 1 to 99, and either end can be None.
+        The rows are sorted by ``id_column``, by default the first
+        column with ID in its name; a row with a blank id, like the
+        other fiber of a plate, goes with the row above it.
+
+        Returns (ids, rows): the ids as an array of ints, None if the
+        grid has no id column, and the ``column_names`` columns of the
+        rows as an array of strings.
+        """
+        plan = self.plan(header, subcase, constraints, column_names,
+                         id_column)
+        return plan.ids, self.extract(plan)
+
+    def get_array(self, header, subcase, constraints, column_names,
+                  id_column=None):
+        """Like ``select``, with the rows as one array of floats,
+        converted all at once. Blanks are NaN.
+
+        Returns (ids, values).
+        """
+        ids, rows = self.select(header, subcase, constraints, column_names,
+                                id_column)
+        values = parse_reals(rows.ravel()) if rows.size \
+                 else numpy.zeros(0)
+        return ids, values.reshape(rows.shape)
+
+    def plan(self, header, subcase, constraints, column_names,
+             id_column=None, by_id=True):
+        """Work out where the rows ``select`` would return are, as a
+        GridPlan that ``extract`` can take them from again, in this
+        output or in the output of another run of the same deck.
+
+        by_id: bool
+            If False, the rows are kept in the order they are printed
+            (as ``get`` returns them) and the ids aren't read.
+
+        The other arguments are as for ``select``.
+        """
+        index = self._grid_index(header, subcase)
+        grid = self.grids[index]
+        if grid is None:
+            raise RuntimeError("The grid you are wanted (under header " +\
+                               self.headers[index]["actual"] + \
+                               ") could not or was not parsed.")
+        names = list(grid[0])
+        if id_column is None:
+            for name in names:
+                if re.search("\\bID\\b", name.upper()):
+                    id_column = name
+                    break
+        if column_names == "*":
+            column_names = names
+
+        def find(name):
+            if name not in names:
+                raise ValueError("Could not find column " + str(name) + \
+                                 " in " + ", ".join(names))
+            return names.index(name)
+
+        columns = [find(name) for name in column_names]
+        table = numpy.array(grid[1:], dtype=object) \
+                .reshape((-1, len(names)))
+        keep = numpy.ones(len(table), dtype=bool)
+        checks = set()
+        within = {}
+        for name, value in constraints.iteritems():
+            column = find(name)
+            checks.add(column)
+            if isinstance(value, slice) or (not isinstance(value, basestring) \
+                                            and hasattr(value, "__iter__")):
+                within[name] = value
+            else:
+                keep &= table[:, column] == str(value)
+
+        ids = None
+        if id_column is not None and len(table) and \
+               (by_id or id_column in within):
+            ids = fill_ids(table[:, find(id_column)])
+            checks.add(find(id_column))
+        for name, value in within.iteritems():
+            if name == id_column:
+                numbers = ids
+            else:
+                numbers = parse_reals(table[:, find(name)])
+            if isinstance(value, slice):
+                if value.start is not None:
+                    keep &= numbers >= value.start
+                if value.stop is not None:
+                    keep &= numbers < value.stop
+            else:
+                keep &= numpy.in1d(numbers, numpy.asarray(list(value),
+                                                          dtype=float))
+
+        rows = numpy.flatnonzero(keep)
+        if ids is not None and by_id:
+            rows = rows[numpy.argsort(ids[rows], kind="mergesort")]
+        checks = sorted(checks)
+        return GridPlan(index, self.headers[index]["actual"],
+                        self.subcases[index], names, len(grid), rows + 1,
+                        columns, None if ids is None or not by_id \
+                        else ids[rows], checks, table[rows][:, checks])
+
+    def extract(self, plan):
+        """Take the rows of a GridPlan from the grids.
+
+        The plan is only checked, not worked out again: the grid has to
+        be where it was, with the same header, columns and number of
+        rows, and the rows have to have the same ids and the values the
+        constraints asked for. Returns None if they don't, and
+        otherwise the columns of the rows as an array of strings.
+        """
+        if self.grids is None:
+            self.parse()
+        if plan.index >= len(self.grids):
+            return None
+        grid = self.grids[plan.index]
+        if grid is None or len(grid) != plan.length or \
+               self.headers[plan.index]["actual"] != plan.header or \
+               self.subcases[plan.index] != plan.subcase or \
+               list(grid[0]) != plan.names:
+            return None
+        block = numpy.array([grid[row] for row in plan.rows], dtype=object)
+        block = block.reshape((len(plan.rows), -1))
+        if block.shape[1] != len(plan.names) or \
+               not (block[:, plan.checks] == plan.values).all():
+            return None
+        return block[:, plan.columns]
+
+    def column_names(self, header, subcase):
+        """The names of the columns of the grid ``get`` would take
+        its values from."""
+        grid = self.grids[self._grid_index(header, subcase)]
+        if grid is None:
+            return []
+        return list(grid[0])
+
+    def _grid_index(self, header, subcase):
+        """The index of the grid ``get`` takes its values from: the
+        first one with the header ``header``, or else the last one
+        with ``header`` in its header. The grids are parsed if they
+        haven't been yet."""
+        if self.grids is None:
+            self.parse()
+
+        # find the grid we're talking about my matching
+        # the header
+        myindex = None
+        maybeindex = None # for partial matches
+        for index in range(len(self.grids)):
+            if self.headers[index]["actual"].strip() == header or \
+                   self.headers[index]["clean"] == header:
+                if not subcase or \
+                   (subcase and self.subcases[index] == subcase):
+                    myindex = index
+                    break
+                else:
+                    print "subcase mismatch!"
+                    print "should be subcase", subcase
+                    print "but the header's subcase is", self.subcases[index]
+            if header in self.headers[index]["actual"].strip() or \
+                header in self.headers[index]["clean"]:
+                if not subcase or \
+                   (subcase and self.subcases[index] == subcase):
+                    maybeindex = index
+
+
+        if myindex is None:
+            if maybeindex is None:
+                raise RuntimeError("Could not find " + header + \
+                                " in:\n" + \
+                                "\n".join(map(lambda x: x["actual"].strip(), self.headers)) + "\n - or -\n" + \
+                                "\n".join(map(operator.itemgetter("clean"), self.headers)))
+            else:
+                myindex = maybeindex
+        return myindex
+
+
+class GridPlan(object):
+    """Where the rows of a ``select`` are in the grids of a
+    NastranParser: made by ``NastranParser.plan`` and taken from the
+    grids again by ``NastranParser.extract``."""
+
+    def __init__(self, index, header, subcase, names, length, rows,
+                 columns, ids, checks, values):
+        """
+        index: int
+            The index of the grid.
+
+        header, subcase, names, length:
+            The header, subcase, column names and number of rows
+            (with the names) of the grid.
+
+        rows, columns: [int]
+            The indices of the rows and columns that are returned.
+
+        ids: None or array of int
+            The id of every row.
+
+        checks, values:
+            The columns the constraints and ids are in, and their
+            values in the rows.
+        """
+        self.index = index
+        self.header = header
+        self.subcase = subcase
+        self.names = names
+        self.length = length
+        self.rows = rows
+        self.columns = columns
+        self.ids = ids
+        self.checks = checks
+        self.values = values
+
+
+def fill_ids(ids):
+    """The ids of the rows of a grid, as ints. A blank id (the second
+    row of an element, like the other fiber of a plate) is the id of
+    the row above it."""
+    ids = numpy.array([str(value).strip() for value in ids], dtype=object)
+    present = ids != ""
+    if not len(ids) or not present[0]:
+        raise RuntimeError("The first row has no id")
+    # the index of the last row with an id, for every row
+    last = numpy.maximum.accumulate(numpy.where(present,
+                                                numpy.arange(len(ids)), 0))
+    return ids[last].astype(float).astype(int)
+
 
 def _header_score(line, row):
     """A helper function to assign the most likely headers.
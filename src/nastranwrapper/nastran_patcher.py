@@ -0,0 +1,226 @@
+"""Defines TemplatePatcher, which writes run decks by copying the
+unchanged byte ranges of a memory-mapped template and writing only the
+changed cards in between."""
+import os
+import re
+import mmap
+
+from nastran_maker import NastranMaker, _change_card
+from nastran_replacer import NastranReplacer, variable_match
+
+# rows that continue the card above them start with one of these
+CONTINUATION_STARTS = " +*,"
+
+
+def _write_all(fd, data):
+    """os.write until all of ``data`` (a str or buffer) is written."""
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+
+class TemplatePatcher(object):
+    """Renders run decks from a template without ever holding the whole
+    template as a Python string.
+
+    The template is memory mapped once. For every run, we find the byte
+    ranges of the cards NastranMaker changes (and of the lines holding
+    NastranReplacer variables), render just those, and build the deck by
+    copying everything else straight from the map. Where the operating
+    system can copy between files by itself (``os.copy_file_range`` or
+    ``os.sendfile``), the unchanged bytes never pass through Python.
+
+    The output is the same as NastranReplacer followed by
+    ``NastranMaker.write_to_file``.
+    """
+
+    def __init__(self, filename):
+        """
+        filename: str
+            The template Nastran file.
+        """
+        self.filename = filename
+        self._fh = open(filename, "rb")
+        self._map = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # {(name, cid): (start, end)}, filled in as cards are asked for
+        self._cards = {}
+        self._variable_lines = None
+
+    def close(self):
+        """Unmap the template."""
+        self._map.close()
+        self._fh.close()
+
+    def _line_end(self, position):
+        """Byte offset just past the newline of the line at ``position``."""
+        end = self._map.find("\n", position)
+        if end < 0:
+            return len(self._map)
+        return end + 1
+
+    def _card_end(self, start):
+        """Byte offset just past the last row of the card at ``start``."""
+        end = self._line_end(start)
+        while end < len(self._map) and \
+                  self._map[end] in CONTINUATION_STARTS and \
+                  self._map[end:self._line_end(end)].strip():
+            end = self._line_end(end)
+        return end
+
+    def _find_cards(self, keys):
+        """Find the byte ranges of all the cards in ``keys`` that we
+        haven't looked for yet, in one pass over the template."""
+        missing = [key for key in keys if key not in self._cards]
+        if not missing:
+            return
+
+        wanted = set([(name, str(cid)) for name, cid in missing])
+        names = sorted(set([re.escape(name) for name, cid in missing]))
+        matcher = re.compile("^(?P<name>" + "|".join(names) + \
+                             ")\\*? +(?P<num>\\d+) ", re.MULTILINE)
+        found = {}
+        for match in matcher.finditer(self._map):
+            key = (match.group("name"), match.group("num"))
+            if key not in wanted:
+                continue
+            if key in found:
+                raise RuntimeError("There were two cards with the " + \
+                                   "same id. You don't want this. " + \
+                                   "Two cards: " + key[0] + \
+                                   " id: " + key[1])
+            found[key] = (match.start(), self._card_end(match.start()))
+
+        for name, cid in missing:
+            if (name, str(cid)) not in found:
+                raise RuntimeError("Could not find card " + name + \
+                                   " with id " + str(cid))
+            self._cards[(name, cid)] = found[(name, str(cid))]
+
+    def _find_variable_lines(self):
+        """Byte ranges of the lines holding NastranReplacer variables,
+        without the newline."""
+        if self._variable_lines is None:
+            lines = []
+            last = -1
+            for match in variable_match.finditer(self._map):
+                start = self._map.rfind("\n", 0, match.start()) + 1
+                if start == last:
+                    continue
+                end = self._map.find("\n", match.start())
+                if end < 0:
+                    end = len(self._map)
+                lines.append((start, end))
+                last = start
+            self._variable_lines = lines
+        return self._variable_lines
+
+    def _replace_variables(self, input_variables):
+        """Run NastranReplacer on all the lines with variables at once.
+
+        Returns {start: (end, new line)}."""
+        replaced = {}
+        variable_lines = self._find_variable_lines()
+        if variable_lines or input_variables:
+            replacer = NastranReplacer([self._map[start:end] for \
+                                        start, end in variable_lines])
+            replacer.replace(input_variables)
+            for (start, end), line in zip(variable_lines, replacer.text):
+                replaced[start] = (end, line)
+        return replaced
+
+    def _patches(self, changes, input_variables, unique_int):
+        """Work out what to write instead of which byte ranges.
+
+        Returns a sorted list of (start, end, new bytes)."""
+        # NastranReplacer first, on all the variable lines at once
+        replaced = self._replace_variables(input_variables)
+
+        self._find_cards(changes.keys())
+        patches = []
+        in_cards = set()
+        # same order as NastranMaker, so the continuations get the
+        # same numbers
+        for (name, cid), attrs in changes.iteritems():
+            start, end = self._cards[(name, cid)]
+            rows = []
+            position = start
+            while position < end:
+                line_end = self._map.find("\n", position, end)
+                if line_end < 0:
+                    line_end = end
+                if position in replaced:
+                    rows.append(replaced[position][1])
+                    in_cards.add(position)
+                else:
+                    rows.append(self._map[position:line_end])
+                position = line_end + 1
+
+            maker = NastranMaker(rows)
+            card, card_end, items, long_card = maker._find_card(name, cid)
+            unique_int, new_rows = _change_card(items, long_card, attrs,
+                                                unique_int)
+            # keep the newline after the card, if it had one
+            newline = "\n" if self._map[end-1] == "\n" else ""
+            patches.append((start, end, "\n".join(new_rows) + newline))
+
+        for start, (end, line) in replaced.iteritems():
+            if start not in in_cards:
+                patches.append((start, end, line))
+
+        patches.sort()
+        return patches
+
+    def write(self, filename, maker, input_variables=None,
+              unique_int=10001):
+        """Write a run deck.
+
+        filename: str
+            Where to write it.
+
+        maker: NastranMaker
+            Only its recorded changes (``maker.names``) are used.
+
+        input_variables: {variable_name: value}
+            Values for the NastranReplacer variables, if any.
+
+        unique_int: int
+            Should be unique within the entire input file for Nastran
+            to work.
+        """
+        patches = self._patches(maker.names, input_variables or {},
+                                unique_int)
+
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+        try:
+            position = 0
+            for start, end, data in patches:
+                self._copy(fd, position, start)
+                _write_all(fd, data)
+                position = end
+            self._copy(fd, position, len(self._map))
+        finally:
+            os.close(fd)
+
+    def _copy(self, fd, start, end):
+        """Copy bytes ``start:end`` of the template to ``fd``."""
+        if end <= start:
+            return
+        source = self._fh.fileno()
+        count = end - start
+        if hasattr(os, "copy_file_range"):
+            while count > 0:
+                copied = os.copy_file_range(source, fd, count, start)
+                if copied == 0:
+                    break
+                start += copied
+                count -= copied
+        elif hasattr(os, "sendfile"):
+            while count > 0:
+                copied = os.sendfile(fd, source, start, count)
+                if copied == 0:
+                    break
+                start += copied
+                count -= copied
+        if count > 0:
+            _write_all(fd, buffer(self._map, start, count))
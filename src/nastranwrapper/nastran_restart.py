@@ -0,0 +1,307 @@
+"""Defines RestartDatabase, a master Nastran database kept from a
+baseline run, and the functions that write the RESTART runs that reuse
+it."""
+import os
+import re
+import json
+import errno
+import fcntl
+import hashlib
+from shutil import rmtree
+
+from nastran_case_control import case_control_bounds, echo_match
+from nastran_deck import _card_header
+from nastran_parser import readable_header
+from nastran_util import parse_reals
+
+# the baseline run's database files are master.MASTER, master.DBALL, ...
+MASTER_NAME = "master"
+
+# where a RestartDatabase keeps the index of the sorted bulk data echo
+INDEX_FILENAME = "echo.index"
+
+# and the values of the cards the baseline run changed
+VALUES_FILENAME = "baseline.json"
+
+echo_row_match = re.compile("^\\s*(?P<count>\\d+)-")
+
+
+def template_key(filename):
+    """A key that changes whenever the contents of ``filename`` do."""
+    digest = hashlib.sha1()
+    fh = open(filename, "rb")
+    try:
+        for block in iter(lambda: fh.read(1 << 20), ""):
+            digest.update(block)
+    finally:
+        fh.close()
+    return digest.hexdigest()
+
+
+def sorted_echo_deck(lines):
+    """The lines of an input file with ``ECHO = SORT`` in the Case
+    Control, which the baseline run needs so that its bulk data can be
+    indexed."""
+    cend, begin = case_control_bounds(lines)
+    lines = list(lines)
+    for index in range(cend + 1, begin):
+        match = echo_match.match(lines[index])
+        if match:
+            lines[index] = match.group("indent") + "ECHO = SORT"
+            return lines
+    return lines[:cend+1] + ["ECHO = SORT"] + lines[cend+1:]
+
+
+def parse_sorted_echo(lines, partitions=(0,)):
+    """Index the sorted bulk data echo of a Nastran output file.
+
+    Every row of the echo, continuations included, is numbered, and
+    the card images all start in the column of the first one.
+
+    lines: [str]
+        The lines of the output file.
+
+    partitions: [int]
+        The superelements of the ``BEGIN SUPER`` partitions of the bulk
+        data, in the order of the template, the residual (0) first.
+        Every partition has its own echo, numbered from 1.
+
+    Returns {(superelement, name, id): (first count, last count)}, the
+    rows of every card.
+    """
+    ranges = {}
+    column = None
+    current = None
+    in_echo = False
+    partition = -1
+    last_count = None
+    for line in lines:
+        if not in_echo:
+            if line.strip() and \
+                   "sorted bulk data echo" in readable_header(line):
+                in_echo = True
+            continue
+        match = echo_row_match.match(line)
+        if not match:
+            if "ENDDATA" in line:
+                # the echo of the next partition has its own header
+                in_echo = False
+            continue
+        count = int(match.group("count"))
+        if last_count is None or count <= last_count:
+            partition += 1
+            if partition >= len(partitions):
+                raise RuntimeError("There are more sorted bulk data " + \
+                                   "echoes than partitions")
+        last_count = count
+        rest = line[match.end():]
+        if column is None:
+            column = match.end() + len(rest) - len(rest.lstrip())
+        image = line[column:]
+        if image[:1].isalpha():
+            name, cid, layout = _card_header(image)
+            current = (partitions[partition], name, cid)
+            ranges[current] = (count, count)
+        elif current is not None:
+            ranges[current] = (ranges[current][0], count)
+    return ranges
+
+
+def delete_entries(ranges):
+    """``/`` entries that delete the rows ``ranges`` of the sorted bulk
+    data, joining ranges that touch."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(last, merged[-1][1])
+        else:
+            merged.append([first, last])
+    return ["/".ljust(8) + str(first).ljust(8) + str(last) \
+            for first, last in merged]
+
+
+def _same_field(first, second):
+    """Do the fields ``first`` and ``second`` hold the same value?
+    Reals are compared as numbers (``2.5`` and ``2.50``), but an
+    integer isn't the same as a real."""
+    if first == second:
+        return True
+    if ("." in first) != ("." in second):
+        return False
+    try:
+        first, second = parse_reals([first, second])
+    except ValueError:
+        return False
+    return first == second
+
+
+def changed_cards(deck, baseline):
+    """The cards of the BulkDeck ``deck`` changed in its last run whose
+    values aren't the ones they have in the baseline database. A card
+    that is set back to its baseline value doesn't have to be replaced.
+
+    baseline: {(name, id): values}
+        The values (as ``BulkDeck.values`` gives them) of the cards the
+        baseline run changed. The other cards have their values in the
+        template.
+
+    Returns the cards, in the order of the template.
+    """
+    changed = []
+    for card in sorted(deck.modified, key=lambda card: card.start):
+        values = baseline.get((card.name, card.cid))
+        if values is None:
+            values = deck.values(card, template=True)
+        current = deck.values(card)
+        if len(current) != len(values) or \
+               not all([_same_field(first, second) \
+                        for first, second in zip(current, values)]):
+            changed.append(card)
+    return changed
+
+
+def restart_deck(head, master, sections):
+    """The input file of a RESTART run.
+
+    head: [str]
+        The lines of the template up to and including ``BEGIN BULK``.
+
+    master: str
+        The MASTER file of the baseline database.
+
+    sections: {superelement: ([str], [str])}
+        The ``/`` entries (from ``delete_entries``) and the rows of the
+        cards that replace the deleted ones, for every partition of
+        the bulk data that changes. 0 is the residual structure.
+
+    Returns the lines.
+    """
+    lines = ["RESTART VERSION=1,KEEP",
+             "ASSIGN MASTER='" + master + "'"] + list(head)
+    for seid in sorted(sections):
+        deletes, cards = sections[seid]
+        if seid:
+            lines.append("BEGIN SUPER=" + str(seid))
+        lines.extend(deletes)
+        lines.extend(cards)
+    return lines + ["ENDDATA"]
+
+
+class RestartDatabase(object):
+    """The database of a baseline run and the index of its sorted bulk
+    data echo, in ``directory/key``.
+
+    Every process that uses the same template shares it. The baseline
+    run and every RESTART run write to the database, so they hold an
+    exclusive ``flock`` on it while they run.
+    """
+
+    def __init__(self, directory, key):
+        """
+        directory: str
+            Where the databases are kept.
+
+        key: str
+            Identifies the template, see ``template_key``.
+        """
+        self.key = key
+        self.path = os.path.join(directory, key)
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError, err:
+                # somebody else may have beaten us to it
+                if err.errno != errno.EEXIST:
+                    raise
+        self._fd = None
+
+    @property
+    def dbs(self):
+        """What to give Nastran as ``dbs=`` for the baseline run."""
+        return os.path.join(self.path, MASTER_NAME)
+
+    @property
+    def master(self):
+        """The MASTER file of the baseline database."""
+        return self.dbs + ".MASTER"
+
+    def lock(self):
+        """Wait for the database to be free and take it."""
+        if self._fd is not None:
+            return
+        fd = os.open(os.path.join(self.path, "lock"),
+                     os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def unlock(self):
+        """Let the next run have the database. Unlocking twice is
+        harmless."""
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def ready(self):
+        """Has the baseline run finished?"""
+        return os.path.exists(os.path.join(self.path, INDEX_FILENAME)) \
+               and os.path.exists(self.master)
+
+    def save_index(self, ranges):
+        """Keep the index of the baseline's sorted bulk data echo. This
+        marks the database as ready."""
+        filename = os.path.join(self.path, INDEX_FILENAME)
+        fh = open(filename + ".tmp", "w")
+        for (seid, name, cid), (first, last) in sorted(ranges.iteritems()):
+            fh.write("%d %s %s %d %d\n" % (seid, name, cid, first, last))
+        fh.close()
+        os.rename(filename + ".tmp", filename)
+
+    def save_values(self, values):
+        """Keep the values of the cards the baseline run changed,
+        {(name, id): values}. Call it before ``save_index``."""
+        filename = os.path.join(self.path, VALUES_FILENAME)
+        fh = open(filename + ".tmp", "w")
+        json.dump([[name, cid, card_values] for (name, cid), card_values \
+                   in sorted(values.iteritems())], fh)
+        fh.close()
+        os.rename(filename + ".tmp", filename)
+
+    def load_values(self):
+        """The values saved by ``save_values``."""
+        fh = open(os.path.join(self.path, VALUES_FILENAME), "r")
+        entries = json.load(fh)
+        fh.close()
+        return dict([((str(name), str(cid)), [str(value) for value in values])
+                     for name, cid, values in entries])
+
+    def load_index(self):
+        """The index saved by ``save_index``."""
+        ranges = {}
+        fh = open(os.path.join(self.path, INDEX_FILENAME), "r")
+        for line in fh:
+            seid, name, cid, first, last = line.split()
+            ranges[(int(seid), name, cid)] = (int(first), int(last))
+        fh.close()
+        return ranges
+
+    def remove(self):
+        """Delete the database, once nobody is using it."""
+        self.lock()
+        try:
+            for name in os.listdir(self.path):
+                if name != "lock":
+                    filename = os.path.join(self.path, name)
+                    if os.path.isdir(filename):
+                        rmtree(filename)
+                    else:
+                        os.remove(filename)
+        finally:
+            self.unlock()
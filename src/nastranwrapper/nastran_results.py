@@ -0,0 +1,239 @@
+"""Defines the functions that derive results, like von Mises stresses
+and margins of safety, from the values Nastran prints. Every function
+works on a whole array at once: the components are along the last
+axis, and the other axes can be elements, subcases, steps, and so on."""
+import numpy
+
+from nastran_util import parse_reals
+
+
+def _components(values, counts):
+    values = numpy.asarray(values, dtype=float)
+    if values.shape[-1] not in counts:
+        raise ValueError("Expected " + " or ".join(map(str, counts)) + \
+                         " components, not " + str(values.shape[-1]))
+    return values
+
+
+def von_mises(stress):
+    """The von Mises stress of plane stress (NORMAL-X, NORMAL-Y,
+    SHEAR-XY) or of a full state of stress (XX, YY, ZZ, XY, YZ, ZX)."""
+    stress = _components(stress, (3, 6))
+    if stress.shape[-1] == 3:
+        sx, sy, txy = stress[..., 0], stress[..., 1], stress[..., 2]
+        return numpy.sqrt(sx * sx - sx * sy + sy * sy + 3 * txy * txy)
+    sx, sy, sz = stress[..., 0], stress[..., 1], stress[..., 2]
+    shear = stress[..., 3:]
+    return numpy.sqrt(.5 * ((sx - sy) ** 2 + (sy - sz) ** 2 + \
+                            (sz - sx) ** 2) + \
+                      3 * (shear * shear).sum(axis=-1))
+
+
+def principal_stresses(stress):
+    """The principal stresses, largest first, of plane stress (NORMAL-X,
+    NORMAL-Y, SHEAR-XY) or of a full state of stress (XX, YY, ZZ, XY,
+    YZ, ZX). The last axis has 2 or 3 of them."""
+    stress = _components(stress, (3, 6))
+    if stress.shape[-1] == 3:
+        center = .5 * (stress[..., 0] + stress[..., 1])
+        radius = numpy.hypot(.5 * (stress[..., 0] - stress[..., 1]),
+                             stress[..., 2])
+        return numpy.stack([center + radius, center - radius], axis=-1)
+    tensor = numpy.empty(stress.shape[:-1] + (3, 3))
+    for index, (row, column) in enumerate([(0, 0), (1, 1), (2, 2),
+                                           (0, 1), (1, 2), (2, 0)]):
+        tensor[..., row, column] = stress[..., index]
+        tensor[..., column, row] = stress[..., index]
+    return numpy.linalg.eigvalsh(tensor)[..., ::-1]
+
+
+def max_principal(stress):
+    """The largest principal stress."""
+    return principal_stresses(stress)[..., 0]
+
+
+def min_principal(stress):
+    """The smallest principal stress."""
+    return principal_stresses(stress)[..., -1]
+
+
+def max_shear(stress):
+    """The largest shear stress, half the difference of the largest
+    and smallest principal stresses (in the plane, for plane
+    stress)."""
+    principal = principal_stresses(stress)
+    return .5 * (principal[..., 0] - principal[..., -1])
+
+
+def combined_stress(stress):
+    """The stress of a rod from its AXIAL STRESS and TORSIONAL STRESS
+    (the last axis), sqrt(.5 * (2 axial**2 + 3 torsion**2))."""
+    stress = _components(stress, (2,))
+    axial, torsion = stress[..., 0], stress[..., 1]
+    return numpy.sqrt(.5 * (2 * axial * axial + 3 * torsion * torsion))
+
+
+def strain_energy_density(stress, strain):
+    """Half the sum of the products of the ``stress`` and ``strain``
+    components (with engineering shear strains), for each element."""
+    stress = numpy.asarray(stress, dtype=float)
+    strain = numpy.asarray(strain, dtype=float)
+    if stress.shape != strain.shape:
+        raise ValueError("The stresses and strains have different shapes")
+    return .5 * (stress * strain).sum(axis=-1)
+
+
+def margin_of_safety(stress, allowable, factor=1.):
+    """allowable / (factor * |stress|) - 1. An element with no stress
+    has an infinite margin."""
+    stress = numpy.abs(numpy.asarray(stress, dtype=float)) * factor
+    with numpy.errstate(divide="ignore"):
+        return numpy.asarray(allowable, dtype=float) / stress - 1.
+
+
+# the results a nastran_derived output can name
+DERIVED = {"von_mises": von_mises,
+           "max_principal": max_principal,
+           "min_principal": min_principal,
+           "max_shear": max_shear,
+           "combined_stress": combined_stress}
+
+# and how it can be reduced to one value. Blank values are left out.
+REDUCTIONS = {"max": numpy.nanmax,
+              "min": numpy.nanmin,
+              "maxabs": lambda values: numpy.nanmax(numpy.abs(values)),
+              "sum": numpy.nansum,
+              "mean": numpy.nanmean}
+
+
+def derived_value(rows, derived=None, reduce=None, allowable=None):
+    """Derive a result from the strings NastranParser found.
+
+    rows: [[str]]
+        The columns of the rows of a grid, as ``NastranParser.get``
+        returns them.
+
+    derived: None, str or function
+        One of the DERIVED results, or a function of an array with
+        the columns along the last axis. None keeps the first column.
+
+    reduce: None or str
+        One of the REDUCTIONS, to get one value for all the rows.
+
+    allowable: None or float
+        If given, the margin of safety of the result is returned.
+
+    Returns an array with one value for each row, or a float if it is
+    reduced.
+    """
+    if not rows:
+        raise RuntimeError("There are no rows to derive a result from")
+    values = parse_reals([value for row in rows for value in row])
+    values = values.reshape((len(rows), -1))
+
+    if derived is None:
+        result = values[:, 0]
+    elif callable(derived):
+        result = derived(values)
+    elif derived in DERIVED:
+        result = DERIVED[derived](values)
+    else:
+        raise ValueError("Unknown derived result " + str(derived) + \
+                         "; use a function or one of " + \
+                         ", ".join(sorted(DERIVED)))
+
+    if reduce is not None:
+        if reduce not in REDUCTIONS:
+            raise ValueError("Unknown reduction " + str(reduce) + \
+                             "; use one of " + ", ".join(sorted(REDUCTIONS)))
+        result = float(REDUCTIONS[reduce](result))
+
+    if allowable is not None:
+        result = margin_of_safety(result, allowable)
+        if reduce is not None:
+            result = float(result)
+    return result
+
+
+def ks_aggregate(values, rho=50.):
+    """The Kreisselmeier-Steinhauser envelope of ``values``, a smooth
+    upper bound of their largest that is at most log(n) / ``rho`` above
+    it. Blank (NaN) values are left out.
+
+    Returns (aggregate, its gradient with respect to ``values``).
+    """
+    values = numpy.asarray(values, dtype=float)
+    present = ~numpy.isnan(values)
+    if not present.any():
+        raise RuntimeError("There are no values to aggregate")
+    largest = values[present].max()
+    exponents = numpy.where(present, numpy.exp(rho * (numpy.where(
+        present, values, largest) - largest)), 0.)
+    total = exponents.sum()
+    return largest + numpy.log(total) / rho, exponents / total
+
+
+def pnorm_aggregate(values, p=8.):
+    """The ``p``-norm of ``values``, a smooth upper bound of their
+    largest magnitude that tends to it as ``p`` grows. Blank (NaN)
+    values are left out.
+
+    Returns (aggregate, its gradient with respect to ``values``).
+    """
+    values = numpy.asarray(values, dtype=float)
+    present = ~numpy.isnan(values)
+    if not present.any():
+        raise RuntimeError("There are no values to aggregate")
+    magnitudes = numpy.where(present, numpy.abs(values), 0.)
+    largest = magnitudes.max()
+    if largest == 0.:
+        return 0., numpy.zeros(values.shape)
+    # scaled by the largest, so that the powers can't overflow
+    scaled = magnitudes / largest
+    total = (scaled ** p).sum()
+    gradient = numpy.sign(numpy.where(present, values, 0.)) * \
+               scaled ** (p - 1) * total ** (1. / p - 1)
+    return largest * total ** (1. / p), gradient
+
+
+# the aggregates a nastran_aggregate output can name, and their
+# parameter (rho, or p) if nastran_rho isn't given
+AGGREGATES = {"ks": (ks_aggregate, 50.),
+              "pnorm": (pnorm_aggregate, 8.)}
+
+
+def aggregate_rows(rows, aggregate, rho=None, derived=None,
+                   constraint_allowable=None):
+    """Aggregate a result of every row NastranParser found into one
+    value.
+
+    rows, derived:
+        As for ``derived_value``.
+
+    aggregate: str
+        One of the AGGREGATES.
+
+    rho: None or float
+        The parameter of the aggregate, rho for ``ks`` and p for
+        ``pnorm``.
+
+    constraint_allowable: None or float
+        If given, the values are made into constraints,
+        |value| / allowable - 1, before they are aggregated. This is
+        not the margin of safety of ``derived_value``: a constraint is
+        satisfied when it is negative.
+
+    Returns (aggregate, its gradient with respect to the value of
+    every row).
+    """
+    if aggregate not in AGGREGATES:
+        raise ValueError("Unknown aggregate " + str(aggregate) + \
+                         "; use one of " + ", ".join(sorted(AGGREGATES)))
+    function, default = AGGREGATES[aggregate]
+    values = derived_value(rows, derived)
+    inner = 1.
+    if constraint_allowable is not None:
+        inner = numpy.nan_to_num(numpy.sign(values)) / constraint_allowable
+        values = numpy.abs(values) / constraint_allowable - 1.
+    value, gradient = function(values, default if rho is None else rho)
+    return float(value), gradient * inner
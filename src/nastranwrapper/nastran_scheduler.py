@@ -0,0 +1,253 @@
+"""Defines NastranScheduler, a machine-wide admission scheduler that keeps
+concurrent Nastran runs from oversubscribing the cores and memory of
+the machine they share."""
+import os
+import re
+import time
+import json
+import errno
+import fcntl
+import itertools
+import threading
+import multiprocessing
+from distutils.spawn import find_executable
+
+# Rough model of how much memory (in MB) a Nastran run needs:
+# a fixed overhead, plus something per GRID (six DOFs each and the
+# fill-in of the factor), plus something per byte of input deck for
+# everything that isn't a GRID.
+BASE_MEMORY_MB = 512
+MEMORY_PER_GRID_MB = 0.02
+MEMORY_PER_DECK_MB = 4.0
+
+grid_match = re.compile("^GRID[* ,]", re.MULTILINE)
+
+# the threads of a process (the jobs of a finite difference gradient,
+# say) share a scheduler, so the tickets are numbered per process
+_tickets = itertools.count()
+_tickets_lock = threading.Lock()
+
+
+def estimate_memory(deck_size, grid_count):
+    """Estimate the memory, in MB, that Nastran needs to run a deck.
+
+    deck_size: int
+        Size of the input deck in bytes.
+
+    grid_count: int
+        Number of GRID cards in the deck.
+    """
+    deck_mb = deck_size / (1024. * 1024.)
+    return int(BASE_MEMORY_MB + MEMORY_PER_GRID_MB * grid_count + \
+               MEMORY_PER_DECK_MB * deck_mb)
+
+
+def estimate_deck_memory(filename):
+    """Estimate the memory, in MB, that Nastran needs to run the
+    deck in ``filename``. See ``estimate_memory``."""
+    fh = open(filename, "r")
+    text = fh.read()
+    fh.close()
+    return estimate_memory(len(text), len(grid_match.findall(text)))
+
+
+def physical_memory():
+    """Physical memory of this machine in MB."""
+    return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / \
+               (1024 * 1024))
+
+
+def affinity_prefix(cpus):
+    """The command prefix that pins a child process to ``cpus``.
+
+    Uses ``taskset`` so that the pinning applies to the Nastran
+    process that ExternalCode spawns and not to us. Returns an empty
+    list if ``taskset`` is not available.
+    """
+    if not cpus:
+        return []
+    taskset = find_executable("taskset")
+    if taskset is None:
+        return []
+    return [taskset, "-c", ",".join([str(cpu) for cpu in sorted(cpus)])]
+
+
+def _pid_alive(pid):
+    """Is there still a process with this pid?"""
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno == errno.EPERM
+    return True
+
+
+class Reservation(object):
+    """The cores and memory a job was admitted with."""
+
+    def __init__(self, ticket, cpus, memory, wait_time):
+        self.ticket = ticket
+        self.cpus = cpus
+        self.memory = memory
+        self.wait_time = wait_time
+
+
+class NastranScheduler(object):
+    """Admits jobs when there are enough free cores and memory for them.
+
+    Every NastranScheduler pointing at the same ``state_dir`` shares one
+    small JSON file, guarded by ``flock``, that lists the running and
+    waiting jobs of every process on this machine. Jobs of processes
+    that died are dropped from it the next time anybody looks.
+
+    The goal is throughput: a job that fits is admitted even if bigger
+    jobs have been waiting longer (backfilling). To keep big jobs from
+    starving, nobody may jump ahead of a job that has been waiting for
+    more than ``starvation_limit`` seconds.
+    """
+
+    def __init__(self, state_dir, cores=0, memory=0,
+                 starvation_limit=600., poll_interval=0.5):
+        """
+        state_dir: str
+            Directory holding the shared state. Created if needed.
+
+        cores: int
+            Cores to hand out. 0 means all the cores of this machine.
+
+        memory: int
+            Memory to hand out, in MB. 0 means all the physical memory.
+
+        starvation_limit: float
+            Seconds after which a waiting job stops being overtaken.
+
+        poll_interval: float
+            Seconds between attempts while waiting.
+        """
+        self.state_dir = state_dir
+        self.cores = cores or multiprocessing.cpu_count()
+        self.memory = memory or physical_memory()
+        self.starvation_limit = starvation_limit
+        self.poll_interval = poll_interval
+
+        if not os.path.isdir(state_dir):
+            try:
+                os.makedirs(state_dir)
+            except OSError, err:
+                if err.errno != errno.EEXIST:
+                    raise
+        self._state_filename = os.path.join(state_dir, "scheduler.json")
+        self._lock_filename = os.path.join(state_dir, "scheduler.lock")
+
+    def _locked(self, update):
+        """Call ``update(state)`` while holding the lock on the shared
+        state and write back whatever it leaves in ``state``."""
+        lock_fd = os.open(self._lock_filename, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            state = {"running": [], "waiting": []}
+            if os.path.exists(self._state_filename):
+                fh = open(self._state_filename, "r")
+                try:
+                    state = json.load(fh)
+                except ValueError:
+                    # torn or empty file, start over
+                    pass
+                fh.close()
+
+            for kind in ("running", "waiting"):
+                state[kind] = [job for job in state[kind] \
+                               if _pid_alive(job["pid"])]
+
+            result = update(state)
+
+            fh = open(self._state_filename + ".tmp", "w")
+            json.dump(state, fh)
+            fh.close()
+            os.rename(self._state_filename + ".tmp", self._state_filename)
+            return result
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    def reserve(self, cores, memory, timeout=None):
+        """Wait until ``cores`` cores and ``memory`` MB are free and take
+        them.
+
+        Requests bigger than the whole machine are trimmed to the whole
+        machine, so they run alone instead of never running.
+
+        timeout: float or None
+            Give up after this many seconds. None waits forever.
+
+        Returns a Reservation. Raises RuntimeError if ``timeout`` expires.
+        """
+        cores = max(1, min(cores, self.cores))
+        memory = max(0, min(memory, self.memory))
+        _tickets_lock.acquire()
+        try:
+            number = _tickets.next()
+        finally:
+            _tickets_lock.release()
+        ticket = "%d.%d.%f" % (os.getpid(), number, time.time())
+        start = time.time()
+
+        def enqueue(state):
+            state["waiting"].append({"ticket": ticket, "pid": os.getpid(),
+                                     "cores": cores, "memory": memory,
+                                     "since": start})
+        self._locked(enqueue)
+
+        def admit(state):
+            used = set()
+            used_memory = 0
+            for job in state["running"]:
+                used.update(job["cpus"])
+                used_memory += job["memory"]
+            free = [cpu for cpu in range(self.cores) if cpu not in used]
+            if len(free) < cores or used_memory + memory > self.memory:
+                return None
+
+            now = time.time()
+            for job in state["waiting"]:
+                if job["ticket"] == ticket:
+                    break
+                if now - job["since"] > self.starvation_limit:
+                    # somebody has been waiting too long, let them go first
+                    return None
+
+            cpus = free[:cores]
+            state["waiting"] = [job for job in state["waiting"] \
+                                if job["ticket"] != ticket]
+            state["running"].append({"ticket": ticket, "pid": os.getpid(),
+                                     "cpus": cpus, "memory": memory})
+            return cpus
+
+        def give_up(state):
+            state["waiting"] = [job for job in state["waiting"] \
+                                if job["ticket"] != ticket]
+
+        cpus = None
+        try:
+            while True:
+                cpus = self._locked(admit)
+                if cpus is not None:
+                    return Reservation(ticket, cpus, memory,
+                                       time.time() - start)
+                if timeout is not None and time.time() - start >= timeout:
+                    raise RuntimeError("Timed out after " + str(timeout) + \
+                                       " seconds waiting for " + \
+                                       str(cores) + " cores and " + \
+                                       str(memory) + " MB of memory")
+                time.sleep(self.poll_interval)
+        finally:
+            # whatever stopped us waiting, a job left in the queue
+            # would hold up everybody once it starved
+            if cpus is None:
+                self._locked(give_up)
+
+    def release(self, reservation):
+        """Give back the cores and memory of ``reservation``."""
+        def remove(state):
+            state["running"] = [job for job in state["running"] \
+                                if job["ticket"] != reservation.ticket]
+        self._locked(remove)
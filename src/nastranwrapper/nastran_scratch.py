@@ -0,0 +1,115 @@
+"""Defines ScratchPool, a pool of run directories that are created ahead
+of time, cleaned in the background and handed out again."""
+import os
+import atexit
+import threading
+from Queue import Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+
+
+class ScratchPool(object):
+    """A pool of recycled run directories.
+
+    Making a directory for every run and deleting the previous one
+    (with gigabyte-sized database and output files in it) right away
+    keeps the optimizer waiting on the filesystem. A ScratchPool creates
+    ``size`` directories up front. Directories that are given back are
+    emptied by a background thread and then handed out again, so
+    neither creating nor cleaning them is on the optimizer's path.
+    Putting ``base_dir`` on a fast local disk or on tmpfs (such as
+    ``/dev/shm``) makes it cheaper still.
+    """
+
+    def __init__(self, base_dir, size, prefix="nastran_run_"):
+        """
+        base_dir: str
+            Where the run directories are created.
+
+        size: int
+            How many clean directories to keep ready.
+
+        prefix: str
+            Prefix of the directory names.
+        """
+        self.base_dir = base_dir
+        self.size = size
+        self.prefix = prefix
+
+        self._lock = threading.Lock()
+        self._free = []
+        for i in range(size):
+            self._free.append(mkdtemp(prefix=prefix, dir=base_dir))
+
+        self._dirty = Queue()
+        self._worker = threading.Thread(target=self._clean)
+        self._worker.setDaemon(True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def acquire(self):
+        """Return an empty directory to run in.
+
+        If every directory is in use or still being cleaned, a new one
+        is made."""
+        self._lock.acquire()
+        try:
+            if self._free:
+                return self._free.pop()
+        finally:
+            self._lock.release()
+        return mkdtemp(prefix=self.prefix, dir=self.base_dir)
+
+    def release(self, directory):
+        """We are done with ``directory``. It is emptied in the
+        background and goes back into the pool, or is deleted if the
+        pool is already full. Either way, this returns immediately."""
+        self._dirty.put(directory)
+
+    def wait(self):
+        """Block until every directory given back has been cleaned."""
+        self._dirty.join()
+
+    def close(self):
+        """Finish cleaning and delete the directories in the pool."""
+        self.wait()
+        self._lock.acquire()
+        try:
+            free, self._free = self._free, []
+        finally:
+            self._lock.release()
+        for directory in free:
+            rmtree(directory, ignore_errors=True)
+
+    def _clean(self):
+        """Body of the background thread."""
+        while True:
+            directory = self._dirty.get()
+            try:
+                self._lock.acquire()
+                try:
+                    recycle = len(self._free) < self.size
+                finally:
+                    self._lock.release()
+
+                if recycle:
+                    for name in os.listdir(directory):
+                        filename = os.path.join(directory, name)
+                        if os.path.isdir(filename) and \
+                               not os.path.islink(filename):
+                            rmtree(filename, ignore_errors=True)
+                        else:
+                            os.remove(filename)
+
+                    self._lock.acquire()
+                    try:
+                        self._free.append(directory)
+                    finally:
+                        self._lock.release()
+                else:
+                    rmtree(directory, ignore_errors=True)
+            except OSError:
+                # somebody removed it under us. It's not coming back.
+                pass
+            finally:
+                self._dirty.task_done()
@@ -0,0 +1,85 @@
+"""Defines ShapeUpdate, which moves GRID points along perturbation basis
+vectors for shape optimization."""
+import numpy
+
+from nastran_util import format_fields
+
+# X1, X2 and X3 are the 3rd to 5th data fields of a GRID card
+GRID_COORDINATE_FIELDS = (3, 4, 5)
+
+
+def shape_coordinates(base, basis, amplitudes):
+    """The coordinates ``base + sum(amplitudes[i] * basis[i])``.
+
+    base: array of shape (n, 3)
+        The coordinates of the n grid points.
+
+    basis: array of shape (m, n, 3)
+        m perturbation shapes.
+
+    amplitudes: array of shape (m,)
+        How much of every shape to add.
+    """
+    amplitudes = numpy.asarray(amplitudes, dtype=float).ravel()
+    if len(amplitudes) != len(basis):
+        raise ValueError("Got " + str(len(amplitudes)) + \
+                         " amplitudes for " + str(len(basis)) + \
+                         " basis vectors")
+    return base + numpy.tensordot(amplitudes, basis, 1)
+
+
+class ShapeUpdate(object):
+    """Moves a set of GRID points along basis vectors.
+
+    ``apply`` computes the new coordinates of all the points with numpy
+    and records the X1, X2 and X3 fields of all their GRID cards with
+    NastranMaker in one go. The fields are numbered as data fields, so
+    it works whether the template writes the GRID cards in short, long
+    or free field. The coordinates are formatted with ``format_fields``,
+    so every one keeps as many digits as fit in a long field. All
+    the cards are then found and rewritten in one indexed pass over
+    the deck, by NastranMaker or by a BulkDeck.
+    """
+
+    def __init__(self, grid_ids, base, basis):
+        """
+        grid_ids: [int]
+            The ids of the n GRID points that move.
+
+        base: array-like of shape (n, 3)
+            Their coordinates in the template, in the coordinate
+            system of the GRID cards (CP).
+
+        basis: array-like of shape (m, n, 3) or (m, 3n)
+            The m shapes they move along.
+        """
+        self.grid_ids = [str(grid_id) for grid_id in grid_ids]
+        self.base = numpy.asarray(base, dtype=float)
+        count = len(self.grid_ids)
+        if self.base.shape != (count, 3):
+            raise ValueError("The base coordinates should be an array " + \
+                             "of shape (" + str(count) + ", 3)")
+        basis = numpy.asarray(basis, dtype=float)
+        if basis.ndim == 1:
+            basis = basis[numpy.newaxis]
+        self.basis = basis.reshape((len(basis), count, 3))
+
+        # the maker targets never change, so they are made once
+        self.targets = [("GRID", grid_id, field) \
+                        for grid_id in self.grid_ids \
+                        for field in GRID_COORDINATE_FIELDS]
+
+    def coordinates(self, amplitudes):
+        """The coordinates of the points for ``amplitudes``, one row
+        per point."""
+        return shape_coordinates(self.base, self.basis, amplitudes)
+
+    def apply(self, maker, amplitudes):
+        """Record the moved coordinates with ``maker``.
+
+        maker: NastranMaker
+
+        amplitudes: array-like of shape (m,)
+        """
+        coordinates = self.coordinates(amplitudes).ravel()
+        maker.set_fields(self.targets, format_fields(coordinates, 16))
@@ -0,0 +1,223 @@
+"""Defines the functions that turn an analysis into a SOL 200 design
+sensitivity analysis, and read the sensitivities back from the output.
+
+The design model is one DESVAR and one DVPREL1 for every property field
+that is an input, and one DRESP1 for every output that is a design
+response. With ``DESMAX 0`` on DOPTPRM, Nastran does the analysis and
+the sensitivity analysis and stops without changing the design, so the
+derivatives of all the responses with respect to all the inputs come
+from a single run."""
+import re
+
+from nastran_case_control import case_control_bounds
+from nastran_util import bulk_data_bounds, format_fields, parse_reals
+
+# where the cards that change from run to run are written
+SOL200_FILENAME = "sol200.bdf"
+
+# the first ids of the DESVAR, DVPREL1 and DRESP1 cards we make
+DESVAR_BASE = 90001
+DVPREL_BASE = 90001
+DRESP_BASE = 90001
+
+# the DCONSTR set that makes Nastran evaluate all the responses
+DCONSTR_ID = 90001
+
+# bounds that never constrain anything
+UNBOUNDED = 1.e20
+
+# what ANALYSIS is for the solutions we know
+ANALYSES = {"101": "STATICS", "103": "MODES", "SESTATIC": "STATICS",
+            "SEMODES": "MODES"}
+
+# nastran_columns of a displacement output to DRESP1 ATTA
+DISPLACEMENT_COMPONENTS = {"T1": 1, "T2": 2, "T3": 3,
+                           "R1": 4, "R2": 5, "R3": 6}
+
+# DRESP1 fields in order, after ID and LABEL
+DRESP_FIELDS = ["RTYPE", "PTYPE", "REGION", "ATTA", "ATTB", "ATTI"]
+
+sol_match = re.compile("^(?P<indent>\\s*)SOL\\s+(?P<sol>\\S+)", re.IGNORECASE)
+float_match = re.compile("^[-+]?(\\d+\\.?\\d*|\\.\\d+)([ED]?[-+]?\\d+)?$",
+                         re.IGNORECASE)
+
+
+def field_position(fieldnum, long_card=False):
+    """The Nastran field position (what DVPREL1 calls FID) of the field
+    NastranMaker calls ``fieldnum``."""
+    if not long_card:
+        # the slots are the fields of the card, counting from 0
+        return fieldnum + 1
+    # two long rows make one short row
+    row, column = divmod(fieldnum, 6)
+    data_field = row * 4 + column
+    row, column = divmod(data_field - 1, 8)
+    return row * 10 + column + 2
+
+
+def displacement_response(constraints, columns):
+    """The DRESP1 fields of a ``displacement vector`` output."""
+    grids = [value for key, value in constraints.iteritems() \
+             if "ID" in key.upper()]
+    if len(grids) != 1 or len(columns) != 1 or \
+           columns[0].upper() not in DISPLACEMENT_COMPONENTS:
+        raise RuntimeError("A displacement response needs one POINT ID " + \
+                           "constraint and one of the columns " + \
+                           ", ".join(sorted(DISPLACEMENT_COMPONENTS)))
+    return {"RTYPE": "DISP",
+            "ATTA": DISPLACEMENT_COMPONENTS[columns[0].upper()],
+            "ATTI": [grids[0]]}
+
+
+def _free_field(values):
+    """A free field card of ``values``, reals formatted to fit in small
+    fields. Returns its rows."""
+    fields = []
+    for value in values:
+        if isinstance(value, float):
+            fields.append(format_fields([value], 8)[0])
+        elif value is None:
+            fields.append("")
+        else:
+            fields.append(str(value))
+    # 9 fields on the first row, 8 on each continuation
+    rows = [",".join(fields[:9])]
+    for start in range(9, len(fields), 8):
+        rows[-1] += ",+"
+        rows.append("+," + ",".join(fields[start:start + 8]))
+    return rows
+
+
+def design_cards(variables, responses):
+    """The DESVAR, DVPREL1 and DRESP1 cards of a design model.
+
+    variables: [(value, lower, upper, property card, pid, fid)]
+        One a design variable. Each is linked to one field of one
+        property card with a coefficient of 1.
+
+    responses: [{DRESP1 field: value}]
+        One a design response, with the keys of ``DRESP_FIELDS``.
+        ``ATTI`` is a list.
+
+    Returns the rows of the cards. The i-th variable is DESVAR
+    ``DESVAR_BASE + i`` and the i-th response DRESP1 ``DRESP_BASE + i``.
+    Every response gets a DCONSTR in set ``DCONSTR_ID`` that never
+    constrains it, since Nastran skips responses nothing refers to.
+    """
+    rows = []
+    for index, (value, lower, upper, card, pid, fid) in \
+            enumerate(variables):
+        rows.extend(_free_field(["DESVAR", DESVAR_BASE + index,
+                                 "V" + str(index), float(value),
+                                 float(lower), float(upper)]))
+        rows.extend(_free_field(["DVPREL1", DVPREL_BASE + index, card, pid,
+                                 fid, None, None, 0., None,
+                                 DESVAR_BASE + index, 1.]))
+    for index, response in enumerate(responses):
+        fields = ["DRESP1", DRESP_BASE + index, "R" + str(index)]
+        for name in DRESP_FIELDS[:-1]:
+            fields.append(response.get(name))
+        fields.extend(response.get("ATTI", []))
+        rows.extend(_free_field(fields))
+        # only the responses that are constrained are evaluated
+        rows.extend(_free_field(["DCONSTR", DCONSTR_ID, DRESP_BASE + index,
+                                 -UNBOUNDED, UNBOUNDED]))
+    return rows
+
+
+def sol200_deck(lines, include=SOL200_FILENAME):
+    """Turn the lines of an input file into a SOL 200 sensitivity
+    analysis.
+
+    The solution becomes SOL 200, and the ANALYSIS of the old solution,
+    ``DESOBJ`` (Nastran wants one, even if it doesn't optimize),
+    ``DESSUB`` and ``DSAPRT`` are added above the subcases of the
+    Case Control. DOPTPRM with ``DESMAX 0`` and an INCLUDE of the
+    design model are added to the bulk data.
+
+    Returns the new lines.
+    """
+    lines = list(lines)
+    cend, begin = case_control_bounds(lines)
+    analysis = None
+    for index, line in enumerate(lines[:cend]):
+        match = sol_match.match(line)
+        if match:
+            analysis = ANALYSES.get(match.group("sol").upper())
+            if analysis is None:
+                raise RuntimeError("Don't know how to do sensitivities " + \
+                                   "for SOL " + match.group("sol"))
+            lines[index] = match.group("indent") + "SOL 200"
+            break
+    if analysis is None:
+        raise RuntimeError("Could not find SOL in the Nastran file")
+
+    top = ["ANALYSIS = " + analysis,
+           "DESOBJ = " + str(DRESP_BASE),
+           "DESSUB = " + str(DCONSTR_ID),
+           "DSAPRT(FORMATTED,NOEXPORT) = ALL"]
+    bulk_begin, enddata = bulk_data_bounds(lines)
+    return lines[:cend+1] + top + lines[cend+1:enddata] + \
+           ["DOPTPRM,DESMAX,0", "INCLUDE '" + include + "'"] + \
+           lines[enddata:]
+
+
+def _is_float(token):
+    return float_match.match(token) is not None
+
+
+# the words of the column names of the table of sensitivities
+TABLE_WORDS = set(["RESPONSE", "DESVAR", "DERIVATIVE"])
+
+
+def parse_sensitivities(lines):
+    """Read the design sensitivities that ``DSAPRT(FORMATTED)`` prints.
+
+    The sensitivities come after a page header with ``SENSITIVIT`` in
+    it. A row holds the id of a response, then pairs of a DESVAR id
+    and the derivative of the response with respect to it. Rows with
+    only pairs carry on the row above. The table ends at the next page
+    break or at another header.
+
+    Returns {(DRESP1 id, DESVAR id): derivative}. Only the first value
+    found for a pair is kept.
+    """
+    sensitivities = {}
+    in_section = False
+    response = None
+    for line in lines:
+        compact = line.replace(" ", "").upper()
+        if "SENSITIVIT" in compact:
+            in_section = True
+            response = None
+            continue
+        if not in_section:
+            continue
+        tokens = line.split()
+        if line.startswith("1") or "PAGE" in tokens:
+            # a page break. If the table goes on, the next page has
+            # the header again
+            in_section = False
+            continue
+        if not tokens or not all([_is_float(token) for token in tokens]):
+            if set(token.upper() for token in tokens) & TABLE_WORDS or \
+                   not "".join(tokens).isalpha():
+                # the column names, or blank lines
+                continue
+            # the header of something else
+            in_section = False
+            continue
+        if len(tokens) % 2 == 1:
+            if not tokens[0].isdigit():
+                continue
+            response = int(tokens[0])
+            tokens = tokens[1:]
+        if response is None:
+            continue
+        for index in range(0, len(tokens) - 1, 2):
+            if not tokens[index].isdigit():
+                break
+            key = (response, int(tokens[index]))
+            if key not in sensitivities:
+                sensitivities[key] = parse_reals([tokens[index + 1]])[0]
+    return sensitivities
@@ -0,0 +1,147 @@
+"""Defines the functions that find which superelement owns each card of
+a partitioned bulk data section, and that restrict the matrix
+generation and reduction of a run to the superelements that changed."""
+import re
+
+from nastran_case_control import case_control_bounds, request_match, \
+     set_match, _set_lines
+from nastran_deck import _card_header
+
+# the residual structure
+RESIDUAL = 0
+
+# the SET that holds the superelements to process
+SUPERELEMENT_SET = 9001
+
+# Case Control entries that pick superelements. The ones we write are
+# matrix generation and stiffness reduction, the others are overridden.
+SUPERELEMENT_ENTRIES = ["SEALL", "SEMG", "SEKR"]
+
+begin_super_match = re.compile("^\\s*BEGIN\\s+(BULK\\s+)?SUPER\\s*=?\\s*" \
+                               "(?P<seid>\\d+)", re.IGNORECASE)
+begin_bulk_match = re.compile("^\\s*BEGIN\\s+BULK\\s*$", re.IGNORECASE)
+
+
+def superelement_map(lines):
+    """Find the superelement of every card of a template whose bulk
+    data is partitioned with ``BEGIN SUPER = n``. The cards before the
+    first partition belong to the residual structure.
+
+    lines: [str]
+        The lines of the file, without newlines.
+
+    Returns {(name, id): set of superelement ids}. A card id can be
+    used again in another partition, so there may be more than one.
+    """
+    owners = {}
+    seid = None
+    for line in lines:
+        match = begin_super_match.match(line)
+        if match:
+            seid = int(match.group("seid"))
+            continue
+        if seid is None:
+            if begin_bulk_match.match(line):
+                seid = RESIDUAL
+            continue
+        if not line[:1].isalpha():
+            # continuations, comments and blank lines
+            continue
+        upper = line.upper()
+        if upper.startswith("ENDDATA"):
+            break
+        if upper.startswith("INCLUDE") or upper.startswith("BEGIN"):
+            continue
+        name, cid, layout = _card_header(line)
+        owners.setdefault((name, cid), set()).add(seid)
+    return owners
+
+
+def superelement_partitions(lines):
+    """The superelements of the partitions of the bulk data, in the
+    order of the template. The residual structure comes first."""
+    partitions = [RESIDUAL]
+    for line in lines:
+        match = begin_super_match.match(line)
+        if match:
+            partitions.append(int(match.group("seid")))
+    return partitions
+
+
+def changed_superelements(owners, keys):
+    """The superelements that own the cards ``keys`` (``(name, id)``
+    pairs, as NastranMaker records them).
+
+    Raises RuntimeError for a card that isn't there, or whose id is
+    used in more than one superelement."""
+    changed = set()
+    for name, cid in keys:
+        key = (name.upper().rstrip("*"), str(cid))
+        seids = owners.get(key)
+        if not seids:
+            raise RuntimeError("Could not find card " + key[0] + \
+                               " with id " + key[1])
+        if len(seids) > 1:
+            raise RuntimeError("Card " + key[0] + " with id " + key[1] + \
+                               " is in superelements " + \
+                               ", ".join([str(s) for s in sorted(seids)]) + \
+                               ", so we can't tell which one changed")
+        changed.update(seids)
+    return changed
+
+
+def partial_case_control(lines, changed):
+    """Rewrite the Case Control so that only the superelements in
+    ``changed``, and the residual structure, have their matrices
+    generated and reduced again (``SEMG`` and ``SEKR``). The others
+    keep the ones in the database. Entries that picked superelements
+    before are commented out.
+
+    Returns the new lines.
+    """
+    cend, begin = case_control_bounds(lines)
+    seids = sorted(set(changed) | set([RESIDUAL]))
+    body = []
+    for line in lines[cend+1:begin]:
+        match = request_match.match(line)
+        if match and match.group("name").upper() in SUPERELEMENT_ENTRIES:
+            body.append("$ " + line)
+        elif set_match.match(line) and \
+                 int(set_match.match(line).group("id")) == SUPERELEMENT_SET:
+            raise RuntimeError("The template already has SET " + \
+                               str(SUPERELEMENT_SET))
+        else:
+            body.append(line)
+    top = _set_lines(SUPERELEMENT_SET, seids) + \
+          ["SEMG = " + str(SUPERELEMENT_SET),
+           "SEKR = " + str(SUPERELEMENT_SET)]
+    return lines[:cend+1] + top + body + lines[begin:]
+
+
+def submitted_superelements(lines):
+    """The superelements a run written by ``partial_case_control``
+    generates matrices for, or None if it does them all."""
+    cend, begin = case_control_bounds(lines)
+    body = lines[cend+1:begin]
+    semg = None
+    for line in body:
+        match = request_match.match(line)
+        if match and match.group("name").upper() == "SEMG":
+            semg = match.group("value").strip()
+    if semg is None or semg.upper() == "ALL":
+        return None
+
+    # the SET can go on over more than one line
+    ids = set()
+    in_set = False
+    for line in body:
+        match = set_match.match(line)
+        if match:
+            in_set = int(match.group("id")) == int(semg)
+            line = line[match.end():]
+        elif in_set and request_match.match(line):
+            in_set = False
+        if in_set:
+            ids.update([int(number) for number in \
+                        line.replace(",", " ").split()])
+    return ids
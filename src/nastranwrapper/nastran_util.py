@@ -2,6 +2,8 @@
 NastranComponent."""
 import re
 
+import numpy
+
 # we have to replace the old_string and it's entire block
 # with the new string in the same block
 def nastran_replace_inline(big_string, old_string, new_string):
@@ -22,6 +24,55 @@ def nastran_replace_inline(big_string, old_string, new_string):
            big_string[8*block+8:]
 
 
+def bulk_data_bounds(lines):
+    """Find the bulk data section of a Nastran input file.
+
+    lines: [str]
+        The lines of the file, without newlines.
+
+    Returns the index of the ``BEGIN BULK`` line and the index of the
+    ``ENDDATA`` line (``len(lines)`` if there isn't one).
+    """
+    begin = None
+    for index, line in enumerate(lines):
+        if begin is None:
+            if re.match(" *BEGIN +BULK", line.upper()):
+                begin = index
+        elif line.upper().startswith("ENDDATA"):
+            return begin, index
+
+    if begin is None:
+        raise RuntimeError("Could not find BEGIN BULK in the Nastran file")
+    return begin, len(lines)
+
+
+def linked_values(values, linking=None, offset=None):
+    """Map design variables onto the values of the fields they set, the
+    way a DVPREL1 card does: ``offset + linking . values``.
+
+    values: array-like
+        The design variables.
+
+    linking: 2-d array, scipy.sparse matrix or None
+        One row per field, one column per design variable. None means
+        every design variable sets one field.
+
+    offset: float, array-like or None
+        Added to every field (C0 on DVPREL1).
+    """
+    values = numpy.asarray(values, dtype=float).ravel()
+    if linking is not None:
+        if linking.shape[1] != len(values):
+            raise ValueError("The linking matrix has " + \
+                             str(linking.shape[1]) + " columns but " + \
+                             "there are " + str(len(values)) + \
+                             " design variables")
+        values = numpy.asarray(linking.dot(values)).ravel()
+    if offset is not None:
+        values = values + offset
+    return values
+
+
 def stringify(thing, length=8):
     """Convert ``thing`` to a string of a certain length.
 
@@ -70,3 +121,143 @@ def stringify(thing, length=8):
 
 
 
+
+
+def _number_length(numbers):
+    """How many digits the (non-negative) integers ``numbers`` have."""
+    return numpy.floor(numpy.log10(numpy.maximum(numbers, 1))).astype(int) + 1
+
+
+def _format_fixed(values, decimals):
+    """``values`` with ``decimals`` decimals, without the zeros Nastran
+    doesn't need (``-0.500`` becomes ``-.5``)."""
+    strings = numpy.char.rstrip(numpy.char.mod("%#." + str(decimals) + "f",
+                                               values), "0")
+    for prefix in ("0.", "-0."):
+        leading = numpy.char.startswith(strings, prefix) & \
+                  (numpy.char.str_len(strings) > len(prefix))
+        strings[leading] = numpy.char.replace(strings[leading], prefix,
+                                              prefix[:-2] + ".", 1)
+    return strings
+
+
+def _format_exponent(values, decimals):
+    """``values`` in the compact exponent form Nastran reads
+    (``1.234-5``), with at most ``decimals`` decimals."""
+    parts = numpy.char.partition(numpy.char.mod("%#." + str(decimals) + "e",
+                                                values), "e")
+    mantissas = numpy.char.rstrip(parts[:, 0], "0")
+    exponents = numpy.char.mod("%+d", parts[:, 2].astype(int))
+    return numpy.char.add(mantissas, exponents)
+
+
+def format_fields(values, width=8):
+    """Format many numbers as Nastran fields at once.
+
+    Integers are written as integers. Reals always get a decimal point
+    and as many significant digits as fit in ``width``, written either
+    with a fixed point (``.00125``) or in the compact exponent form
+    (``1.25-3``), whichever keeps more. Unlike ``stringify``, the
+    numbers are formatted in groups that share a format, with numpy.
+
+    values: array-like
+        The numbers.
+
+    width: int
+        8 for short field, 16 for long field.
+
+    Returns a numpy array of strings with the shape of ``values``.
+    Raises ValueError for numbers that can't be written in ``width``
+    characters (infinities, NaNs and huge integers).
+    """
+    values = numpy.asarray(values)
+    flat = values.ravel()
+    if flat.dtype.kind in "iub":
+        strings = numpy.char.mod("%d", flat)
+        if len(flat) and numpy.char.str_len(strings).max() > width:
+            raise ValueError("An integer is wider than " + str(width) + \
+                             " characters")
+        return strings.reshape(values.shape)
+
+    flat = flat.astype(float)
+    if not numpy.isfinite(flat).all():
+        raise ValueError("Can't write infinities or NaNs to Nastran")
+
+    magnitudes = numpy.abs(flat)
+    exponents = numpy.zeros(len(flat), dtype=int)
+    nonzero = magnitudes > 0
+    exponents[nonzero] = numpy.floor(numpy.log10(magnitudes[nonzero]))
+    # the characters left for the number once the sign is written
+    room = width - (flat < 0)
+
+    # significant digits either way. The fixed point form writes the
+    # integer part (or a leading zero is dropped), a dot and decimals.
+    # The exponent form writes d., decimals and the signed exponent.
+    fixed_decimals = room - 1 - numpy.maximum(exponents + 1, 0)
+    fixed_digits = fixed_decimals + exponents + 1
+    exponent_decimals = room - 3 - _number_length(numpy.abs(exponents))
+    use_fixed = (fixed_decimals >= 0) & \
+                ((fixed_digits >= exponent_decimals + 1) | ~nonzero)
+    decimals = numpy.where(use_fixed, fixed_decimals, exponent_decimals)
+    if (decimals < 0).any():
+        raise ValueError("A number can't be written in " + str(width) + \
+                         " characters")
+
+    strings = numpy.zeros(len(flat), dtype="S" + str(width + 2))
+    for fixed in (True, False):
+        for count in numpy.unique(decimals[use_fixed == fixed]):
+            group = (use_fixed == fixed) & (decimals == count)
+            if fixed:
+                strings[group] = _format_fixed(flat[group], count)
+            else:
+                strings[group] = _format_exponent(flat[group], count)
+
+    # rounding up can carry into one more digit (9.99 to 10.0), so
+    # those few get one decimal less. A fixed point number with no
+    # decimals left (9999999.9 to 10000000.) goes to the exponent form,
+    # which takes the carry in its exponent (1.+7)
+    long_ones = numpy.nonzero(numpy.char.str_len(strings) > width)[0]
+    for index in long_ones:
+        count = decimals[index]
+        fixed = use_fixed[index]
+        while len(strings[index]) > width:
+            if count > 0:
+                count -= 1
+            elif fixed and exponent_decimals[index] >= 0:
+                fixed = False
+                count = exponent_decimals[index]
+            else:
+                break
+            if fixed:
+                strings[index] = _format_fixed(flat[index:index+1], count)[0]
+            else:
+                strings[index] = _format_exponent(flat[index:index+1],
+                                                  count)[0]
+        if len(strings[index]) > width:
+            raise ValueError("Unable to reduce " + repr(flat[index]) + \
+                             " to " + str(width) + " characters wide")
+
+    return strings.astype("S" + str(width)).reshape(values.shape)
+
+
+# a sign that follows a digit or a dot starts an exponent (1.234-5)
+_exponent_sign = re.compile("([0-9.])([+-])")
+
+
+def parse_reals(strings):
+    """Read many Nastran (Fortran style) reals at once.
+
+    Understands ``1.5``, ``.5``, ``5.``, ``1.5E-3``, ``1.5D-3`` and
+    the compact ``1.5-3``, with any blanks. Blank fields are NaN.
+
+    strings: sequence of str
+
+    Returns a numpy array of floats.
+    """
+    text = "\n".join(strings).upper().replace("D", "E").replace(" ", "")
+    text = _exponent_sign.sub("\\1E\\2", text)
+    fields = text.split("\n")
+    for index, field in enumerate(fields):
+        if not field:
+            fields[index] = "nan"
+    return numpy.array(fields).astype(float)
@@ -0,0 +1,240 @@
+"""Defines DeckValidator, which looks for mistakes in a Nastran input
+file before Nastran is started on it."""
+from nastran_deck import SHORT, LONG, FREE, FREE_LONG, included_decks
+
+# {element card: (index of the PID or None, indices of the grids)}.
+# Indices are into BulkDeck.values(card), where 1 is the id.
+ELEMENTS = {
+    "CROD": (2, [3, 4]),
+    "CTUBE": (2, [3, 4]),
+    "CONROD": (None, [2, 3]),
+    "CBAR": (2, [3, 4]),
+    "CBEAM": (2, [3, 4]),
+    "CBUSH": (2, [3, 4]),
+    "CELAS1": (2, [3, 5]),
+    "CSHEAR": (2, [3, 4, 5, 6]),
+    "CTRIA3": (2, [3, 4, 5]),
+    "CTRIA6": (2, range(3, 9)),
+    "CQUAD4": (2, [3, 4, 5, 6]),
+    "CQUAD8": (2, range(3, 11)),
+    "CTETRA": (2, range(3, 13)),
+    "CPENTA": (2, range(3, 18)),
+    "CHEXA": (2, range(3, 23)),
+    "CONM2": (None, [2]),
+}
+
+# {property card: indices of the material ids}
+PROPERTIES = {
+    "PROD": [2],
+    "PTUBE": [2],
+    "PBAR": [2],
+    "PBARL": [2],
+    "PBEAM": [2],
+    "PSHEAR": [2],
+    "PSHELL": [2, 4, 6, 11],
+    "PSOLID": [2],
+    "PCOMP": None,  # one material a ply, see _material_indices
+    "PBUSH": [],
+    "PELAS": [],
+}
+
+MATERIALS = ["MAT1", "MAT2", "MAT3", "MAT8", "MAT9"]
+
+# the material of CONROD is on the element
+CONROD_MATERIAL = 4
+
+# cards whose ids have to be unique among all the cards of the family
+FAMILIES = {"grid": ["GRID"],
+            "element": sorted(ELEMENTS),
+            "property": sorted(PROPERTIES),
+            "material": MATERIALS}
+
+
+def _material_indices(card_name, values):
+    """Indices of the material ids of the property ``values``."""
+    if card_name == "PCOMP":
+        # PID Z0 NSM SB FT TREF GE LAM, then MID T THETA SOUT a ply
+        return range(9, len(values), 4)
+    return PROPERTIES[card_name]
+
+
+def _check_field(field, width, problems, where):
+    """Complain about a field that is too wide or has blanks in it."""
+    value = field.strip()
+    if len(value) > width:
+        problems.append(where + ": `" + value + "` is wider than " + \
+                        str(width) + " characters")
+    elif " " in value:
+        problems.append(where + ": `" + value + "` has blanks in it")
+
+
+def check_rows(rows, layout, where=""):
+    """Check the field widths and continuation markers of the rows of
+    one card.
+
+    rows: [str]
+        The rows, without newlines.
+
+    layout: int
+        SHORT, LONG, FREE or FREE_LONG, as in ``nastran_deck``.
+
+    where: str
+        Which card this is, for the messages.
+
+    Returns a list of problems.
+    """
+    problems = []
+    if layout in (FREE, FREE_LONG):
+        width = 16 if layout == FREE_LONG else 8
+        for row in rows:
+            entries = row.split(",")
+            for entry in entries[1:]:
+                _check_field(entry, width, problems, where)
+        return problems
+
+    width = 16 if layout == LONG else 8
+    for number, row in enumerate(rows):
+        if len(row.rstrip()) > 80:
+            problems.append(where + ": row " + str(number + 1) + \
+                            " is wider than 80 columns")
+        for start in range(8, 72, width):
+            _check_field(row[start:start + width], width, problems, where)
+
+        marker = row[72:80].replace(" ", "")
+        if number + 1 < len(rows):
+            following = rows[number + 1][:8].replace(" ", "")
+            if marker and not marker[0] in "+*":
+                problems.append(where + ": the continuation `" + \
+                                marker + "` should start with + or *")
+            elif marker and following and following != marker and \
+                     following not in ("+", "*"):
+                problems.append(where + ": the continuation `" + \
+                                marker + "` is followed by `" + \
+                                following + "`")
+    return problems
+
+
+class DeckValidator(object):
+    """Checks a BulkDeck for the mistakes that would otherwise only show
+    up after Nastran has started and got a license:
+
+    - fields that are too wide or have blanks in them
+    - continuation markers that don't pair up, and continuation rows
+      that don't belong to a card
+    - ids used twice within a family of cards (grids, elements,
+      properties, materials)
+    - elements that refer to missing properties or grids, and
+      properties that refer to missing materials
+
+    The ids are collected once, from the deck's index and the indices
+    of the files it INCLUDEs. After that, ``validate`` can check only
+    the cards that changed, which is what makes it cheap enough to run
+    before every run. If an INCLUDEd file can't be read, references
+    to missing ids aren't reported, since they may be in it.
+    """
+
+    def __init__(self, deck):
+        """
+        deck: BulkDeck
+        """
+        self.deck = deck
+        self.included, self.missing = included_decks(deck)
+        # {family: set of ids}
+        self.ids = {}
+        self._family = {}
+        for family, names in FAMILIES.iteritems():
+            self.ids[family] = set()
+            for name in names:
+                self._family[name] = family
+
+        self._duplicates = []
+        for one in [deck] + self.included:
+            for card in one.cards:
+                family = self._family.get(card.name)
+                if family is None:
+                    continue
+                if card.cid in self.ids[family]:
+                    self._duplicates.append((one, card))
+                else:
+                    self.ids[family].add(card.cid)
+
+    def close(self):
+        """Close the decks of the INCLUDEd files."""
+        for deck in self.included:
+            deck.close()
+        self.included = []
+
+    def validate(self, cards=None):
+        """Check ``cards`` (all of them if None).
+
+        Returns a list of problems, empty if there are none."""
+        problems = []
+        if cards is None:
+            cards = [(deck, card) for deck in [self.deck] + self.included \
+                     for card in deck.cards]
+            for deck, card in self._duplicates:
+                problems.append(self._where(deck, card) + ": the id is " + \
+                                "used by another " + \
+                                self._family[card.name] + " card")
+            for deck in [self.deck] + self.included:
+                for start in deck.orphans:
+                    problems.append("The continuation at byte " + \
+                                    str(start) + self._in(deck) + \
+                                    " doesn't follow a card")
+        else:
+            cards = [(self.deck, card) for card in cards]
+
+        for deck, card in cards:
+            rows, layout = deck.rows(card)
+            problems.extend(check_rows(rows, layout,
+                                       self._where(deck, card)))
+            if card.name in self._family:
+                problems.extend(self._check_references(deck, card))
+        return problems
+
+    def _in(self, deck):
+        """Where ``deck`` is, for a problem in an INCLUDEd file."""
+        if deck is self.deck:
+            return ""
+        return " of " + deck.filename
+
+    def _where(self, deck, card):
+        return card.name + " " + card.cid + self._in(deck)
+
+    def _check_references(self, deck, card):
+        """Check that what ``card`` of ``deck`` refers to is there."""
+        problems = []
+        values = deck.values(card)
+
+        if len(values) > 1 and values[1] != card.cid:
+            family = self._family[card.name]
+            if values[1] in self.ids[family]:
+                problems.append(self._where(deck, card) + ": the new id " + \
+                                values[1] + " is used by another " + \
+                                family + " card")
+
+        references = []
+        if card.name in ELEMENTS:
+            pid, grids = ELEMENTS[card.name]
+            if pid is not None:
+                references.append((pid, "property"))
+            references.extend([(index, "grid") for index in grids])
+            if card.name == "CONROD":
+                references.append((CONROD_MATERIAL, "material"))
+        elif card.name in PROPERTIES:
+            references.extend([(index, "material") for index in \
+                               _material_indices(card.name, values)])
+
+        for index, family in references:
+            if index >= len(values):
+                continue
+            value = values[index]
+            # blanks are optional fields, and anything that isn't an
+            # integer (a NastranReplacer variable, say) can't be
+            # checked. Nor can anything if an INCLUDE is missing
+            if value.isdigit() and value not in self.ids[family] and \
+                   not self.missing:
+                problems.append(self._where(deck, card) + " refers to " + \
+                                family + " " + value + \
+                                ", which isn't there")
+        return problems
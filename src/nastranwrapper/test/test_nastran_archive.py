@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nastranwrapper.nastran_archive import RunArchive, input_hash
+
+class TestRunArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archive_dir = os.path.join(self.tmpdir, "archive")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_run(self, iteration):
+        run_dir = os.path.join(self.tmpdir, "run%d" % iteration)
+        os.mkdir(run_dir)
+        for name in ["input.bdf", "input.out", "input.DBALL"]:
+            fh = open(os.path.join(run_dir, name), "w")
+            fh.write("%s of run %d\n" % (name, iteration))
+            fh.close()
+        return run_dir
+
+    def archived(self, archive):
+        return sorted([entry["iteration"] for entry in archive.find()])
+
+    def test_every(self):
+        archive = RunArchive(self.archive_dir, every=3, failed=False)
+        for i in range(1, 8):
+            archive.submit(self.make_run(i), i)
+        self.assertEqual(self.archived(archive), [3, 6])
+
+    def test_failed(self):
+        archive = RunArchive(self.archive_dir)
+        archive.submit(self.make_run(1), 1)
+        archive.submit(self.make_run(2), 2, failed=True)
+        [entry] = archive.find()
+        self.assertEqual(entry["iteration"], 2)
+        self.assertEqual(entry["status"], "failed")
+
+    def test_best(self):
+        archive = RunArchive(self.archive_dir, best=2)
+        for i, objective in enumerate([5., 3., 4., 1., 6.]):
+            archive.submit(self.make_run(i), i, objective=objective)
+        self.assertEqual(self.archived(archive), [1, 3])
+        # the ones that were pushed out are deleted
+        self.assertEqual(len(os.listdir(self.archive_dir)), 3)
+
+    def test_best_maximize(self):
+        archive = RunArchive(self.archive_dir, best=2, maximize=True)
+        for i, objective in enumerate([5., 3., 4., 1., 6.]):
+            archive.submit(self.make_run(i), i, objective=objective)
+        self.assertEqual(self.archived(archive), [0, 4])
+
+    def test_index_and_extract(self):
+        archive = RunArchive(self.archive_dir, compression="bz2",
+                             artifacts=["input.bdf", "input.out",
+                                        "input.f06"], every=1)
+        run_dir = self.make_run(4)
+        digest = input_hash(os.path.join(run_dir, "input.bdf"))
+        archive.submit(run_dir, 4)
+
+        # the index can be read back by somebody else
+        archive.wait()
+        [entry] = RunArchive.read_index(self.archive_dir)
+        self.assertEqual(entry["iteration"], 4)
+        self.assertEqual(archive.find(input_hash=digest), [entry])
+
+        out = os.path.join(self.tmpdir, "extracted")
+        archive.extract(entry, out)
+        self.assertEqual(sorted(os.listdir(out)), ["input.bdf", "input.out"])
+
+    def test_when_done(self):
+        archive = RunArchive(self.archive_dir, every=1)
+        run_dir = self.make_run(1)
+        archive.submit(run_dir, 1)
+        archive.when_done(run_dir, shutil.rmtree)
+        archive.wait()
+        self.assertFalse(os.path.exists(run_dir))
+        self.assertEqual(self.archived(archive), [1])
+
+        # not pending, so it happens right away
+        run_dir = self.make_run(2)
+        archive.when_done(run_dir, shutil.rmtree)
+        self.assertFalse(os.path.exists(run_dir))
+
+    def test_broken_run(self):
+        archive = RunArchive(self.archive_dir, every=1)
+        def broken(*args):
+            raise ValueError("corrupt stream")
+        archive._archive = broken
+        run_dir = self.make_run(1)
+        archive.submit(run_dir, 1)
+        archive.when_done(run_dir, shutil.rmtree)
+        # the worker lives on, and still cleans up
+        archive.wait()
+        self.assertFalse(os.path.exists(run_dir))
+        del archive._archive
+        archive.submit(self.make_run(2), 2)
+        self.assertEqual(self.archived(archive), [2])
+
+    def test_shared_dir(self):
+        # another process archiving the same iteration keeps its own
+        archive = RunArchive(self.archive_dir, every=1)
+        archive.submit(self.make_run(1), 1)
+        [entry] = archive.find()
+        self.assertTrue(str(os.getpid()) in entry["archive"])
+
+        # an archive that was opened before that run was indexed
+        # doesn't drop it when it writes the index
+        other = RunArchive(self.archive_dir, every=1)
+        archive.submit(self.make_run(2), 2)
+        archive.wait()
+        other.submit(self.make_run(3), 3)
+        self.assertEqual(sorted([entry["iteration"] \
+                                 for entry in other.find()]), [1, 2, 3])
+        self.assertEqual(len(archive.find(iteration=3)), 1)
+
+    def test_bad_compression(self):
+        self.assertRaises(ValueError, RunArchive, self.archive_dir,
+                          compression="zip")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import unittest
+import pkg_resources
+
+from nastranwrapper.nastran_case_control import needed_requests, \
+     trim_case_control, request_for_header, load_case_subcases
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+class TestCaseControl(unittest.TestCase):
+
+    def lines(self, name):
+        fh = open(os.path.join(DIRECTORY, "bdf_files", name))
+        lines = fh.read().split("\n")
+        fh.close()
+        return lines
+
+    def case_control(self, lines):
+        return lines[lines.index("CEND") + 1:lines.index("BEGIN BULK")]
+
+    def test_headers(self):
+        self.assertEqual(request_for_header("displacement vector"),
+                         "DISPLACEMENT")
+        self.assertEqual(request_for_header(
+            "S T R E S S E S   I N   R O D   E L E M E N T S"), "STRESS")
+        self.assertEqual(request_for_header("real eigenvalues"), None)
+        self.assertRaises(KeyError, request_for_header, "something else")
+
+    def test_needed_requests(self):
+        self.assertEqual(needed_requests(
+            [("displacement vector", {"POINT ID.": "1"}),
+             ("displacement vector", {"POINT ID.": "2"}),
+             ("stresses in rod elements", {"ELEMENT ID.": "3"}),
+             ("stresses in bar elements", {}),
+             ("real eigenvalues", {"MODE NO.": "1"})]),
+            {"DISPLACEMENT": set([1, 2]), "STRESS": None})
+        # the ids of an Array output
+        self.assertEqual(needed_requests(
+            [("displacement vector", {"POINT ID.": [4, 5]}),
+             ("displacement vector", {"POINT ID.": "1"}),
+             ("stresses in rod elements", {"ELEMENT ID.": slice(1, 9)})]),
+            {"DISPLACEMENT": set([1, 4, 5]), "STRESS": None})
+
+    def test_trim(self):
+        lines = self.lines("bar10.bdf")
+        trimmed = trim_case_control(lines, {"DISPLACEMENT": set([3, 1]),
+                                            "OLOAD": None})
+        self.assertEqual(self.case_control(trimmed), [
+            "SET 1001 = 1, 3",
+            "OLOAD = ALL",
+            "TITLE = MSC.NASTRAN JOB CREATED ON 29-JUL-09 AT 16:31:42",
+            "ECHO = NONE",
+            "SUBCASE 1",
+            "$ Subcase name : Default",
+            "   SUBTITLE=Default",
+            "   SPC = 2",
+            "   LOAD = 10",
+            "   DISPLACEMENT(SORT1,REAL) = 1001",
+            "$    SPCFORCES(SORT1,REAL)=ALL",
+            "$    STRESS(SORT1,REAL,VONMISES,BILIN)=ALL"])
+        # the bulk data is left alone
+        self.assertEqual(trimmed[trimmed.index("BEGIN BULK"):],
+                         lines[lines.index("BEGIN BULK"):])
+
+    def test_keep_and_unknown(self):
+        lines = self.lines("bar3.bdf")
+        trimmed = self.case_control(trim_case_control(
+            lines, {"STRESS": None}, keep=["FORC"]))
+        self.assertTrue("   STRESS(SORT1,REAL,VONMISES,BILIN) = ALL" in trimmed)
+        self.assertTrue("   FORCE(SORT1,REAL,BILIN)=ALL" in trimmed)
+        self.assertTrue("$    SPCFORCES(SORT1,REAL)=ALL" in trimmed)
+
+        # None only turns the echo off
+        trimmed = trim_case_control(self.lines("bar10.bdf"), None)
+        self.assertEqual(len(trimmed), len(self.lines("bar10.bdf")))
+        self.assertTrue("ECHO = NONE" in trimmed)
+        self.assertTrue("   STRESS(SORT1,REAL,VONMISES,BILIN)=ALL" in trimmed)
+
+    def test_long_set(self):
+        trimmed = self.case_control(trim_case_control(
+            self.lines("bar25.bdf"), {"DISPLACEMENT": set(range(1, 11))}))
+        self.assertEqual(trimmed[:2], ["SET 1001 = 1, 2, 3, 4, 5, 6, 7, 8,",
+                                       "   9, 10"])
+
+    def test_load_cases(self):
+        lines = self.lines("bar10.bdf")
+        cases = [{"name": "up", "LOAD": 10},
+                 {"name": "down", "LOAD": 20, "SPC": 3,
+                  "TEMPERATURE(LOAD)": 9}]
+        new = load_case_subcases(lines, cases)
+        self.assertEqual(self.case_control(new), [
+            "TITLE = MSC.NASTRAN JOB CREATED ON 29-JUL-09 AT 16:31:42",
+            "ECHO = SORT",
+            "SUBCASE 1",
+            "   LABEL = up",
+            "$ Subcase name : Default",
+            "   SUBTITLE=Default",
+            "   SPC = 2",
+            "   LOAD = 10",
+            "   DISPLACEMENT(SORT1,REAL)=ALL",
+            "   SPCFORCES(SORT1,REAL)=ALL",
+            "   STRESS(SORT1,REAL,VONMISES,BILIN)=ALL",
+            "SUBCASE 2",
+            "   LABEL = down",
+            "$ Subcase name : Default",
+            "   SUBTITLE=Default",
+            "   SPC = 3",
+            "   LOAD = 20",
+            "   DISPLACEMENT(SORT1,REAL)=ALL",
+            "   SPCFORCES(SORT1,REAL)=ALL",
+            "   STRESS(SORT1,REAL,VONMISES,BILIN)=ALL",
+            "   TEMPERATURE(LOAD) = 9"])
+
+        # the output requests are trimmed in every subcase
+        trimmed = self.case_control(trim_case_control(
+            new, {"DISPLACEMENT": set([1])}))
+        self.assertEqual(trimmed.count("   DISPLACEMENT(SORT1,REAL) = 1001"),
+                         2)
+
+    def test_load_cases_full_names(self):
+        lines = ["SOL 101", "CEND", "SUBCASE 1", "   LOADSET = 5",
+                 "   LOAD = 10", "   TEMPERATURE(INITIAL) = 7",
+                 "   DISPLACEMENT = ALL", "BEGIN BULK", "ENDDATA"]
+        new = self.case_control(load_case_subcases(
+            lines, [{"LOAD": 20, "TEMP": 8, "DISP": "NONE"}]))
+        # LOAD isn't LOADSET, and TEMP isn't TEMPERATURE, but an
+        # output request can be abbreviated
+        self.assertEqual(new, ["SUBCASE 1", "   LOADSET = 5",
+                               "   LOAD = 20",
+                               "   TEMPERATURE(INITIAL) = 7",
+                               "   DISP = NONE", "   TEMP = 8"])
+
+    def test_load_cases_replace_subcases(self):
+        new = self.case_control(load_case_subcases(
+            self.lines("ring_25dv.bdf"), [{"LOAD": 104}]))
+        self.assertEqual(new[-2:], ["SUBCASE 1", "   LOAD = 104"])
+        self.assertEqual(len([line for line in new \
+                              if line.startswith("SUBCASE")]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pkg_resources
+
+from nastranwrapper.nastran_maker import NastranMaker
+from nastranwrapper.nastran_replacer import NastranReplacer
+from nastranwrapper.nastran_deck import BulkDeck, SHORT, LONG, FREE, \
+     FREE_LONG
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+TEMPLATE = """SOL 101
+CEND
+METHOD %*n
+BEGIN BULK
+PBAR     1       1      40.     333.333 53.3333 259.865                 +      A
++      A5.      2.      -5.     2.      -5.     -2.     5.      -2.     +      B
++      B.833333 .833333
+$ a comment
+PROD    12      5       %area
+PROD*   13              5               4.0
+MAT1    5       %youngs         .3
+GRID,21,,1.0,2.0,3.0
+CBAR,31,1,21,22,0.,1.,0.,,+
+,,,,,,2.5
+GRID*,22,,1.123456789012345678,2.0
+*,3.0
+ENDDATA
+"""
+
+VARIABLES = {"*n": 104, "area": 2.5, "youngs": 3.0e7}
+
+class TestBulkDeck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.template = os.path.join(self.tmpdir, "template.bdf")
+        fh = open(self.template, "w")
+        fh.write(TEMPLATE)
+        fh.close()
+        self.deck = BulkDeck(self.template)
+
+    def tearDown(self):
+        self.deck.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, changes, variables=VARIABLES):
+        maker = NastranMaker([])
+        for change in changes:
+            maker.set(*change)
+        filename = os.path.join(self.tmpdir, "result.bdf")
+        self.deck.write(filename, maker, variables)
+        return open(filename).read()
+
+    def expected(self, changes, variables=VARIABLES):
+        replacer = NastranReplacer(TEMPLATE.split("\n"))
+        replacer.replace(variables)
+        maker = NastranMaker(replacer.text)
+        for change in changes:
+            maker.set(*change)
+        filename = os.path.join(self.tmpdir, "expected.bdf")
+        maker.write_to_file(open(filename, "w"), 10001)
+        return open(filename).read()
+
+    def test_index(self):
+        layouts = [(card.name, card.cid, card.layout) \
+                   for card in self.deck.cards]
+        self.assertEqual(layouts, [("PBAR", "1", SHORT),
+                                   ("PROD", "12", SHORT),
+                                   ("PROD", "13", LONG),
+                                   ("MAT1", "5", SHORT),
+                                   ("GRID", "21", FREE),
+                                   ("CBAR", "31", FREE),
+                                   ("GRID", "22", FREE_LONG)])
+        pbar = self.deck.card("PBAR", 1)
+        self.assertEqual(TEMPLATE[pbar.start:pbar.end].count("\n"), 3)
+
+    def test_values(self):
+        self.assertEqual(self.deck.values(self.deck.card("PBAR", 1)),
+                         ["PBAR", "1", "1", "40.", "333.333", "53.3333",
+                          "259.865", "", "", "5.", "2.", "-5.", "2.",
+                          "-5.", "-2.", "5.", "-2.", ".833333",
+                          ".833333"])
+        self.assertEqual(self.deck.values(self.deck.card("CBAR", 31)),
+                         ["CBAR", "31", "1", "21", "22", "0.", "1.", "0.",
+                          "", "", "", "", "", "", "2.5"])
+        self.assertEqual(self.deck.values(self.deck.card("GRID", 22)),
+                         ["GRID", "22", "", "1.12345678901", "2.0",
+                          "3.0"])
+
+    def test_same_as_maker(self):
+        changes = [("PBAR", "1", 2, 7), ("PROD", "13", 3, 5.5),
+                   ("PBAR", "1", 12, 1.25)]
+        self.assertEqual(self.write(changes), self.expected(changes))
+        # nothing changed, so nothing is rendered again
+        rendered = self.deck.card("PBAR", 1).rendered
+        self.assertEqual(self.write(changes), self.expected(changes))
+        self.assertTrue(self.deck.card("PBAR", 1).rendered is rendered)
+
+    def test_continuation_numbers(self):
+        # a card keeps its continuation numbers from run to run
+        for value in range(5):
+            result = self.write([("PBAR", "1", 2, value)])
+        self.assertTrue("*10004  .833333" in result)
+        self.assertEqual(self.deck._unique_int, 10005)
+        # and gets more only if it needs more
+        result = self.write([("PBAR", "1", 2, 1), ("PBAR", "1", 26, 2.)])
+        self.assertTrue("*10005" in result)
+        self.assertFalse("*10001" in result)
+
+    def test_free_field(self):
+        result = self.write([("GRID", "21", 3, 1.5)])
+        self.assertTrue("GRID*   21                              1.5" \
+                        "             2.0             *10001" in result)
+        self.assertTrue("*10001  3.0" in result)
+        self.assertFalse("GRID,21" in result)
+
+        # the continuation row of a free field card is found too
+        result = self.write([("CBAR", "31", 4, 23)])
+        self.assertTrue("CBAR*   31              1               " \
+                        "21              23" in result)
+        self.assertFalse(",,,,,,2.5" in result)
+
+    def test_revert(self):
+        self.write([("PROD", "13", 3, 7)])
+        result = self.write([("PBAR", "1", 3, 6)])
+        self.assertTrue("PROD*   13              5               4.0\n" \
+                        in result)
+        self.assertEqual(self.write([], {"*n": 1, "area": 2.5,
+                                         "youngs": 3.0e7}),
+                         self.expected([], {"*n": 1, "area": 2.5,
+                                            "youngs": 3.0e7}))
+
+    def test_variable_inside_changed_card(self):
+        self.assertRaises(RuntimeError, self.write, [("MAT1", "5", 4, .33)])
+
+    def test_missing_and_duplicate_cards(self):
+        self.assertRaises(RuntimeError, self.write, [("PROD", "14", 3, 1.)])
+        deck = BulkDeck(os.path.join(DIRECTORY, "bdf_files", "bar25.bdf"))
+        self.assertEqual(len([card for card in deck.cards \
+                              if card.name == "PROD"]), 25)
+        # a load set has many FORCE cards with the same id
+        self.assertEqual(deck.duplicates, set([("FORCE", "10"),
+                                               ("FORCE", "20")]))
+        deck.close()
+
+    def test_real_deck(self):
+        template = os.path.join(DIRECTORY, "bdf_files", "bar25.bdf")
+        changes = [("PROD", str(i), 3, 0.5 * i) for i in range(1, 26)]
+        text = open(template).read().split("\n")
+        maker = NastranMaker(text)
+        for change in changes:
+            maker.set(*change)
+        expected = os.path.join(self.tmpdir, "expected.bdf")
+        maker.write_to_file(open(expected, "w"), 10001)
+
+        deck = BulkDeck(template)
+        maker = NastranMaker([])
+        for change in changes:
+            maker.set(*change)
+        result = os.path.join(self.tmpdir, "result.bdf")
+        deck.write(result, maker)
+        deck.close()
+        self.assertEqual(open(expected).read(), open(result).read())
+
+
+if __name__ == "__main__":
+    unittest.main()
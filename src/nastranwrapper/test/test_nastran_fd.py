@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pkg_resources
+
+import numpy
+
+from nastranwrapper.nastran_deck import BulkDeck
+from nastranwrapper.nastran_maker import NastranMaker, data_field
+from nastranwrapper.nastran_fd import FiniteDifferenceBatch, fd_steps, \
+     written_steps, fd_jacobian, run_jobs, FD_UNIQUE_INT
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+class TestFiniteDifference(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        fh = open(os.path.join(DIRECTORY, "bdf_files", "bar10.bdf"))
+        self.text = fh.read()
+        fh.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, name):
+        fh = open(os.path.join(self.tmpdir, name))
+        text = fh.read()
+        fh.close()
+        return text
+
+    def test_steps(self):
+        steps = fd_steps([0., .5, -20.], 1.e-6)
+        self.assertTrue(numpy.allclose(steps, [1.e-6, 1.e-6, 2.e-5]))
+        # 10 + 1e-6 writes fine, 1e12 + 1 doesn't in 16 characters
+        steps = written_steps([10., 1.e12], [1.e-6, 1.])
+        self.assertAlmostEqual(steps[0], 1.e-6, 12)
+        self.assertEqual(steps[1], 0.)
+
+    def test_jacobian(self):
+        J = fd_jacobian([1., 2.], [[1.5, 2.], [1., 1.]], [.5, .25])
+        self.assertTrue(numpy.allclose(J, [[1., 0.], [0., -4.]]))
+        self.assertRaises(ValueError, fd_jacobian, [1.], [[1.]], [0.])
+
+    def test_run_jobs(self):
+        self.assertEqual(run_jobs(lambda x: x * x, range(5), 3),
+                         [0, 1, 4, 9, 16])
+        self.assertEqual(run_jobs(lambda x: -x, [2], 0), [-2])
+
+    def test_batch(self):
+        base = os.path.join(self.tmpdir, "base.bdf")
+        fh = open(base, "w")
+        fh.write(self.text)
+        fh.close()
+
+        batch = FiniteDifferenceBatch(base)
+        try:
+            batch.write(os.path.join(self.tmpdir, "1.bdf"), "PROD", 3, 3,
+                        10.000001)
+            batch.write(os.path.join(self.tmpdir, "2.bdf"), "PROD", 7, 3,
+                        10.000001)
+        finally:
+            batch.close()
+
+        # the same as NastranMaker on the whole deck
+        for name, cid in (("1.bdf", 3), ("2.bdf", 7)):
+            maker = NastranMaker(self.text.split("\n"))
+            maker.set("PROD", cid, 3, 10.000001)
+            expected = os.path.join(self.tmpdir, "expected.bdf")
+            fh = open(expected, "w")
+            maker.write_to_file(fh, FD_UNIQUE_INT)
+            fh.close()
+            self.assertEqual(self.read(name).rstrip("\n"),
+                             self.read("expected.bdf").rstrip("\n"))
+
+        # the first perturbation is gone from the second deck
+        self.assertTrue("PROD     3       1       10." in self.read("2.bdf"))
+
+    def test_batch_long_base(self):
+        # in the base deck MAT1 has been rewritten in long field, so
+        # fieldnum 5 of the template (RHO) is another slot there
+        maker = NastranMaker(self.text.split("\n"))
+        maker.set("MAT1", 1, 2, 2.e7)
+        base = os.path.join(self.tmpdir, "base.bdf")
+        fh = open(base, "w")
+        maker.write_to_file(fh, 10001)
+        fh.close()
+
+        self.assertEqual(data_field(5, False), 5)
+        self.assertEqual(data_field(12, False), 10)
+        self.assertEqual(data_field(7, True), 5)
+        self.assertRaises(ValueError, data_field, 9, False)
+        batch = FiniteDifferenceBatch(base)
+        try:
+            batch.write(os.path.join(self.tmpdir, "1.bdf"), "MAT1", 1,
+                        data_field(5, False), .2)
+        finally:
+            batch.close()
+
+        deck = BulkDeck(os.path.join(self.tmpdir, "1.bdf"))
+        try:
+            values = deck.values(deck.card("MAT1", 1))
+        finally:
+            deck.close()
+        # only RHO changed
+        self.assertEqual(float(values[2]), 2.e7)
+        self.assertEqual(float(values[4]), .3)
+        self.assertEqual(float(values[5]), .2)
+
+    def test_batch_design(self):
+        # the design.bdf of nastran_include_base is only bulk data
+        design = os.path.join(self.tmpdir, "design.bdf")
+        fh = open(design, "w")
+        fh.write("PROD,3,1,10.\nPROD,7,1,10.\n")
+        fh.close()
+
+        batch = FiniteDifferenceBatch(design, True)
+        try:
+            batch.write(os.path.join(self.tmpdir, "1.bdf"), "PROD", 7, 3,
+                        10.5)
+        finally:
+            batch.close()
+        lines = self.read("1.bdf").split("\n")
+        self.assertEqual(lines[0], "PROD,3,1,10.")
+        self.assertTrue(lines[1].startswith("PROD*"))
+        self.assertTrue("10.5" in lines[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pkg_resources
+
+import numpy
+
+from nastranwrapper.nastran_deck import BulkDeck
+from nastranwrapper.nastran_groups import element_properties, fill_ids, \
+     template_properties, GroupIndex
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+DECK = """BEGIN BULK
+CQUAD4  7       20      1       2       3       4
+CROD    3       10      1       2
+CROD,1,10,1,2
+CBAR    5               1       2       0.      0.      1.
+CONROD  9       1       2       5       1.
+PROD    10      5       1.
+PSHELL  20      5       .1      5
+ENDDATA
+"""
+
+
+class TestGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_properties(self):
+        filename = os.path.join(self.tmpdir, "deck.bdf")
+        fh = open(filename, "w")
+        fh.write(DECK)
+        fh.close()
+        deck = BulkDeck(filename)
+        try:
+            elements, pids, names = element_properties(deck)
+        finally:
+            deck.close()
+        self.assertEqual(elements.tolist(), [1, 3, 5, 7])
+        # a blank property id is the element id
+        self.assertEqual(pids.tolist(), [10, 10, 5, 20])
+        self.assertEqual(names.tolist(), ["CROD", "CROD", "CBAR", "CQUAD4"])
+
+        index = GroupIndex(elements, pids, [20, [10, 5]])
+        self.assertEqual(index.group_of([7, 1, 5]).tolist(), [0, 1, 1])
+        self.assertRaises(RuntimeError, index.group_of, [2])
+        self.assertRaises(ValueError, GroupIndex, elements, pids, [10, 99])
+        self.assertRaises(ValueError, GroupIndex, elements, pids, [10, [10]])
+
+        # the second fiber of a plate has no element id
+        ids = fill_ids(["7", "", "1", "3", "5"])
+        self.assertEqual(ids.tolist(), [7, 7, 1, 3, 5])
+        values = [1., 4., -30., numpy.nan, 2.]
+        self.assertEqual(index.reduce(ids, values).tolist(), [4., 2.])
+        self.assertEqual(index.reduce(ids, values, "maxabs").tolist(),
+                         [4., 30.])
+        self.assertEqual(index.reduce(ids, values, "sum").tolist(),
+                         [5., -28.])
+        # the blank value of element 3 doesn't count
+        self.assertEqual(index.reduce(ids, values, "mean").tolist(),
+                         [2.5, -14.])
+        self.assertTrue(numpy.isnan(index.reduce([7], [1.])[1]))
+        self.assertRaises(ValueError, index.reduce, ids, values, "median")
+
+    def test_includes(self):
+        # the rods are in a file the template INCLUDEs
+        filename = os.path.join(self.tmpdir, "deck.bdf")
+        fh = open(filename, "w")
+        fh.write("BEGIN BULK\nCQUAD4  7       20      1       2       3\n"
+                 "INCLUDE 'rods.bdf'\nENDDATA\n")
+        fh.close()
+        fh = open(os.path.join(self.tmpdir, "rods.bdf"), "w")
+        fh.write("CROD    3       10      1       2\n")
+        fh.close()
+        elements, pids, names = template_properties(filename)
+        self.assertEqual(elements.tolist(), [3, 7])
+        self.assertEqual(pids.tolist(), [10, 20])
+
+        os.remove(os.path.join(self.tmpdir, "rods.bdf"))
+        self.assertRaises(RuntimeError, template_properties, filename)
+
+    def test_bar25(self):
+        # the groups bar25_static_nastran.py spells out element by element
+        element_groups = [range(1, 2), range(2, 6), range(6, 10),
+                          range(10, 14), range(14, 15), range(20, 21),
+                          range(22, 23), range(15, 16), range(18, 19),
+                          range(23, 24), range(16, 17), range(21, 22),
+                          range(25, 26), range(17, 18), range(19, 20),
+                          range(24, 25)]
+        deck = BulkDeck(os.path.join(DIRECTORY, "bdf_files", "bar25.bdf"))
+        try:
+            elements, pids, names = element_properties(deck)
+        finally:
+            deck.close()
+        self.assertEqual(len(elements), 25)
+
+        # every rod has a property of its own (though rods 24 and 25
+        # have each other's), so each group is a list of properties
+        groups = [[pids[element - 1] for element in group] \
+                  for group in element_groups]
+        self.assertEqual(groups[-1], [25])
+        index = GroupIndex(elements, pids, groups)
+        stresses = numpy.sin(numpy.arange(1, 26)) * 1000.
+        expected = [max([abs(stresses[element - 1]) for element in group]) \
+                    for group in element_groups]
+        self.assertTrue(numpy.allclose(
+            index.reduce(numpy.arange(1, 26), stresses, "maxabs"), expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
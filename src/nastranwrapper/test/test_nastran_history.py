@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from nastranwrapper.nastran_history import read_history, magnitude_phase
+
+PAGE = "1    TRANSIENT RUN                          OCTOBER  19, 2026  " \
+       "MSC.NASTRAN  1/ 1/11   PAGE    %d"
+
+def sort1_page(page, time, rows, subcase=1):
+    lines = ["0                                                          " \
+             "                     SUBCASE %d" % subcase,
+             "      TIME =  %.6E" % time,
+             "                                             D I S P L A C " \
+             "E M E N T   V E C T O R",
+             " ",
+             "      POINT ID.   TYPE          T1             T2             T3"]
+    for point, values in rows:
+        lines.append("             %d      G   " % point + \
+                     "".join(["%15.6E" % value for value in values]))
+    lines.append(PAGE % page)
+    return lines
+
+SORT2 = """0                                                                               SUBCASE 1
+      POINT-ID =         2
+                                       C O M P L E X   D I S P L A C E M E N T   V E C T O R
+                                                          (MAGNITUDE/PHASE)
+
+      FREQUENCY   TYPE          T1             T2
+0   1.000000E+01     G      2.000000E+00   1.000000E+00
+                            9.000000E+01   0.0
+0   2.000000E+01     G      3.000000E+00   1.000000E+00
+                            1.800000E+02   0.0
+                                       F O R C E S   I N   R O D   E L E M E N T S
+0   1.000000E+01            5.000000E+00   1.000000E+00
+1    FREQUENCY RUN                          OCTOBER  19, 2026  MSC.NASTRAN  1/ 1/11   PAGE     2
+0                                                                               SUBCASE 1
+      POINT-ID =         1
+                                       C O M P L E X   D I S P L A C E M E N T   V E C T O R
+                                                          (MAGNITUDE/PHASE)
+
+      FREQUENCY   TYPE          T1             T2
+0   2.000000E+01     G      1.000000E+00   4.000000E+00
+                            0.0            0.0
+1    FREQUENCY RUN                          OCTOBER  19, 2026  MSC.NASTRAN  1/ 1/11   PAGE     3
+""".split("\n")
+
+
+class TestHistory(unittest.TestCase):
+
+    def test_sort1(self):
+        # a time step can go over more than one page, and the steps
+        # of another subcase are left out
+        lines = sort1_page(1, 0., [(1, [1., 2., 3.]), (2, [4., 5., 6.])]) + \
+                sort1_page(2, .01, [(1, [7., 8., 9.])]) + \
+                sort1_page(3, .01, [(2, [-1., -2., -3.e-3])]) + \
+                sort1_page(4, .01, [(3, [0., 0., 0.])], subcase=2)
+        steps, ids, values = read_history(lines, "displacement vector", 1)
+        self.assertEqual(steps.tolist(), [0., .01])
+        self.assertEqual(ids.tolist(), [1, 2])
+        self.assertEqual(values.shape, (2, 2, 3))
+        self.assertEqual(values[1, 1].tolist(), [-1., -2., -3.e-3])
+        self.assertEqual(values[:, 0, 2].tolist(), [3., 9.])
+
+        self.assertEqual(read_history(lines, "displacement vector")[1] \
+                         .tolist(), [1, 2, 3])
+        self.assertRaises(RuntimeError, read_history, lines,
+                          "stress vector")
+
+    def test_sort2_complex(self):
+        steps, ids, values = read_history(SORT2, "displacement vector")
+        self.assertEqual(steps.tolist(), [10., 20.])
+        self.assertEqual(ids.tolist(), [1, 2])
+        self.assertTrue(numpy.iscomplexobj(values))
+        self.assertTrue(numpy.allclose(values[0, 1], [2.j, 1.]))
+        self.assertTrue(numpy.allclose(values[1, 1], [-3., 1.]))
+        self.assertTrue(numpy.allclose(values[1, 0], [1., 4.]))
+        # point 1 isn't printed at 10 Hz
+        self.assertTrue(numpy.isnan(values[0, 0]).all())
+
+        magnitude, phase = magnitude_phase(values[1])
+        self.assertTrue(numpy.allclose(magnitude, [[1., 4.], [3., 1.]]))
+        self.assertTrue(numpy.allclose(phase[1], [180., 0.]))
+
+    def test_memmap(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "history.npy")
+            values = read_history(SORT2, "displacement vector",
+                                  filename=filename)[2]
+            self.assertTrue(isinstance(values, numpy.memmap))
+            del values
+            values = numpy.load(filename)
+            self.assertTrue(numpy.allclose(values[1, 0], [1., 4.]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nastranwrapper.nastran_license import LicenseSemaphore, license_failure
+
+class TestLicenseSemaphore(unittest.TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def test_tokens_are_exclusive(self):
+        first = LicenseSemaphore(self.lock_dir, 1, poll_interval=0.01)
+        second = LicenseSemaphore(self.lock_dir, 1, poll_interval=0.01)
+        first.acquire()
+        self.assertRaises(RuntimeError, second.acquire, 0.05)
+        first.release()
+        wait = second.acquire(0.05)
+        self.assertTrue(wait < 0.05)
+        second.release()
+
+    def test_several_tokens(self):
+        holders = [LicenseSemaphore(self.lock_dir, 2, poll_interval=0.01)
+                   for i in range(3)]
+        holders[0].acquire()
+        holders[1].acquire()
+        self.assertTrue(holders[0].token != holders[1].token)
+        self.assertRaises(RuntimeError, holders[2].acquire, 0.05)
+        holders[1].release()
+        holders[2].acquire(0.05)
+        holders[0].release()
+        holders[2].release()
+
+    def test_double_release(self):
+        semaphore = LicenseSemaphore(self.lock_dir, 1)
+        semaphore.acquire()
+        semaphore.release()
+        semaphore.release()
+        self.assertTrue(semaphore.token is None)
+
+
+class TestLicenseFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmpdir, name)
+        fh = open(filename, "w")
+        fh.write(text)
+        fh.close()
+        return filename
+
+    def test_detects_failure(self):
+        log = self.write("input.log", "MSC.Nastran started\n" + \
+                         " *** Unable to obtain a license for feature " + \
+                         "NASTRAN\n")
+        self.assertTrue("license" in license_failure([log]))
+
+    def test_clean_run(self):
+        out = self.write("input.out", "D I S P L A C E M E N T   " + \
+                         "V E C T O R\n")
+        missing = os.path.join(self.tmpdir, "missing.log")
+        self.assertTrue(license_failure([missing, out]) is None)
+
+
+if __name__ == "__main__":
+    unittest.main()
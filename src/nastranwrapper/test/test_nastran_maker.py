@@ -1,6 +1,9 @@
 import unittest
 
+import numpy
+
 from nastranwrapper.nastran_maker import NastranMaker
+from nastranwrapper.nastran_util import bulk_data_bounds
 
 class TestNastranMaker(unittest.TestCase):
 
@@ -46,6 +49,74 @@ class TestNastranMaker(unittest.TestCase):
         self.maker._output(10001)
         self.assertTrue(t == self.maker.text)
 
+    def test_split(self):
+        s = ["SOL 101", "CEND", "BEGIN BULK",
+             "PROD    12      5     ",
+             "PBAR     1       1      40.     333.333 53.3333 259.865                 +      A", "+      A5.      2.      -5.     2.      -5.     -2.     5.      -2.",
+             "GRID     1               0.      0.      0.",
+             "ENDDATA"]
+        self.go(list(s))
+        self.maker.set("PROD", "12", 2, 7)
+        self.maker.set("PBAR", "1", 2, 7)
+        changed = self.maker.split(10001)
+
+        # only the unchanged cards are left
+        self.assertEqual(self.maker.text, ["SOL 101", "CEND", "BEGIN BULK",
+            "GRID     1               0.      0.      0.", "ENDDATA"])
+        self.assertTrue("PROD*   12              7               " in changed)
+        self.assertEqual(len(changed), 5)
+        self.assertEqual(bulk_data_bounds(self.maker.text), (2, 4))
+        self.assertEqual(bulk_data_bounds(s[:-1]), (2, 7))
+        self.assertRaises(RuntimeError, bulk_data_bounds, s[:2])
+
+    def test_set_many(self):
+        s = ["PROD    12      5       1.",
+             "PROD    13      5       1."]
+        self.go(s)
+        self.maker.set_many([("PROD", "12", 3), ("PROD", "13", 3),
+                             ("PROD", "13", 4)], numpy.array([2., 3., .5]))
+        self.maker._output(10001)
+        self.assertEqual(self.maker.text,
+                         ["PROD*   12              5               2.0     " \
+                          "        ",
+                          "PROD*   13              5               3.0     " \
+                          "        0.5             "])
+        self.assertRaises(ValueError, self.maker.set_many,
+                          [("PROD", "12", 3)], [1., 2.])
+
+    def test_many_cards(self):
+        # all the cards are found in one pass, and each lands in place
+        s = ["GRID    %-8d        %-8s0.      0." % (i, float(i)) \
+             for i in range(1, 301)]
+        self.go(list(s))
+        self.maker.set_many([("GRID", str(i), 4) for i in range(1, 301, 2)],
+                            numpy.ones(150))
+        self.maker._output(10001)
+        cards = [line for line in self.maker.text \
+                 if line.startswith("GRID")]
+        self.assertEqual(len(cards), 300)
+        for i, line in enumerate(cards):
+            # in the order of the template, every other one changed
+            self.assertEqual(line.split()[1], str(i + 1))
+            self.assertEqual(line.startswith("GRID*"), i % 2 == 0)
+
+    def test_continuation_field(self):
+        # a field past the end of the card goes on a new row
+        self.go(["PROD    12      5       1."])
+        self.maker.set("PROD", "12", 11, 2)
+        self.maker._output(10001)
+        self.assertEqual(len(self.maker.text), 3)
+        self.assertTrue(self.maker.text[2].startswith("*10002  2"))
+
+        # but a continuation field can't be set
+        for fieldnum in [9, 10, 19]:
+            self.go(["PROD    12      5       1."])
+            self.maker.set("PROD", "12", fieldnum, 2)
+            self.assertRaises(ValueError, self.maker._output, 10001)
+        self.go(["PROD*   12              5               1."])
+        self.maker.set("PROD", "12", 5, 2)
+        self.assertRaises(ValueError, self.maker._output, 10001)
+
 
 if __name__ == "__main__":
     unittest.main()
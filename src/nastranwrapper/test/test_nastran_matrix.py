@@ -0,0 +1,131 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from nastranwrapper.nastran_matrix import read_op4, read_dmig, \
+     read_matrices
+
+def op4_header(ncol, nrow, nform, ntype, name):
+    return "%8d%8d%8d%8d%-8s1P,3E23.16" % (ncol, nrow, nform, ntype, name)
+
+def op4_values(values):
+    lines = []
+    for start in range(0, len(values), 3):
+        lines.append("".join(["%23.16E" % value \
+                              for value in values[start:start + 3]]))
+    return lines
+
+def record(data):
+    return struct.pack("<i", len(data)) + data + struct.pack("<i", len(data))
+
+# a symmetric DMIG, punched in long field
+DMIG = """DMIG    KAAX           0       6       1       0                       2
+DMIG*   KAAX                           1               1
+*                      1               1 2.000000000D+00
+*                      2               3-5.000000000D-01
+DMIG*   KAAX                           2               3
+*                      2               3 4.000000000D+00
+"""
+
+class TestMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        filename = os.path.join(self.tmpdir, name)
+        fh = open(filename, "wb")
+        fh.write(data)
+        fh.close()
+        return filename
+
+    def test_ascii(self):
+        lines = [op4_header(3, 4, 2, 2, "KAA")]
+        # column 1, rows 1 and 2
+        lines.append("%8d%8d%8d" % (1, 1, 4))
+        lines.extend(op4_values([1., -2.5]))
+        # column 3, rows 2 to 4
+        lines.append("%8d%8d%8d" % (3, 2, 6))
+        lines.extend(op4_values([3., 4., -1.25e-7]))
+        lines.append("%8d%8d%8d" % (4, 1, 2))
+        lines.extend(op4_values([0.]))
+        # a complex one
+        lines.append(op4_header(1, 2, 2, 4, "CMPLX"))
+        lines.append("%8d%8d%8d" % (1, 2, 4))
+        lines.extend(op4_values([1., 2.]))
+        lines.append("%8d%8d%8d" % (2, 1, 2))
+        lines.extend(op4_values([0.]))
+        filename = self.write("kaa.op4", "\n".join(lines) + "\n")
+
+        matrices = read_op4(filename)
+        expected = numpy.zeros((4, 3))
+        expected[:2, 0] = [1., -2.5]
+        expected[1:, 2] = [3., 4., -1.25e-7]
+        self.assertTrue(numpy.array_equal(matrices["KAA"], expected))
+        self.assertTrue(numpy.array_equal(matrices["CMPLX"],
+                                          [[0.], [1. + 2.j]]))
+
+    def test_binary(self):
+        data = record(struct.pack("<4i8s", 2, -3, 1, 1, "KGG     "))
+        data += record(struct.pack("<3i2f", 1, 2, 2, 5., 6.))
+        # a sparse BIGMAT column: strings at rows 1 and 3
+        data += record(struct.pack("<3i", 2, 0, 6) + \
+                       struct.pack("<2if", 2, 1, 7.) + \
+                       struct.pack("<2if", 2, 3, 8.))
+        data += record(struct.pack("<3if", 3, 1, 1, 0.))
+        filename = self.write("kgg.op4", data)
+
+        expected = [[0., 7.], [5., 0.], [6., 8.]]
+        self.assertTrue(numpy.array_equal(read_op4(filename)["KGG"],
+                                          expected))
+        try:
+            import scipy.sparse
+        except ImportError:
+            return
+        matrix = read_op4(filename, sparse=True)["KGG"]
+        self.assertTrue(scipy.sparse.issparse(matrix))
+        self.assertTrue(numpy.array_equal(matrix.toarray(), expected))
+
+    def test_dmig(self):
+        filename = self.write("model.pch", DMIG)
+        matrix, rows, columns = read_dmig(filename)["KAAX"]
+        self.assertEqual(rows.tolist(), [[1, 1], [2, 3]])
+        self.assertEqual(columns.tolist(), [[1, 1], [2, 3]])
+        self.assertTrue(numpy.array_equal(matrix, [[2., -.5], [-.5, 4.]]))
+
+        # a rectangular one in free field
+        filename = self.write("rect.bdf", "DMIG,KR,0,2,1,0,,,2\n" \
+                              "DMIG,KR,10,1,,1,2,3.5,,\n" \
+                              ",5,0,-1.\n" \
+                              "DMIG,KR,20,0,,1,2,2.\n")
+        matrix, rows, columns = read_dmig(filename)["KR"]
+        self.assertEqual(rows.tolist(), [[1, 2], [5, 0]])
+        self.assertEqual(columns.tolist(), [[10, 1], [20, 0]])
+        self.assertTrue(numpy.array_equal(matrix, [[3.5, 2.], [-1., 0.]]))
+        self.assertTrue(numpy.array_equal(read_matrices(filename)["KR"],
+                                          matrix))
+
+        # IFO 9: NCOL columns, numbered, and no mirroring
+        filename = self.write("ncol.bdf", "DMIG,KN,0,9,1,0,,,3\n" \
+                              "DMIG,KN,1,0,,7,0,1.5,,\n" \
+                              ",3,2,-2.\n" \
+                              "DMIG,KN,3,0,,7,0,4.\n")
+        matrix, rows, columns = read_dmig(filename)["KN"]
+        self.assertEqual(rows.tolist(), [[3, 2], [7, 0]])
+        self.assertEqual(columns.tolist(), [[1, 0], [2, 0], [3, 0]])
+        self.assertTrue(numpy.array_equal(matrix, [[-2., 0., 0.],
+                                                   [1.5, 0., 4.]]))
+        self.write("ncol.bdf", "DMIG,KN,0,9,1,0,,,2\n" \
+                   "DMIG,KN,3,0,,7,0,4.\n")
+        self.assertRaises(ValueError, read_dmig, filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
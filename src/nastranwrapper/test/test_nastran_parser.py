@@ -200,6 +200,70 @@ class TestNastranParser(unittest.TestCase):
         self.assertTrue(len(element_2[0]) == 15)
         self.assertTrue(element_2[0][:2] == [['8.079449E+03'], ['1.242515E+04']])
 
+        # the rows without an element id go with the one above them
+        ids, von_mises = self.parser.get_array(h, None, {"ELEMENT ID": [2]},
+                                               ["VON MISES"])
+        self.assertEqual(ids.tolist(), [2] * 15)
+        self.assertEqual(von_mises.shape, (15, 1))
+        self.assertAlmostEqual(von_mises[1, 0], 1.242515E+04)
+
+    def test_select(self):
+        self.go("practice-grid.1.txt")
+        self.assertEqual(self.parser.column_names("displacement vector", 1),
+                         ["POINT ID.", "TYPE", "T1", "T2", "T3", "R1", "R2",
+                          "R3"])
+
+        # a range of ids, and a block of columns
+        ids, values = self.parser.get_array("displacement vector", 1,
+                                            {"POINT ID.": slice(5, 9)},
+                                            ["T1", "R2"])
+        self.assertEqual(ids.tolist(), [5, 6, 7, 8])
+        self.assertEqual(values.shape, (4, 2))
+        self.assertAlmostEqual(values[0, 1], 2.744697E-01)
+
+        # an array of ids comes back in the order of the ids, and an
+        # equality constraint still works
+        ids, rows = self.parser.select("displacement vector", 1,
+                                       {"POINT ID.": [17, 3], "TYPE": "G"},
+                                       ["R2"])
+        self.assertEqual(ids.tolist(), [3, 17])
+        self.assertEqual(rows[:, 0].tolist(), ["1.537090E-01",
+                                               "2.451840E-01"])
+
+    def test_plan(self):
+        self.go("practice-grid.1.txt")
+        plan = self.parser.plan("displacement vector", 1,
+                                {"POINT ID.": [17, 3]}, ["R2"])
+        self.assertEqual(plan.ids.tolist(), [3, 17])
+
+        # the same output again takes the rows from the same places
+        self.go("practice-grid.1.txt")
+        self.assertEqual(self.parser.extract(plan)[:, 0].tolist(),
+                         ["1.537090E-01", "2.451840E-01"])
+
+        # but not when the ids aren't there anymore
+        self.parser.grids[plan.index][plan.rows[0]][0] = "99"
+        self.assertEqual(self.parser.extract(plan), None)
+
+        # the printed order, as get has it
+        plan = self.parser.plan("displacement vector", 1, {"TYPE": "G"},
+                                ["T1"], by_id=False)
+        self.assertEqual(plan.ids, None)
+        self.assertEqual(self.parser.extract(plan).tolist(),
+                         self.parser.get("displacement vector", 1,
+                                         {"TYPE": "G"}, ["T1"]))
+
+
+    def test_lazy(self):
+        # the grids are parsed the first time they're needed
+        fh = open("practice-grid.1.txt", "r")
+        parser = NastranParser(fh.readlines())
+        fh.close()
+        self.assertEqual(parser.grids, None)
+        self.assertEqual(parser.get("displacement vector", 1,
+                                    {"POINT ID.": "3"}, ["R2"]),
+                         [["1.537090E-01"]])
+        self.assertNotEqual(parser.grids, None)
 
 
 if __name__ == "__main__":
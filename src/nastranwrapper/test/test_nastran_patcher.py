@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pkg_resources
+
+from nastranwrapper.nastran_maker import NastranMaker
+from nastranwrapper.nastran_replacer import NastranReplacer
+from nastranwrapper.nastran_patcher import TemplatePatcher
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+TEMPLATE = """SOL 101
+CEND
+METHOD %*n
+BEGIN BULK
+PBAR     1       1      40.     333.333 53.3333 259.865                 +      A
++      A5.      2.      -5.     2.      -5.     -2.     5.      -2.     +      B
++      B.833333 .833333
+$ a comment
+PROD    12      5       %area
+PROD*   13              5               4.0
+MAT1    5       %youngs         .3
+ENDDATA
+"""
+
+class TestTemplatePatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, text):
+        filename = os.path.join(self.tmpdir, "template.bdf")
+        fh = open(filename, "w")
+        fh.write(text)
+        fh.close()
+        return filename
+
+    def compare(self, template, changes, variables):
+        """The patcher has to write exactly what the replacer and maker
+        would have written."""
+        fh = open(template, "r")
+        text = fh.read().split("\n")
+        fh.close()
+        replacer = NastranReplacer(text)
+        replacer.replace(variables)
+        maker = NastranMaker(replacer.text)
+        for change in changes:
+            maker.set(*change)
+        expected_filename = os.path.join(self.tmpdir, "expected.bdf")
+        maker.write_to_file(open(expected_filename, "w"), 10001)
+
+        patcher = TemplatePatcher(template)
+        maker = NastranMaker([])
+        for change in changes:
+            maker.set(*change)
+        result_filename = os.path.join(self.tmpdir, "result.bdf")
+        patcher.write(result_filename, maker, variables)
+        # and once more, with the cards already found
+        patcher.write(result_filename, maker, variables)
+        patcher.close()
+
+        expected = open(expected_filename).read()
+        result = open(result_filename).read()
+        self.assertEqual(expected, result)
+        return result
+
+    def test_cards_and_variables(self):
+        template = self.write(TEMPLATE)
+        result = self.compare(template,
+                              [("PBAR", "1", 2, 7), ("PROD", "13", 3, 5.5),
+                               ("PROD", "12", 4, 1.25)],
+                              {"*n": 104, "area": 2.5, "youngs": 3.0e7})
+        self.assertTrue("METHOD 104" in result)
+        self.assertTrue("$ a comment\n" in result)
+
+    def test_variable_inside_changed_card(self):
+        template = self.write(TEMPLATE)
+        self.compare(template, [("MAT1", "5", 4, 0.33)],
+                     {"*n": 1, "area": 2.5, "youngs": 3.0e7})
+
+    def test_real_deck(self):
+        template = os.path.join(DIRECTORY, "bdf_files", "bar25.bdf")
+        self.compare(template, [("PROD", str(i), 3, 0.5 * i) \
+                                for i in range(1, 26)], {})
+
+    def test_missing_card(self):
+        patcher = TemplatePatcher(self.write(TEMPLATE))
+        maker = NastranMaker([])
+        maker.set("PROD", "14", 3, 1.)
+        self.assertRaises(RuntimeError, patcher.write,
+                          os.path.join(self.tmpdir, "out.bdf"), maker,
+                          {"*n": 1, "area": 2.5, "youngs": 3.0e7})
+        patcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
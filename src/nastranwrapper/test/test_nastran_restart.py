@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nastranwrapper.nastran_deck import BulkDeck
+from nastranwrapper.nastran_maker import NastranMaker
+from nastranwrapper.nastran_superelement import superelement_map, \
+     changed_superelements
+from nastranwrapper.nastran_restart import RestartDatabase, template_key, \
+     sorted_echo_deck, parse_sorted_echo, delete_entries, restart_deck, \
+     changed_cards
+
+# laid out the way ECHO = SORT prints the bulk data
+ECHO = """
+1    SOME TITLE                                                  AUGUST  13, 2012  MSC.NASTRAN   PAGE     5
+0
+                                        S O R T E D   B U L K   D A T A   E C H O
+                 ENTRY
+                 COUNT        .   1  ..   2  ..   3  ..   4  ..   5  ..   6  ..   7  ..   8  ..   9  ..  10  .
+                    1-        CROD    1       1       1       2
+                    2-        GRID    1               0.      0.      0.
+                    3-        GRID    2               1.      0.      0.
+                    4-        PBAR*   1               1               40.             333.333         *1
+                    5-        *1      53.3333         259.865
+                    6-        PROD    11      1       2.5
+                              ENDDATA
+""".split("\n")
+
+DECK = """SOL 101
+CEND
+TITLE = SOME TITLE
+ECHO = NONE
+SUBCASE 1
+   LOAD = 1
+BEGIN BULK
+PROD    11      1       2.5
+ENDDATA""".split("\n")
+
+class TestRestart(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_echo(self):
+        self.assertEqual(parse_sorted_echo(ECHO),
+                         {(0, "CROD", "1"): (1, 1), (0, "GRID", "1"): (2, 2),
+                          (0, "GRID", "2"): (3, 3), (0, "PBAR", "1"): (4, 5),
+                          (0, "PROD", "11"): (6, 6)})
+        self.assertEqual(parse_sorted_echo(DECK), {})
+
+        # every partition has its own echo
+        rows = [line.replace("4-", "1-").replace("5-", "2-") \
+                .replace("6-", "3-") for line in ECHO[9:]]
+        ranges = parse_sorted_echo(ECHO + ECHO[:6] + rows, [0, 3])
+        self.assertEqual(ranges[(0, "PBAR", "1")], (4, 5))
+        self.assertEqual(ranges[(3, "PBAR", "1")], (1, 2))
+        self.assertEqual(ranges[(3, "PROD", "11")], (3, 3))
+        self.assertRaises(RuntimeError, parse_sorted_echo, ECHO + ECHO)
+
+    def test_sorted_echo_deck(self):
+        lines = sorted_echo_deck(DECK)
+        self.assertEqual(lines[3], "ECHO = SORT")
+        self.assertEqual(len(lines), len(DECK))
+        lines = sorted_echo_deck(DECK[:3] + DECK[4:])
+        self.assertEqual(lines[2], "ECHO = SORT")
+
+    def test_restart_deck(self):
+        self.assertEqual(delete_entries([(6, 6), (1, 1), (4, 5), (2, 2)]),
+                         ["/       1       2", "/       4       6"])
+        lines = restart_deck(DECK[:-2], "/db/master.MASTER",
+                             {0: (["/       6       6"],
+                                  ["PROD    11      1       3.5"]),
+                              3: (["/       1       2"], [])})
+        self.assertEqual(lines[:2], ["RESTART VERSION=1,KEEP",
+                                     "ASSIGN MASTER='/db/master.MASTER'"])
+        self.assertEqual(lines[-6:], ["BEGIN BULK", "/       6       6",
+                                      "PROD    11      1       3.5",
+                                      "BEGIN SUPER=3", "/       1       2",
+                                      "ENDDATA"])
+
+    def test_database(self):
+        template = os.path.join(self.tmpdir, "template.bdf")
+        fh = open(template, "w")
+        fh.write("\n".join(DECK))
+        fh.close()
+        key = template_key(template)
+        fh = open(template, "a")
+        fh.write("\n")
+        fh.close()
+        self.assertNotEqual(template_key(template), key)
+
+        database = RestartDatabase(os.path.join(self.tmpdir, "restart"), key)
+        self.assertFalse(database.ready())
+        database.lock()
+        try:
+            open(database.master, "w").close()
+            database.save_values({("PROD", "11"): ["PROD", "11", "1", "3."]})
+            database.save_index({(0, "PROD", "11"): (6, 6)})
+        finally:
+            database.unlock()
+        database.unlock()
+
+        # another process would find the same database
+        other = RestartDatabase(os.path.join(self.tmpdir, "restart"), key)
+        self.assertTrue(other.ready())
+        self.assertEqual(other.load_index(), {(0, "PROD", "11"): (6, 6)})
+        self.assertEqual(other.load_values(),
+                         {("PROD", "11"): ["PROD", "11", "1", "3."]})
+        other.remove()
+        self.assertFalse(database.ready())
+
+    def test_changed_cards(self):
+        template = os.path.join(self.tmpdir, "template.bdf")
+        lines = DECK[:-1] + ["BEGIN SUPER = 1", "PROD    21      1       2.5",
+                             "BEGIN SUPER = 2", "PROD    31      1       2.5",
+                             "ENDDATA"]
+        fh = open(template, "w")
+        fh.write("\n".join(lines) + "\n")
+        fh.close()
+        owners = superelement_map(lines)
+
+        deck = BulkDeck(template)
+        try:
+            # the baseline changed PROD 21
+            maker = NastranMaker([])
+            maker.set("PROD", 21, 3, 3.)
+            deck.apply(maker.names)
+            baseline = dict([((card.name, card.cid), deck.values(card)) \
+                             for card in deck.modified])
+
+            # PROD 21 keeps its baseline value, and PROD 11 is set to
+            # the value it has in the template
+            maker = NastranMaker([])
+            maker.set("PROD", 11, 3, 2.50)
+            maker.set("PROD", 21, 3, "3.0")
+            maker.set("PROD", 31, 3, 4.)
+            deck.apply(maker.names)
+            self.assertEqual(len(deck.modified), 3)
+            changed = changed_cards(deck, baseline)
+            self.assertEqual([(card.name, card.cid) for card in changed],
+                             [("PROD", "31")])
+            self.assertEqual(changed_superelements(owners,
+                [(card.name, card.cid) for card in changed]), set([2]))
+
+            # and PROD 21 back at the template's value is a change
+            maker = NastranMaker([])
+            maker.set("PROD", 21, 3, 2.5)
+            deck.apply(maker.names)
+            self.assertEqual([card.cid for card in changed_cards(deck,
+                                                                 baseline)],
+                             ["21"])
+        finally:
+            deck.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import math
+import unittest
+
+import numpy
+
+from nastranwrapper.nastran_results import von_mises, principal_stresses, \
+     max_shear, combined_stress, strain_energy_density, margin_of_safety, \
+     derived_value, ks_aggregate, pnorm_aggregate, aggregate_rows
+
+
+class TestResults(unittest.TestCase):
+
+    def test_von_mises(self):
+        # uniaxial, pure shear and a full state of stress
+        plane = numpy.array([[100., 0., 0.], [0., 0., 10.]])
+        self.assertTrue(numpy.allclose(von_mises(plane),
+                                       [100., 10. * math.sqrt(3.)]))
+        full = numpy.array([[1., 2., 3., 4., 5., 6.]])
+        expected = math.sqrt(.5 * (1. + 1. + 4.) + 3 * (16. + 25. + 36.))
+        self.assertTrue(numpy.allclose(von_mises(full), [expected]))
+        # subcases and elements at once
+        self.assertEqual(von_mises(numpy.zeros((4, 7, 3))).shape, (4, 7))
+        self.assertRaises(ValueError, von_mises, numpy.zeros((2, 4)))
+
+    def test_principal(self):
+        plane = numpy.array([[50., -50., 0.], [0., 0., 20.]])
+        self.assertTrue(numpy.allclose(principal_stresses(plane),
+                                       [[50., -50.], [20., -20.]]))
+        self.assertTrue(numpy.allclose(max_shear(plane), [50., 20.]))
+        full = numpy.array([[3., 1., 2., 0., 0., 0.]])
+        self.assertTrue(numpy.allclose(principal_stresses(full),
+                                       [[3., 2., 1.]]))
+        # the principal stresses of plane stress are the same either way
+        full = numpy.array([[30., -10., 0., 15., 0., 0.]])
+        principal = principal_stresses(full)[0]
+        self.assertTrue(numpy.allclose(sorted(principal),
+                                       sorted(list(principal_stresses(
+                                           [[30., -10., 15.]])[0]) + [0.])))
+
+    def test_combined(self):
+        # what the models computed one element at a time
+        stresses = numpy.array([[3., 4.], [-1., 0.]])
+        expected = [math.sqrt(.5 * (2 * ax * ax + 3 * tors * tors)) \
+                    for ax, tors in stresses]
+        self.assertTrue(numpy.allclose(combined_stress(stresses), expected))
+
+    def test_energy_and_margin(self):
+        self.assertTrue(numpy.allclose(
+            strain_energy_density([[2., 4.]], [[1., .5]]), [2.]))
+        self.assertRaises(ValueError, strain_energy_density, [1.], [1., 2.])
+        margins = margin_of_safety([-50., 25., 0.], 100., factor=2.)
+        self.assertTrue(numpy.allclose(margins[:2], [0., 1.]))
+        self.assertEqual(margins[2], numpy.inf)
+
+    def test_derived_value(self):
+        rows = [["3.0E+00", "4.0E+00"], ["-1.0", "0.0"], ["", ""]]
+        values = derived_value(rows, "combined_stress")
+        self.assertEqual(values.shape, (3,))
+        self.assertTrue(numpy.isnan(values[2]))
+        self.assertAlmostEqual(derived_value(rows, "combined_stress", "max"),
+                               math.sqrt(.5 * (18. + 48.)))
+        self.assertAlmostEqual(derived_value(rows, None, "maxabs", 6.), 1.)
+        self.assertEqual(derived_value(rows, lambda x: x.sum(axis=-1),
+                                       "sum"), 6.)
+        self.assertRaises(ValueError, derived_value, rows, "tresca")
+        self.assertRaises(ValueError, derived_value, rows, None, "median")
+
+    def check_gradient(self, function, values):
+        value, gradient = function(values)
+        for index in range(len(values)):
+            step = numpy.zeros(len(values))
+            step[index] = 1e-6
+            numeric = (function(values + step)[0] - \
+                       function(values - step)[0]) / 2e-6
+            self.assertAlmostEqual(gradient[index], numeric, 5)
+
+    def test_aggregates(self):
+        values = numpy.array([.2, -.5, .9, .85])
+        ks, gradient = ks_aggregate(values, 50.)
+        self.assertTrue(.9 <= ks <= .9 + math.log(4) / 50.)
+        self.assertAlmostEqual(gradient.sum(), 1.)
+        self.check_gradient(ks_aggregate, values)
+
+        # the largest magnitude is bounded, even with a negative one
+        norm, gradient = pnorm_aggregate(-values, 8.)
+        self.assertTrue(.9 <= norm <= .9 * 4 ** (1. / 8))
+        self.check_gradient(pnorm_aggregate, -values)
+        self.assertEqual(pnorm_aggregate(numpy.zeros(3))[0], 0.)
+
+        # a huge rho or p doesn't overflow
+        self.assertAlmostEqual(ks_aggregate(values * 1e3, 1e3)[0], 900., 2)
+        self.assertAlmostEqual(pnorm_aggregate(values * 1e3, 400.)[0],
+                               900., -1)
+
+        self.assertRaises(RuntimeError, ks_aggregate, [numpy.nan])
+
+    def test_aggregate_rows(self):
+        rows = [["100."], [""], ["-250."], ["50."]]
+        value, gradient = aggregate_rows(rows, "ks", 200.,
+                                         constraint_allowable=200.)
+        # the constraints are .25 - 1 = -.5, blank, 1.25 - 1 = .25, -.75
+        self.assertTrue(.25 <= value <= .25 + math.log(3) / 200.)
+        self.assertEqual(gradient[1], 0.)
+        # d(|s| / 200 - 1)/ds is negative for a compressive stress
+        self.assertTrue(gradient[2] < 0)
+        self.assertAlmostEqual(gradient[2], -1. / 200., 4)
+        self.assertRaises(ValueError, aggregate_rows, rows, "max")
+
+
+if __name__ == "__main__":
+    unittest.main()
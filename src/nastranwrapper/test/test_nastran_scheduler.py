@@ -0,0 +1,108 @@
+import os
+import time
+import shutil
+import threading
+import tempfile
+import unittest
+
+from nastranwrapper.nastran_scheduler import NastranScheduler, \
+     estimate_memory, estimate_deck_memory, affinity_prefix
+
+class TestNastranScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def scheduler(self, **kwargs):
+        return NastranScheduler(self.state_dir, cores=4, memory=1000,
+                                poll_interval=0.01, **kwargs)
+
+    def test_cores(self):
+        first = self.scheduler().reserve(3, 100)
+        self.assertEqual(len(first.cpus), 3)
+        self.assertRaises(RuntimeError, self.scheduler().reserve, 2, 100, 0.05)
+        second = self.scheduler().reserve(1, 100, 0.05)
+        self.assertTrue(set(second.cpus).isdisjoint(first.cpus))
+        self.scheduler().release(first)
+        self.scheduler().release(second)
+        self.assertEqual(len(self.scheduler().reserve(4, 100).cpus), 4)
+
+    def test_memory(self):
+        first = self.scheduler().reserve(1, 800)
+        self.assertRaises(RuntimeError, self.scheduler().reserve, 1, 300, 0.05)
+        small = self.scheduler().reserve(1, 200, 0.05)
+        self.scheduler().release(first)
+        self.scheduler().release(small)
+
+    def test_too_big(self):
+        # bigger than the machine: trimmed so it can run alone
+        reservation = self.scheduler().reserve(16, 5000)
+        self.assertEqual(len(reservation.cpus), 4)
+        self.assertEqual(reservation.memory, 1000)
+
+    def test_starvation(self):
+        first = self.scheduler().reserve(2, 100)
+        def wait_for_everything():
+            # never gets in, because ``first`` holds two cores
+            self.assertRaises(RuntimeError,
+                              self.scheduler(starvation_limit=0.).reserve,
+                              4, 100, 0.3)
+        waiter = threading.Thread(target=wait_for_everything)
+        waiter.start()
+        time.sleep(0.05)
+        # the big job has waited too long, nobody may overtake it
+        self.assertRaises(RuntimeError,
+                          self.scheduler(starvation_limit=0.).reserve,
+                          1, 100, 0.05)
+        # while normally small jobs are backfilled
+        self.scheduler().release(self.scheduler().reserve(1, 100, 0.05))
+        waiter.join()
+        self.scheduler().release(first)
+
+    def test_shared_scheduler(self):
+        # the threads of a process share one scheduler
+        scheduler = self.scheduler()
+        reservations = []
+        threads = [threading.Thread(target=lambda: reservations.append(
+                       scheduler.reserve(1, 100))) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set([reservation.ticket \
+                                  for reservation in reservations])), 4)
+        self.assertEqual(len(set([reservation.cpus[0] \
+                                  for reservation in reservations])), 4)
+
+        # a waiting job that fails leaves the queue
+        scheduler.poll_interval = "broken"
+        self.assertRaises(TypeError, scheduler.reserve, 1, 100)
+        self.assertEqual(scheduler._locked(lambda state: state["waiting"]),
+                         [])
+        for reservation in reservations:
+            scheduler.release(reservation)
+
+    def test_memory_estimate(self):
+        self.assertTrue(estimate_memory(10 ** 8, 10 ** 6) > \
+                        estimate_memory(10 ** 6, 10 ** 4))
+
+        filename = os.path.join(self.state_dir, "deck.bdf")
+        fh = open(filename, "w")
+        fh.write("BEGIN BULK\nGRID     1               0.      0.      0.\n" + \
+                 "GRID*   2\nGRID,3,,0.,0.,0.\nGRIDX\nENDDATA\n")
+        fh.close()
+        self.assertEqual(estimate_deck_memory(filename),
+                         estimate_memory(os.path.getsize(filename), 3))
+
+    def test_affinity_prefix(self):
+        self.assertEqual(affinity_prefix([]), [])
+        prefix = affinity_prefix([3, 1])
+        if prefix:
+            self.assertEqual(prefix[1:], ["-c", "1,3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nastranwrapper.nastran_scratch import ScratchPool
+
+class TestScratchPool(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.pool = ScratchPool(self.base_dir, 2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.base_dir)
+
+    def test_precreated(self):
+        self.assertEqual(len(os.listdir(self.base_dir)), 2)
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertTrue(first != second)
+        # the pool is empty now, so a new one gets made
+        self.pool.acquire()
+        self.assertEqual(len(os.listdir(self.base_dir)), 3)
+
+    def test_recycle(self):
+        directory = self.pool.acquire()
+        os.mkdir(os.path.join(directory, "sub"))
+        fh = open(os.path.join(directory, "input.out"), "w")
+        fh.write("output")
+        fh.close()
+
+        self.pool.release(directory)
+        self.pool.wait()
+
+        # it comes back empty
+        again = [self.pool.acquire() for i in range(2)]
+        self.assertTrue(directory in again)
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_overflow_deleted(self):
+        extra = [self.pool.acquire() for i in range(3)]
+        for directory in extra:
+            self.pool.release(directory)
+        self.pool.wait()
+        # only two are kept around
+        self.assertEqual(len(os.listdir(self.base_dir)), 2)
+
+    def test_close(self):
+        self.pool.close()
+        self.assertEqual(os.listdir(self.base_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
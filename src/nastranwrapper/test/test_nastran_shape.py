@@ -0,0 +1,86 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from nastranwrapper.nastran_deck import BulkDeck
+from nastranwrapper.nastran_maker import NastranMaker
+from nastranwrapper.nastran_shape import ShapeUpdate, shape_coordinates
+
+class TestShapeUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.base = numpy.array([[0., 0., 0.], [1., 0., 0.]])
+        self.basis = numpy.array([[[0., 1., 0.], [0., 2., 0.]],
+                                  [[0., 0., 1.], [0., 0., 0.]]])
+
+    def test_coordinates(self):
+        coordinates = shape_coordinates(self.base, self.basis, [.5, 2.])
+        self.assertEqual(coordinates.tolist(), [[0., .5, 2.], [1., 1., 0.]])
+        self.assertRaises(ValueError, shape_coordinates, self.base,
+                          self.basis, [1.])
+
+    def test_flat_basis(self):
+        shape = ShapeUpdate([1, 2], self.base, self.basis.reshape((2, 6)))
+        self.assertEqual(shape.coordinates([1., 0.]).tolist(),
+                         [[0., 1., 0.], [1., 2., 0.]])
+        self.assertRaises(ValueError, ShapeUpdate, [1], self.base,
+                          self.basis)
+
+    def test_short_and_long_grids(self):
+        text = ["GRID    1               0.      0.      0.",
+                "GRID*   2                               1.              " \
+                "0.              *G2",
+                "*G2     0."]
+        maker = NastranMaker(text)
+        shape = ShapeUpdate([1, 2], self.base, self.basis)
+        shape.apply(maker, [.5, 2.])
+        maker._output(10001)
+        # the continuation numbers depend on the order of the cards
+        text = [re.sub("[*]1000[12]", "*C", row).rstrip() \
+                for row in maker.text]
+        self.assertEqual(text,
+                         ["GRID*   1                               0.      " \
+                          "        .5              *C",
+                          "*C  2.",
+                          # X3 of a long card is on its continuation
+                          "GRID*   2                               1.      " \
+                          "        1.              *C",
+                          "*C  0."])
+
+    def test_many_grids(self):
+        # a batch of points is applied in one pass over the deck
+        count = 400
+        base = numpy.arange(count * 3, dtype=float).reshape((count, 3))
+        basis = numpy.ones((1, count, 3))
+        text = ["BEGIN BULK"] + \
+               ["GRID    %-8d        %-8s%-8s%-8s" % \
+                ((i + 1,) + tuple([str(value) for value in base[i]])) \
+                for i in range(count)] + ["ENDDATA"]
+        maker = NastranMaker(text)
+        shape = ShapeUpdate(range(1, count + 1), base, basis)
+        shape.apply(maker, [.25])
+        maker._output(10001)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "moved.bdf")
+            fh = open(filename, "w")
+            fh.write("\n".join(maker.text) + "\n")
+            fh.close()
+            deck = BulkDeck(filename)
+            try:
+                moved = numpy.array([map(float, deck.values(card)[3:6]) \
+                                     for card in deck.cards])
+            finally:
+                deck.close()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(moved.tolist(), (base + .25).tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import unittest
+import pkg_resources
+
+from nastranwrapper.nastran_sol200 import sol200_deck, design_cards, \
+     parse_sensitivities, field_position, displacement_response
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+# laid out the way DSAPRT(FORMATTED) prints the sensitivities
+SENSITIVITIES = """
+1                                                 AUGUST  13, 2012  MSC.NASTRAN   PAGE    12
+0
+
+              D E S I G N   S E N S I T I V I T Y   M A T R I X
+
+     RESPONSE      DESVAR       DERIVATIVE    DESVAR       DERIVATIVE
+     90001         90001       -1.234567E-02  90002        4.5D-3
+                   90003        2.5-1
+     90002         90001        1.000000E+00
+1                                                 AUGUST  13, 2012  MSC.NASTRAN   PAGE    13
+""".split("\n")
+
+
+class TestSol200(unittest.TestCase):
+
+    def lines(self, name):
+        fh = open(os.path.join(DIRECTORY, "bdf_files", name))
+        lines = fh.read().split("\n")
+        fh.close()
+        return lines
+
+    def test_deck(self):
+        lines = self.lines("bar10.bdf")
+        deck = sol200_deck(lines)
+        self.assertTrue("SOL 200" in deck)
+        self.assertFalse("SOL 101" in deck)
+        case_control = deck[deck.index("CEND") + 1:deck.index("BEGIN BULK")]
+        self.assertEqual(case_control[:4],
+                         ["ANALYSIS = STATICS", "DESOBJ = 90001",
+                          "DESSUB = 90001",
+                          "DSAPRT(FORMATTED,NOEXPORT) = ALL"])
+        end = [index for index, line in enumerate(deck) \
+               if line.startswith("ENDDATA")][0]
+        self.assertEqual(deck[end - 2:end],
+                         ["DOPTPRM,DESMAX,0", "INCLUDE 'sol200.bdf'"])
+        self.assertEqual(len(deck), len(lines) + 6)
+
+        lines[lines.index("SOL 101")] = "SOL 106"
+        self.assertRaises(RuntimeError, sol200_deck, lines)
+
+    def test_design_cards(self):
+        response = displacement_response({"POINT ID.": "3"}, ["T2"])
+        self.assertEqual(response, {"RTYPE": "DISP", "ATTA": 2,
+                                    "ATTI": ["3"]})
+        self.assertRaises(RuntimeError, displacement_response,
+                          {"POINT ID.": "3"}, ["T2", "T3"])
+
+        rows = design_cards([(2.5, .1, 10., "PROD", "11", field_position(3))],
+                            [response])
+        self.assertEqual(rows, ["DESVAR,90001,V0,2.5,.1,10.",
+                                "DVPREL1,90001,PROD,11,4,,,0.,,+",
+                                "+,90001,1.",
+                                "DRESP1,90001,R0,DISP,,,2,,3",
+                                "DCONSTR,90001,90001,-1.+20,1.+20"])
+
+    def test_field_position(self):
+        # short fields are counted with the name and continuations
+        self.assertEqual(field_position(3), 4)
+        self.assertEqual(field_position(12), 13)
+        # long: the 2nd data field of the 2nd row is the 6th data field
+        self.assertEqual(field_position(8, True), 7)
+        # and the 1st data field of the 3rd row the 1st of the 2nd row
+        self.assertEqual(field_position(13, True), 12)
+
+    def test_parse(self):
+        self.assertEqual(parse_sensitivities(SENSITIVITIES),
+                         {(90001, 90001): -1.234567e-2,
+                          (90001, 90002): 4.5e-3,
+                          (90001, 90003): .25,
+                          (90002, 90001): 1.})
+        self.assertEqual(parse_sensitivities(["nothing to see"]), {})
+
+        # the numbers after the table aren't sensitivities
+        after = SENSITIVITIES[:-2] + \
+                ["                 S T R E S S E S   I N   R O D",
+                 "     90003         90001        5.0"] + \
+                SENSITIVITIES[-2:] + \
+                ["     90004         90001        6.0"]
+        self.assertEqual(sorted(parse_sensitivities(after)),
+                         [(90001, 90001), (90001, 90002), (90001, 90003),
+                          (90002, 90001)])
+        self.assertEqual(len(parse_sensitivities(
+            SENSITIVITIES + ["     90004         90001        6.0"])), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from nastranwrapper.nastran_superelement import superelement_map, \
+     superelement_partitions, changed_superelements, partial_case_control, \
+     submitted_superelements
+from nastranwrapper.nastran_restart import restart_deck, delete_entries
+
+TEMPLATE = """SOL 101
+CEND
+SEALL = ALL
+SUBCASE 1
+   LOAD = 1
+BEGIN BULK
+GRID    1               0.      0.      0.
+PROD    1       1       2.5
+BEGIN SUPER=3
+CROD    10      11      1       2
+PROD    11      1       2.5
+PBAR    12      1       40.     333.333                                 +
++       5.      2.
+BEGIN SUPER=7
+PROD    11      1       1.5
+PROD    21      1       1.5
+ENDDATA""".split("\n")
+
+
+def fake_solver(lines):
+    """Stands in for Nastran: says which superelements the run
+    processes again and which partitions of the bulk data it gets."""
+    partitions = [int(line.split("=")[1]) for line in lines \
+                  if line.startswith("BEGIN SUPER")]
+    return submitted_superelements(lines), partitions
+
+
+class TestSuperelement(unittest.TestCase):
+
+    def test_map(self):
+        owners = superelement_map(TEMPLATE)
+        self.assertEqual(owners[("GRID", "1")], set([0]))
+        self.assertEqual(owners[("PBAR", "12")], set([3]))
+        self.assertEqual(owners[("PROD", "11")], set([3, 7]))
+        self.assertEqual(len(owners), 6)
+        self.assertEqual(superelement_partitions(TEMPLATE), [0, 3, 7])
+
+        self.assertEqual(changed_superelements(owners, [("PBAR", 12),
+                                                        ("PROD", 21)]),
+                         set([3, 7]))
+        self.assertRaises(RuntimeError, changed_superelements, owners,
+                          [("PROD", 11)])
+        self.assertRaises(RuntimeError, changed_superelements, owners,
+                          [("PROD", 99)])
+
+    def test_submitted(self):
+        owners = superelement_map(TEMPLATE)
+        head = TEMPLATE[:TEMPLATE.index("BEGIN BULK") + 1]
+        self.assertEqual(fake_solver(head), (None, []))
+
+        # a change in superelement 7 only
+        changed = changed_superelements(owners, [("PROD", 21)])
+        deck = restart_deck(partial_case_control(head, changed),
+                            "master.MASTER",
+                            {7: (delete_entries([(2, 2)]),
+                                 ["PROD    21      1       1.75"])})
+        self.assertEqual(fake_solver(deck), (set([0, 7]), [7]))
+        self.assertTrue("$ SEALL = ALL" in deck)
+
+        # residual only
+        deck = partial_case_control(head, set())
+        self.assertEqual(fake_solver(deck), (set([0]), []))
+
+        head = partial_case_control(head, [3])
+        self.assertRaises(RuntimeError, partial_case_control, head, [3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import random
+import unittest
+
+import numpy
+
+from nastranwrapper.nastran_util import linked_values, format_fields, \
+     parse_reals
+
+class TestLinkedValues(unittest.TestCase):
+
+    def test_plain(self):
+        values = linked_values([[1., 2.], [3., 4.]])
+        self.assertEqual(values.tolist(), [1., 2., 3., 4.])
+
+    def test_linking_and_offset(self):
+        linking = numpy.array([[1., 0.], [.5, .5], [0., 2.]])
+        values = linked_values([2., 4.], linking, 1.)
+        self.assertEqual(values.tolist(), [3., 4., 9.])
+        values = linked_values([2., 4.], linking, [0., 1., 2.])
+        self.assertEqual(values.tolist(), [2., 4., 10.])
+
+    def test_sparse_linking(self):
+        try:
+            from scipy import sparse
+        except ImportError:
+            return
+        linking = sparse.csr_matrix(numpy.array([[1., 0.], [0., 3.]]))
+        self.assertEqual(linked_values([2., 4.], linking).tolist(),
+                         [2., 12.])
+
+    def test_wrong_shape(self):
+        self.assertRaises(ValueError, linked_values, [1., 2., 3.],
+                          numpy.ones((2, 2)))
+
+
+class TestFormatFields(unittest.TestCase):
+
+    def test_examples(self):
+        self.assertEqual(format_fields([1.234e-5, .5, 123456789., -.001,
+                                        1e20, 0., 2., 9.9999999, -1.5e-100,
+                                        1 / 3.]).tolist(),
+                         ["1.234-5", ".5", "1.2346+8", "-.001", "1.+20",
+                          "0.", "2.", "10.", "-1.5-100", ".3333333"])
+        self.assertEqual(format_fields([123456789012345., -1 / 3.],
+                                       16).tolist(),
+                         ["123456789012345.", "-.33333333333333"])
+        self.assertEqual(format_fields(numpy.array([[3, 40]])).tolist(),
+                         [["3", "40"]])
+
+    def test_carry(self):
+        self.assertEqual(format_fields([9999999.9, 9999999.6, -999999.99,
+                                        -999999.6]).tolist(),
+                         ["1.+7", "1.+7", "-1.+6", "-1.+6"])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, format_fields, [123456789])
+        self.assertRaises(ValueError, format_fields, [1., numpy.inf])
+        self.assertRaises(ValueError, format_fields, [numpy.nan], 16)
+
+    def round_trip(self, width, tolerance):
+        random.seed(width)
+        values = numpy.array([random.choice([-1, 1]) * \
+                              10 ** random.uniform(-99, 99) \
+                              for i in range(2000)] + [0.] + \
+                             # where rounding carries into one more digit
+                             [sign * 10 ** power * (1 - 10 ** -digits) \
+                              for sign in (-1, 1) \
+                              for power in range(-3, 18) \
+                              for digits in (7, 8, 9, 15, 16, 17)] + \
+                             [9999999.9, 9999999.6, -999999.99, -999999.6,
+                              999999999999999.9, -99999999999999.99])
+        strings = format_fields(values, width)
+        for string in strings:
+            self.assertTrue(len(string) <= width)
+            # a real has to have a dot for Nastran
+            self.assertTrue("." in string)
+        parsed = parse_reals(strings)
+        error = numpy.abs(parsed - values) / numpy.maximum(
+            numpy.abs(values), 1e-300)
+        self.assertTrue(error.max() <= tolerance)
+
+    def test_round_trip(self):
+        # at least 3 and 11 significant digits, even with a sign and a
+        # two digit exponent
+        self.round_trip(8, 5e-3)
+        self.round_trip(16, 5e-11)
+
+    def test_significant_digits(self):
+        # whichever of the fixed point and exponent forms keeps more
+        self.assertEqual(format_fields([2 / 3e-7, 123456.789, 1e-3 / 7,
+                                        -1e-3 / 7, .0123456789]).tolist(),
+                         ["6666667.", "123456.8", "1.4286-4", "-1.429-4",
+                          ".0123457"])
+
+
+class TestParseReals(unittest.TestCase):
+
+    def test_forms(self):
+        parsed = parse_reals(["1.234-5", " .5", "5.", "1.5D-3", "-2.5E+2",
+                              "1.+20", "-1-3", "1.2 3", "7"])
+        self.assertEqual(parsed.tolist(), [1.234e-5, .5, 5., 1.5e-3, -250.,
+                                           1e20, -1e-3, 1.23, 7.])
+
+    def test_blank(self):
+        self.assertTrue(numpy.isnan(parse_reals(["", "1."])[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pkg_resources
+
+from nastranwrapper.nastran_deck import BulkDeck, SHORT, LONG
+from nastranwrapper.nastran_maker import NastranMaker
+from nastranwrapper.nastran_validator import DeckValidator, check_rows
+
+DIRECTORY = pkg_resources.resource_filename('nastranwrapper', 'test')
+
+GOOD = """BEGIN BULK
+GRID    1               0.      0.      0.
+GRID    2               1.      0.      0.
+GRID,3,,1.,1.,0.
+CROD    1       10      1       2
+CTRIA3  2       20      1       2       3
+PROD    10      5       1.
+PSHELL  20      5       .1      5
+MAT1    5       3.+7            .3
+ENDDATA
+"""
+
+BAD = """BEGIN BULK
+GRID    1               0.      0.      0.
+GRID    1               1.      0.      0.
+GRID    2               1.      0.      0.
+CROD    1       10      1       2
+CROD    2       11      1       2
+PROD    10      6       1. 5
+PBAR     1       5      40.     333.333 53.3333 259.865                 +      A
++      B5.      2.      -5.     2.      -5.     -2.     5.      -2.
+MAT1    5       3.+7            .3
+
++      C5.
+ENDDATA
+"""
+
+class TestDeckValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def deck(self, text):
+        filename = os.path.join(self.tmpdir, "input.bdf")
+        fh = open(filename, "w")
+        fh.write(text)
+        fh.close()
+        return BulkDeck(filename)
+
+    def test_good(self):
+        deck = self.deck(GOOD)
+        self.assertEqual(DeckValidator(deck).validate(), [])
+        deck.close()
+
+    def test_real_deck(self):
+        deck = BulkDeck(os.path.join(DIRECTORY, "bdf_files", "bar25.bdf"))
+        self.assertEqual(DeckValidator(deck).validate(), [])
+        deck.close()
+
+    def test_bad(self):
+        deck = self.deck(BAD)
+        problems = DeckValidator(deck).validate()
+        deck.close()
+        self.assertEqual(problems, [
+            "GRID 1: the id is used by another grid card",
+            "The continuation at byte " + str(BAD.index("+      C5.")) + \
+            " doesn't follow a card",
+            "CROD 2 refers to property 11, which isn't there",
+            "PROD 10: `1. 5` has blanks in it",
+            "PROD 10 refers to material 6, which isn't there",
+            "PBAR 1: the continuation `+A` is followed by `+B`"])
+
+    def test_includes(self):
+        # the grids and the properties are in INCLUDEd files, the way
+        # nastran_include_base writes a run
+        lines = GOOD.split("\n")
+        for name, rows in [("base.bdf", lines[1:4] + \
+                            ["INCLUDE 'sub/materials.bdf'"]),
+                           ("design.bdf", lines[6:8]),
+                           (os.path.join("sub", "materials.bdf"),
+                            lines[8:9] + ["PROD    10      7       1."])]:
+            filename = os.path.join(self.tmpdir, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.mkdir(os.path.dirname(filename))
+            fh = open(filename, "w")
+            fh.write("\n".join(rows) + "\n")
+            fh.close()
+        deck = self.deck("BEGIN BULK\nINCLUDE 'base.bdf'\n" + \
+                         "\n".join(lines[4:6]) + \
+                         "\ninclude design.bdf\nENDDATA\n")
+        validator = DeckValidator(deck)
+        # the cards of the INCLUDEd files are checked too
+        where = "PROD 10 of " + os.path.join(self.tmpdir, "sub",
+                                             "materials.bdf")
+        self.assertEqual(validator.validate(), [
+            where + ": the id is used by another property card",
+            where + " refers to material 7, which isn't there"])
+        validator.close()
+        deck.close()
+
+        # an INCLUDE that isn't there could have anything in it
+        deck = self.deck("BEGIN BULK\nINCLUDE 'nowhere.bdf'\n" + \
+                         "\n".join(lines[4:6]) + "\nENDDATA\n")
+        validator = DeckValidator(deck)
+        self.assertEqual(validator.missing, ["nowhere.bdf"])
+        self.assertEqual(validator.validate(), [])
+        validator.close()
+        deck.close()
+
+    def test_changed_cards(self):
+        deck = self.deck(GOOD)
+        validator = DeckValidator(deck)
+        maker = NastranMaker([])
+        maker.set("CTRIA3", "2", 5, 4)
+        maker.set("PSHELL", "20", 2, 5)
+        deck.write(os.path.join(self.tmpdir, "run.bdf"), maker)
+        # only the changed cards are looked at
+        self.assertEqual(validator.validate(deck.modified),
+                         ["CTRIA3 2 refers to grid 4, which isn't there"])
+
+        maker = NastranMaker([])
+        maker.set("GRID", "3", 1, 2)
+        deck.write(os.path.join(self.tmpdir, "run.bdf"), maker)
+        self.assertEqual(validator.validate(deck.modified),
+                         ["GRID 3: the new id 2 is used by another " + \
+                          "grid card"])
+        deck.close()
+
+    def test_rows(self):
+        self.assertEqual(check_rows(["PROD    1       5       1.234567890"],
+                                    SHORT), [])
+        # a value that spilled over into the next field
+        self.assertEqual(check_rows(["PROD    1       5       " \
+                                    "1.2345678 2."], SHORT, "PROD 1"),
+                         ["PROD 1: `8 2.` has blanks in it"])
+        row = "PROD*   1               5               1.234567890123"
+        self.assertEqual(check_rows([row.ljust(72) + "A1", "A1"], LONG,
+                                    "PROD 1"),
+                         ["PROD 1: the continuation `A1` should start " + \
+                          "with + or *"])
+
+
+if __name__ == "__main__":
+    unittest.main()